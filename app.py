@@ -1,18 +1,64 @@
+import dataclasses
+import functools
+import html
+import json
 import os
 import random
+import re
+import secrets
 import time
 from dataclasses import dataclass
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 
 import streamlit as st
 
+from formagent.providers import (
+    ADAPTERS,
+    PROVIDER_ENV_KEYS,
+    ChatRequest,
+    ChatResult,
+    ProviderError,
+    ProviderPool,
+    ProviderSettings,
+    provider_for_model,
+)
+from formagent.cache import ResponseCache, cache_key
+from formagent.config import data_dir
+from formagent.dag import RERUN, STALE, UNCHANGED, StepRecipe, dependents, rerun_dirty, stale_steps
+from formagent.executor import (
+    DEFAULT_REVIEW_AGENTS,
+    DIFF_AGENT,
+    MAP_REDUCE_PROFILES,
+    MEMO_AGENT,
+    SUBMISSION_POINTER,
+    MapReduceProfile,
+    StepResult,
+    map_reduce,
+    needs_chunking,
+    run_diff,
+    run_review,
+    submission_context,
+)
+from formagent.form_extract import extract_structure
+from formagent.forms import FormRenderer, SpecError, compile_layout, iter_records, jspdf_source, parse_spec, python_source, render_batch, zip_files
+from formagent.highlight import CORAL, Highlighter, parse_keywords
+from formagent.notes import MAGIC_AGENTS, NOTE_AGENT, NoteKnowledge, organize_note, run_magics
+from formagent.pdf_ingest import PageCache, iter_pages, page_count, store_upload
+from formagent.registry import AgentRegistry, RegistryLoader, fill_placeholders
+from formagent.retrieval import RETRIEVAL_TOKENS, SectionIndex, narrow
+from formagent.routing import PREFERENCES, Router, RoutingPolicy
+from formagent.run_store import RunStore
+from formagent.tracing import TRACER, Span, activate, breakdown, deactivate, depth, end_span, span, start_span, to_otlp
+from formagent.usage import GROUP_KEYS, UsageLedger, cheapest_models, count_tokens, estimate_request, ledger_from_steps
+from formagent.validation import RuleResult, ValidationStats, Validator, failures, retry_feedback
+
 
 # =========================
 # Page / App Bootstrap
 # =========================
 st.set_page_config(
     page_title="FormAgent AI — WOW UI",
-    page_icon="🧩",
+    page_icon=":material/extension:",  # an emoji icon makes Streamlit load its emoji table on every cold start
     layout="wide",
     initial_sidebar_state="expanded",
 )
@@ -432,6 +478,25 @@ PAINTER_STYLES: Dict[str, PainterStyle] = {
 STYLE_NAMES: List[str] = list(PAINTER_STYLES.keys())
 
 
+SAMPLE_PDF_SPEC = """## pdf_spec
+title: Device Application Form
+fields:
+  - label: Device Name
+    name: device_name
+    type: text
+  - label: Submission Type
+    name: submission_type
+    type: dropdown
+    options: [New, Update, Replacement]
+  - label: Agree to Terms
+    name: agree_terms
+    type: checkbox
+  - label: Submission Date
+    name: submission_date
+    type: date
+"""
+
+
 # =========================
 # Session State Initialization
 # =========================
@@ -447,6 +512,31 @@ def init_state() -> None:
     ss.setdefault("pipeline_step", 0)
     ss.setdefault("pipeline_total_steps", 6)
     ss.setdefault("last_latency_ms", None)
+    ss.setdefault("last_ttft_ms", None)
+    ss.setdefault("last_tokens_per_s", None)
+    ss.setdefault("last_cache_read_tokens", None)  # input tokens the provider served from its prompt cache
+    ss.setdefault("last_error", "")
+    ss.setdefault("ingested_pdf", {})  # metadata only; page text lives in the page cache
+    ss.setdefault("run_id", "")  # persistent run in the run store ("" = start a new one on first step)
+    ss.setdefault("carry_output", "")  # edited output handed to the next step
+    ss.setdefault("fanout_results", [])  # [(agent_id, latency_ms | None, error)]
+    ss.setdefault("usage_ledger", UsageLedger())  # every call this session (incl. fan-out specialists)
+    ss.setdefault("auto_route", False)
+    ss.setdefault("retrieve_sections", True)  # specialist slots filled from the ingested PDF by retrieval
+    ss.setdefault("validate_output", True)
+    ss.setdefault("last_violations", [])  # rule failures of the latest step output
+    ss.setdefault("diff_summary", "")
+    ss.setdefault("dag_summary", "")  # outcome of the last incremental re-run
+    ss.setdefault("form_spec_text", SAMPLE_PDF_SPEC)
+    ss.setdefault("form_raw_text", "Device Name: ______\nSubmission Type: [New/Update]\nAgree to Terms: [ ]")
+    ss.setdefault("form_extract_note", "")  # outcome of the last Generate Structure
+    ss.setdefault("form_batch", {})  # summary + bundle path of the last batch render
+    ss.setdefault("form_preview", b"")  # blank PDF of the current spec
+    ss.setdefault("note_source", "")  # raw note that note_organized was produced from
+    ss.setdefault("note_organized", "")
+    ss.setdefault("note_knowledge", None)  # NoteKnowledge of the latest magics run
+    ss.setdefault("trace_session", secrets.token_hex(8))  # tags this session's rerun traces for the Dashboard
+    ss.setdefault("agent_output", "{\n  \"title\": \"Device Application Form\",\n  \"fields\": []\n}")
 
     # Provider keys in session (NEVER show env keys)
     ss.setdefault("session_keys", {
@@ -460,14 +550,38 @@ def init_state() -> None:
 init_state()
 
 
+# =========================
+# Tracing: one root span per script run
+# =========================
+_previous_run = st.session_state.get("rerun_span")
+if _previous_run is not None and not _previous_run.end_ns:  # a widget change stopped that run midway
+    _previous_run.set(interrupted=True)
+    end_span(_previous_run)
+rerun_span = start_span("streamlit.rerun", root=True, session=st.session_state.trace_session)
+st.session_state.rerun_span = rerun_span
+rerun_token = activate(rerun_span)
+
+
+def rerun() -> None:
+    """st.rerun(), closing this run's span first so it does not absorb the next run."""
+    end_span(rerun_span)
+    deactivate(rerun_token)
+    st.rerun()
+
+
 # =========================
 # WOW CSS Theming via CSS Variables
 # =========================
-def apply_wow_css(theme_mode: str, style: PainterStyle) -> None:
+@functools.lru_cache(maxsize=None)
+def build_wow_css(theme_mode: str, style_name: str) -> str:
     """
     Streamlit doesn't support perfect runtime theme swapping like a SPA,
     but we can achieve a strong WOW effect via CSS variables + custom classes.
+
+    Built once per (style, theme) per process (20 styles x 2 themes) and minified,
+    so reruns only pay a dict lookup and ship the smallest possible <style> block.
     """
+    style = PAINTER_STYLES[style_name]
     # Theme-aware overrides: when user selects dark, ensure backgrounds are darker.
     # Some painter styles are already dark; for light-only styles, we adjust gently.
     is_dark = (theme_mode == "dark")
@@ -605,23 +719,22 @@ def apply_wow_css(theme_mode: str, style: PainterStyle) -> None:
       }}
     </style>
     """
-    st.markdown(css, unsafe_allow_html=True)
+    return _minify_css(css)
 
 
-apply_wow_css(st.session_state.theme_mode, PAINTER_STYLES[st.session_state.style_name])
+def _minify_css(css: str) -> str:
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    return re.sub(r"\s*([{};:,>])\s*", r"\1", css).replace(";}", "}").strip()
+
+
+def apply_wow_css(theme_mode: str, style: PainterStyle) -> None:
+    st.markdown(build_wow_css(theme_mode, style.name), unsafe_allow_html=True)
 
 
 # =========================
 # Helpers: Provider Key Status
 # =========================
-PROVIDER_ENV_KEYS = {
-    "Gemini": "GEMINI_API_KEY",
-    "OpenAI": "OPENAI_API_KEY",
-    "Anthropic": "ANTHROPIC_API_KEY",
-    "Grok": "GROK_API_KEY",
-}
-
-
 def provider_status(env_key_name: str) -> str:
     """Return 'env', 'session', or 'missing'. Never return the actual key."""
     if os.getenv(env_key_name):
@@ -631,6 +744,173 @@ def provider_status(env_key_name: str) -> str:
     return "missing"
 
 
+def resolve_api_key(env_key_name: str) -> str:
+    """Env key first, then the session-only key. Used only to build requests."""
+    return os.getenv(env_key_name) or st.session_state.session_keys.get(env_key_name, "")
+
+
+@st.cache_resource(show_spinner=False)
+def get_provider_pool() -> ProviderPool:
+    """One pooled, keep-alive HTTP client per provider, shared across reruns and sessions."""
+    return ProviderPool(ProviderSettings.from_env())
+
+
+@st.cache_resource(show_spinner=False)
+def get_router() -> Router:
+    """Process-wide router: latency windows and provider circuits are shared by every session."""
+    return Router(RoutingPolicy.from_env())
+
+
+def session_router() -> Optional[Router]:
+    """Router with this session's policy overrides (sharing the global tracker), or None when routing is off."""
+    ss = st.session_state
+    if not ss.get("auto_route"):
+        return None
+    base = get_router()
+    policy = dataclasses.replace(
+        base.policy,
+        latency_slo_ms=int(ss.get("route_slo_ms", base.policy.latency_slo_ms)),
+        max_cost_usd=float(ss.get("route_max_cost", base.policy.max_cost_usd)),
+        prefer=ss.get("route_prefer", base.policy.prefer),
+    )
+    return Router(policy, tracker=base.tracker)
+
+
+@st.cache_resource(show_spinner=False)
+def get_validation_stats() -> ValidationStats:
+    """Per agent/rule pass rates across all sessions; shown on the Dashboard."""
+    return ValidationStats()
+
+
+def session_validator() -> Optional[Validator]:
+    if not st.session_state.get("validate_output"):
+        return None
+    return Validator(get_agents(), get_validation_stats())
+
+
+@st.cache_resource(show_spinner=False)
+def get_response_cache() -> ResponseCache:
+    """Process-wide response cache (memory LRU + SQLite); stats feed the Dashboard."""
+    return ResponseCache()
+
+
+def session_cache() -> Optional[ResponseCache]:
+    """The response cache, or None while the selected step's "Use response cache" box is off."""
+    ss = st.session_state
+    if not ss.get(f"use_cache_{ss.get('step_name')}", True):
+        return None
+    return get_response_cache()
+
+
+@st.cache_resource(show_spinner=False)
+def get_page_cache() -> PageCache:
+    """Per-page PDF text keyed by file hash; re-uploads of the same file skip extraction."""
+    return PageCache()
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_section_index(sha: str) -> SectionIndex:
+    """BM25 index over the ingested PDF's sections, built once per file hash."""
+    return SectionIndex.build(get_page_cache().text(sha))
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def get_highlighter(keywords: Tuple[Tuple[str, str], ...]) -> Highlighter:
+    """One automaton per keyword set; its block cache means a rerun re-scans only edited paragraphs."""
+    return Highlighter(dict(keywords))
+
+
+def ingested_values() -> Dict[str, str]:
+    """Placeholder values backed by the ingested PDF (loaded from the page cache on demand)."""
+    doc = st.session_state.ingested_pdf
+    if not doc:
+        return {}
+    return {"pdf_text": get_page_cache().text(doc["sha"])}
+
+
+@st.cache_resource(show_spinner=False)
+def get_agent_loader() -> RegistryLoader:
+    """agents.yaml is parsed once per process and re-parsed only when the file changes."""
+    return RegistryLoader()
+
+
+def get_agents() -> AgentRegistry:
+    return get_agent_loader().current()
+
+
+@st.cache_resource(show_spinner=False)
+def get_run_store() -> RunStore:
+    """Step inputs/outputs/timings persisted outside session state so runs survive resets and restarts."""
+    return RunStore()
+
+
+def record_run_step(agent_id: str, prompt: str, result: Optional[ChatResult], status: str = "completed",
+                    recipe: Optional[StepRecipe] = None) -> None:
+    """
+    Persist the step under the run's own next index (one past its last completed step;
+    pipeline_step is only the progress display and stops at the pipeline length). With a
+    recipe the step is recorded as consuming the previous step's output, so editing that
+    output later re-runs it (and whatever depends on it) incrementally.
+    """
+    ss = st.session_state
+    store = get_run_store()
+    if not ss.run_id:
+        ss.run_id = store.create_run(agent_id, ss.pipeline_total_steps)
+    index = store.next_step_index(ss.run_id)
+    deps = (index - 1,) if recipe is not None and index > 0 else ()
+    store.record_step(ss.run_id, index, agent_id, prompt, result, status=status,
+                      recipe=recipe.to_json() if deps else "", deps=deps)
+    if result is not None:
+        record_usage(index, agent_id, result, prompt)
+    store.update_run(ss.run_id, "awaiting_edit" if status == "completed" else status, index + 1 if status == "completed" else index)
+
+
+def record_usage(step: int, agent_id: str, result: ChatResult, prompt: str = "") -> None:
+    st.session_state.usage_ledger.record(step, agent_id, result, prompt)
+    # Routed calls are recorded by the router itself; results answered locally (e.g. an
+    # unchanged version diff) are not provider latencies and would drag p50/p95 toward 0.
+    if not result.cached and not st.session_state.auto_route and result.provider in ADAPTERS:
+        get_router().tracker.record(result.model, result.latency_ms)
+
+
+def current_api_keys() -> Dict[str, str]:
+    """Provider -> key snapshot; resolved on the script thread so worker threads never touch session state."""
+    return {provider: resolve_api_key(env_key) for provider, env_key in PROVIDER_ENV_KEYS.items()}
+
+
+TIMELINE_COLORS = {"provider": "#4c78a8", "queue": "#f58518", "ui": "#54a24b", "local": "#b279a2"}
+
+
+def timeline_html(trace_spans: List[Span]) -> str:
+    """
+    Gantt rows for one trace as plain HTML. Streamlit's chart elements import pandas and
+    pyarrow (about half a second on a cold process) just to serialize a few dozen bars.
+    """
+    start = min(sp.start_ns for sp in trace_spans)
+    total = max(max(sp.end_ns for sp in trace_spans) - start, 1)
+    levels = depth(trace_spans)
+    rows = []
+    for sp in trace_spans:
+        detail = " ".join(f"{k}={v}" for k, v in sp.attributes.items()) + (f" error={sp.error}" if sp.error else "")
+        left = (sp.start_ns - start) / total * 100
+        width = max((sp.end_ns - sp.start_ns) / total * 100, 0.3)
+        rows.append(
+            f"<div title='{html.escape(detail, quote=True)}' style='display:flex; align-items:center; gap:8px; font-size:0.82rem;'>"
+            f"<div style='width:34%; padding-left:{levels[sp.span_id] * 12}px; white-space:nowrap; overflow:hidden; text-overflow:ellipsis;'>"
+            f"{html.escape(sp.name)}{' ⚠' if sp.error else ''}</div>"
+            f"<div style='flex:1; position:relative; height:14px;'>"
+            f"<div style='position:absolute; left:{left:.2f}%; width:{width:.2f}%; height:100%; border-radius:3px; "
+            f"background:{TIMELINE_COLORS[sp.category]};'></div></div>"
+            f"<div style='width:72px; text-align:right; color:var(--wow-subtle);'>{sp.duration_ms:.0f} ms</div>"
+            f"</div>"
+        )
+    legend = " ".join(
+        f"<span style='display:inline-block; width:10px; height:10px; border-radius:2px; background:{color};'></span> {category}"
+        for category, color in TIMELINE_COLORS.items()
+    )
+    return f"<div class='wow-paper'>{''.join(rows)}<div style='margin-top:8px; font-size:0.82rem;'>{legend}</div></div>"
+
+
 def status_badge(status: str) -> str:
     if status == "env":
         return f"<span class='wow-pill wow-pill-strong'>{t('from_env')}</span>"
@@ -653,6 +933,7 @@ def jackpot_style() -> None:
 # =========================
 # UI: Sidebar Controls
 # =========================
+ui_span = start_span("ui.sidebar")
 with st.sidebar:
     st.markdown(f"### {t('ui_controls')}")
 
@@ -733,10 +1014,13 @@ with st.sidebar:
             if k not in ["session_keys"]:  # keep session keys unless user cleared
                 del st.session_state[k]
         init_state()
-        st.rerun()
+        rerun()
 
 
-# Re-apply CSS after sidebar changes (theme/lang/style)
+end_span(ui_span)
+
+# Emit CSS once per rerun, after the sidebar has settled theme/lang/style.
+ui_span = start_span("ui.chrome")
 apply_wow_css(st.session_state.theme_mode, PAINTER_STYLES[st.session_state.style_name])
 
 
@@ -767,6 +1051,9 @@ with top:
                 <span class="wow-pill">{t("pipeline_state")}: <b>{t(st.session_state.pipeline_status)}</b></span>
                 <span class="wow-pill">Step: <b>{st.session_state.pipeline_step}/{st.session_state.pipeline_total_steps}</b></span>
                 <span class="wow-pill">Latency: <b>{st.session_state.last_latency_ms if st.session_state.last_latency_ms is not None else "—"} ms</b></span>
+                <span class="wow-pill">TTFT: <b>{st.session_state.last_ttft_ms if st.session_state.last_ttft_ms is not None else "—"} ms</b></span>
+                <span class="wow-pill">Speed: <b>{st.session_state.last_tokens_per_s if st.session_state.last_tokens_per_s is not None else "—"} tok/s</b></span>
+                <span class="wow-pill">Prompt cache: <b>{f"{st.session_state.last_cache_read_tokens:,}" if st.session_state.last_cache_read_tokens is not None else "—"} tok</b></span>
               </div>
               <div style="margin-top:8px; color: var(--wow-subtle); font-size: 0.92rem;">
                 {t("demo_hint")}
@@ -783,9 +1070,11 @@ with top:
 # Main Workspaces
 # =========================
 tabs = st.tabs([t("forms_tab"), t("agent_tab"), t("note_tab"), t("dash_tab")])
+end_span(ui_span)
 
 
 # ---- Forms Workspace (Scaffold) ----
+ui_span = start_span("ui.forms")
 with tabs[0]:
     colA, colB = st.columns([1.05, 1.0], gap="large")
 
@@ -797,53 +1086,160 @@ with tabs[0]:
         st.write("")
         st.markdown("<div class='wow-card'><h4>Input</h4></div>", unsafe_allow_html=True)
         mode = st.radio("Mode", ["PDF Spec", "Raw Document"], horizontal=True)
-        sample_spec = """## pdf_spec
-title: Device Application Form
-fields:
-  - label: Device Name
-    name: device_name
-    type: text
-  - label: Submission Type
-    name: submission_type
-    type: dropdown
-    options: [New, Update, Replacement]
-  - label: Agree to Terms
-    name: agree_terms
-    type: checkbox
-  - label: Submission Date
-    name: submission_date
-    type: date
-"""
         if mode == "PDF Spec":
-            st.text_area("Paste PDF Spec (Markdown)", value=sample_spec, height=220)
+            st.session_state.form_spec_text = st.text_area("Paste PDF Spec (Markdown)", value=st.session_state.form_spec_text, height=220)
         else:
-            st.text_area("Paste Raw Form Text", value="Device Name: ______\nSubmission Type: [New/Update]\nAgree to Terms: [ ]", height=220)
+            st.session_state.form_raw_text = st.text_area("Paste Raw Form Text", value=st.session_state.form_raw_text, height=220)
+        try:
+            form_schema = parse_spec(st.session_state.form_spec_text)  # cached per spec text
+            form_layout = compile_layout(form_schema)
+        except SpecError as e:
+            form_schema = form_layout = None
+            st.error(f"PDF spec: {e}")
+
+        pdf_file = st.file_uploader("Source PDF (large submissions)", type=["pdf"])
+        if pdf_file is not None and st.session_state.ingested_pdf.get("file_id") != pdf_file.file_id:
+            pdf_sha, pdf_path = store_upload(pdf_file)
+            n_pages = page_count(pdf_path)
+            ingest_progress = st.progress(0.0, text=f"Extracting {n_pages} pages…")
+            ocr_pages = 0
+            unread_pages = 0
+            doc_tokens = 0
+            for page in iter_pages(pdf_path, pdf_sha, get_page_cache()):
+                ocr_pages += page.ocr and page.final
+                unread_pages += not page.final
+                doc_tokens += count_tokens(page.text)
+                if page.index % 10 == 0 or page.index == n_pages - 1:
+                    ingest_progress.progress((page.index + 1) / max(1, n_pages), text=f"Page {page.index + 1}/{n_pages}")
+            st.session_state.ingested_pdf = {
+                "file_id": pdf_file.file_id,
+                "name": pdf_file.name,
+                "sha": pdf_sha,
+                "pages": n_pages,
+                "ocr_pages": ocr_pages,
+                "unread_pages": unread_pages,
+                "tokens": doc_tokens,
+            }
+        if st.session_state.ingested_pdf:
+            doc = st.session_state.ingested_pdf
+            st.caption(
+                f"Ingested `{doc['name']}`: {doc['pages']} pages ({doc['ocr_pages']} via OCR) • "
+                f"≈{doc.get('tokens', 0):,} tokens • available to agents as `{{pdf_text}}`"
+            )
+            if doc.get("unread_pages"):
+                st.warning(f"{doc['unread_pages']} pages have no text layer and OCR is unavailable (pdftoppm/tesseract); "
+                           "they are retried on the next upload of this file.")
 
         cols = st.columns([1, 1, 1])
         with cols[0]:
-            st.button("Generate Structure (via Agents)", type="primary", use_container_width=True)
+            structure_clicked = st.button("Generate Structure (via Agents)", type="primary", use_container_width=True,
+                                          disabled=mode != "Raw Document" or not st.session_state.form_raw_text.strip(),
+                                          help="Rules classify blanks, [A/B] options, checkboxes and dates locally; "
+                                               "only lines they cannot classify go to form_structure_agent.")
         with cols[1]:
-            st.button("Download Python (.py)", use_container_width=True)
+            st.download_button("Download Python (.py)", data=python_source(form_layout) if form_layout else "",
+                               file_name="fill_form.py", mime="text/x-python", use_container_width=True, disabled=form_layout is None)
         with cols[2]:
-            st.button("Download jsPDF (.js)", use_container_width=True)
+            st.download_button("Download jsPDF (.js)", data=jspdf_source(form_layout) if form_layout else "",
+                               file_name="form_jspdf.js", mime="text/javascript", use_container_width=True, disabled=form_layout is None)
+
+        if structure_clicked:
+            extraction, structure_step = extract_structure(
+                get_provider_pool(), get_agents(), st.session_state.form_raw_text, current_api_keys(),
+                cache=get_response_cache(), router=session_router(), validator=session_validator(),
+            )
+            note = f"{extraction.local_fields} field(s) classified locally"
+            if structure_step is not None and structure_step.ok:
+                record_usage(st.session_state.pipeline_step, structure_step.agent_id, structure_step.result)
+                note += f", {len(extraction.fields) - extraction.local_fields} by {structure_step.agent_id}"
+            elif structure_step is not None:
+                st.session_state.last_error = structure_step.error
+                note += f"; {len(extraction.unresolved)} line(s) left unclassified"
+            if extraction.fields:
+                st.session_state.form_spec_text = extraction.schema.to_spec()
+            st.session_state.form_extract_note = note + "."
+            rerun()
+        if st.session_state.form_extract_note:
+            st.caption(st.session_state.form_extract_note + " The result is in the PDF Spec view.")
+
+        with st.expander("Batch fill (one form per record)"):
+            st.caption("CSV or JSON Lines; columns match field names or labels. Rendered locally, no model calls.")
+            records_file = st.file_uploader("Records", type=["csv", "jsonl", "ndjson"], key="form_records")
+            per_file = st.number_input("Forms per PDF file", min_value=50, max_value=5000, value=500, step=50)
+            if st.button("Render forms", use_container_width=True, disabled=form_layout is None or records_file is None):
+                out_dir = os.path.join(data_dir(), "forms", time.strftime("%Y%m%d-%H%M%S"))
+                render_progress = st.progress(0.0, text="Rendering…")
+                records_file.seek(0)
+                try:
+                    report = render_batch(
+                        form_layout,
+                        iter_records(records_file, records_file.name),
+                        out_dir,
+                        per_file=int(per_file),
+                        on_progress=lambda n: render_progress.progress(
+                            min(records_file.tell() / max(records_file.size, 1), 1.0), text=f"{n} forms rendered…"
+                        ),
+                    )
+                except ValueError as e:  # malformed JSON line / undecodable bytes
+                    st.error(f"Records file: {e}")
+                else:
+                    bundle = report.files[0] if len(report.files) == 1 else zip_files(report.files, os.path.join(out_dir, "forms.zip"))
+                    st.session_state.form_batch = {
+                        "path": bundle if report.records else "",
+                        "records": report.records,
+                        "pages": report.pages,
+                        "files": len(report.files),
+                        "seconds": round(report.seconds, 2),
+                        "problems": report.problems[:200],
+                    }
+                    rerun()
+            batch = st.session_state.form_batch
+            if batch:
+                st.caption(
+                    f"{batch['records']} forms • {batch['pages']} pages • {batch['files']} file(s) • {batch['seconds']} s"
+                    f" • {len(batch['problems'])} value problem(s)"
+                )
+                for rec_no, field_id, problem in batch["problems"][:20]:
+                    st.caption(f"⚠️ record #{rec_no} `{field_id}`: {problem}")
+                if batch["path"] and os.path.exists(batch["path"]):
+                    with open(batch["path"], "rb") as f:
+                        st.download_button("Download rendered forms", data=f.read(), file_name=os.path.basename(batch["path"]),
+                                           mime="application/zip" if batch["path"].endswith(".zip") else "application/pdf",
+                                           use_container_width=True)
 
     with colB:
-        st.markdown("<div class='wow-paper'><h3>Preview (Paper)</h3>"
-                    "<div style='color:var(--wow-subtle)'>"
-                    "This panel is styled as a document surface. In the full implementation, it renders the extracted form schema with edit controls."
-                    "</div>"
-                    "<hr style='border:none; border-top:1px solid var(--wow-paper-border); margin:12px 0;'>"
-                    "<div><b>Title:</b> Device Application Form</div>"
-                    "<div style='margin-top:10px; color:var(--wow-subtle)'>"
-                    "Fields: text / dropdown / checkbox / date (preserved from v1.1)."
-                    "</div>"
-                    "</div>",
-                    unsafe_allow_html=True)
+        if form_schema is None:
+            st.markdown("<div class='wow-paper'><h3>Preview (Paper)</h3>"
+                        "<div style='color:var(--wow-subtle)'>Fix the PDF spec to see the compiled form.</div></div>",
+                        unsafe_allow_html=True)
+        else:
+            field_rows = "".join(
+                f"<tr><td>{html.escape(f.label)}</td><td><code>{html.escape(f.name)}</code></td><td>{f.type}</td>"
+                f"<td>{html.escape(' / '.join(f.options))}</td></tr>"
+                for f in form_schema.fields
+            )
+            st.markdown("<div class='wow-paper'><h3>Preview (Paper)</h3>"
+                        f"<div><b>Title:</b> {html.escape(form_schema.title)}</div>"
+                        f"<div style='color:var(--wow-subtle)'>{len(form_schema.fields)} fields • {form_layout.pages} page(s) per form</div>"
+                        "<hr style='border:none; border-top:1px solid var(--wow-paper-border); margin:12px 0;'>"
+                        "<table style='width:100%; font-size:0.9rem;'><tr><th>Label</th><th>Name</th><th>Type</th><th>Options</th></tr>"
+                        f"{field_rows}</table>"
+                        "</div>",
+                        unsafe_allow_html=True)
+            if st.button("Build preview PDF", use_container_width=True):
+                st.session_state.form_preview = FormRenderer(form_layout).blank()
+            if st.session_state.form_preview:
+                st.download_button("Download preview PDF", data=st.session_state.form_preview, file_name="form_preview.pdf",
+                                   mime="application/pdf", use_container_width=True)
 
 
 # ---- Agent Studio (Scaffold with WOW per-step controls) ----
+end_span(ui_span)
+
+ui_span = start_span("ui.agent")  # ended early when this run executes a step
 with tabs[1]:
     left, right = st.columns([1.1, 1.0], gap="large")
+    pending_run = None
 
     with left:
         st.markdown(f"<div class='wow-card'><h3>{t('agent_scaffold_title')}</h3>"
@@ -852,46 +1248,344 @@ with tabs[1]:
         st.write("")
 
         st.markdown("<div class='wow-card'><h4>Step Controls (Example)</h4></div>", unsafe_allow_html=True)
-        step_name = st.selectbox("Agent Step", ["01_extract_structure", "02_validate_repair", "03_generate_fpdf2", "04_generate_jspdf"])
-        model = st.selectbox(
-            "Model",
-            [
-                "gpt-4o-mini",
-                "gpt-4.1-mini",
-                "gemini-2.5-flash",
-                "gemini-2.5-flash-lite",
-                "gemini-3-flash-preview",
-                "anthropic (select in full impl)",
-                "grok-4-fast-reasoning",
-                "grok-3-mini",
-            ],
+        agents = get_agents()
+        step_name = st.selectbox(
+            "Agent Step",
+            agents.ids(),
+            format_func=lambda a: f"{a} — {agents.get(a).name}",
+            key="step_name",
+        )
+        spec = agents.get(step_name)
+        model_choices = [
+            "gpt-4o-mini",
+            "gpt-4.1-mini",
+            "gemini-2.5-flash",
+            "gemini-2.5-flash-lite",
+            "gemini-3-flash-preview",
+            "claude-haiku-4-5",
+            "grok-4-fast-reasoning",
+            "grok-3-mini",
+        ]
+        if spec.model not in model_choices:
+            model_choices.append(spec.model)
+        model = st.selectbox("Model", model_choices, index=model_choices.index(spec.model))
+        max_tokens = st.number_input("max_tokens", min_value=256, max_value=20000, value=spec.max_tokens, step=256)
+        prompt = st.text_area("Prompt (editable)", value=spec.user_prompt_template, height=180)
+        if spec.placeholders:
+            st.caption("Placeholders: " + ", ".join(f"`{{{p}}}`" for p in spec.placeholders))
+        doc_tokens = st.session_state.ingested_pdf.get("tokens", 0) if "{pdf_text}" in prompt else 0
+        estimate = estimate_request(model, spec.system_prompt, prompt, int(max_tokens), doc_tokens)
+        cheapest = cheapest_models(spec.system_prompt, prompt, int(max_tokens), model_choices, doc_tokens)
+        max_cost = f"max ${estimate.max_cost_usd:.4f}" if estimate.max_cost_usd is not None else "price unknown"
+        st.caption(f"Estimate: ≈{estimate.input_tokens:,} input tokens • up to {estimate.max_output_tokens:,} output • {max_cost}")
+        if not estimate.fits:
+            st.caption("⚠️ Prompt + max_tokens exceed this model's context window (oversize `{pdf_text}` is map-reduced).")
+        if cheapest and cheapest[0].model != model:
+            st.caption(f"Cheapest fitting model: `{cheapest[0].model}` (max ${cheapest[0].max_cost_usd:.4f})")
+        use_cache = st.checkbox(
+            "Use response cache",
+            value=True,
+            key=f"use_cache_{step_name}",
+            help="Identical agent/model/prompt/settings return the stored answer instead of a new paid call.",
+        )
+        st.checkbox(
+            "Validate output (early abort + 1 retry)",
+            key="validate_output",
+            help="Check the agent's output_requirements / validation_rules while the output streams in.",
+        )
+        st.checkbox(
+            "Relevant sections only (retrieval)",
+            key="retrieve_sections",
+            help=f"Fill this agent's input slot from the ingested PDF with only its most relevant sections "
+                 f"(≈{RETRIEVAL_TOKENS:,} tokens) instead of the whole document.",
         )
-        max_tokens = st.number_input("max_tokens", min_value=256, max_value=20000, value=12000, step=256)
-        prompt = st.text_area("Prompt (editable)", value=f"You are agent {step_name}. Follow SKILL.md and return the required output.", height=180)
+        st.checkbox(
+            "Auto-route (policy + provider fallback)",
+            key="auto_route",
+            help="Pick the model per call from the policy below and fall back to another provider on timeouts/outages.",
+        )
+        if st.session_state.auto_route:
+            route_cols = st.columns([1, 1, 1])
+            with route_cols[0]:
+                st.number_input("p95 SLO (ms, 0 = off)", min_value=0, step=1000,
+                                value=get_router().policy.latency_slo_ms, key="route_slo_ms")
+            with route_cols[1]:
+                st.number_input("Max cost / call (USD, 0 = off)", min_value=0.0, step=0.01, format="%.4f",
+                                value=get_router().policy.max_cost_usd, key="route_max_cost")
+            with route_cols[2]:
+                st.selectbox("Prefer", PREFERENCES, index=PREFERENCES.index(get_router().policy.prefer), key="route_prefer")
+            route_plan = session_router().rank(
+                ChatRequest(model=model, user_prompt=prompt, system_prompt=spec.system_prompt, max_tokens=int(max_tokens)),
+                current_api_keys(),
+            )
+            st.caption("Route: " + (" → ".join(f"`{m}`" for m in route_plan) if route_plan else "no model with a key fits the policy"))
 
         run_cols = st.columns([1, 1, 1])
         with run_cols[0]:
             if st.button("Run Step", type="primary", use_container_width=True):
+                provider = provider_for_model(model)
+                api_key = resolve_api_key(PROVIDER_ENV_KEYS[provider])
+                if not api_key and not st.session_state.auto_route:
+                    st.session_state.last_error = f"{provider}: {t('missing')} {PROVIDER_ENV_KEYS[provider]}"
+                    st.session_state.pipeline_status = "error"
+                    rerun()
                 st.session_state.pipeline_status = "running"
-                st.session_state.pipeline_step = min(st.session_state.pipeline_step + 1, st.session_state.pipeline_total_steps)
-                start = time.time()
-                time.sleep(0.25)  # placeholder "work"
-                st.session_state.last_latency_ms = int((time.time() - start) * 1000)
-                st.session_state.pipeline_status = "awaiting_edit"
-                st.rerun()
+                # Executed in the Output Viewer column so tokens render as they stream in.
+                carry = st.session_state.carry_output
+                template = prompt  # the previous step's output slot still open
+                consumes_carry = bool(carry and spec.placeholders and spec.placeholders[0] != "pdf_text")
+                if consumes_carry:
+                    prompt = fill_placeholders(prompt, {spec.placeholders[0]: carry})
+                elif (st.session_state.retrieve_sections and st.session_state.ingested_pdf and spec.placeholders
+                      and spec.placeholders[0] != "pdf_text" and "{" + spec.placeholders[0] + "}" in prompt):
+                    # Specialist slots (e.g. {labeling_text}) get the relevant part of the submission;
+                    # {pdf_text} stays whole for agents that convert or summarize the full document.
+                    index = get_section_index(st.session_state.ingested_pdf["sha"])
+                    prompt = fill_placeholders(prompt, {spec.placeholders[0]: narrow(spec, index)})
+                run_req = ChatRequest(
+                    model=model,
+                    user_prompt=prompt,
+                    system_prompt=spec.system_prompt,
+                    max_tokens=int(max_tokens),
+                    temperature=spec.temperature,
+                )
+                doc_text = ingested_values().get("pdf_text", "") if "{pdf_text}" in prompt else ""
+                chunked = bool(doc_text) and needs_chunking(
+                    run_req, "pdf_text", doc_text, MAP_REDUCE_PROFILES.get(step_name, MapReduceProfile()).output_ratio
+                )
+                if doc_text and not chunked:
+                    # The document leads the user turn: re-runs of an agent over the same PDF
+                    # share one cacheable prompt prefix (system prompt + document).
+                    run_req = dataclasses.replace(run_req, user_prompt=fill_placeholders(prompt, {"pdf_text": SUBMISSION_POINTER}),
+                                                  context=submission_context(doc_text))
+                recipe = None
+                if consumes_carry and not chunked:  # a map-reduced document cannot be rebuilt from the template
+                    recipe_req = dataclasses.replace(
+                        run_req, user_prompt=fill_placeholders(template, {"pdf_text": SUBMISSION_POINTER}) if doc_text else template
+                    )
+                    recipe = StepRecipe(step_name, recipe_req, spec.placeholders[0])
+                pending_run = {
+                    "recipe": recipe,
+                    "req": run_req,
+                    "provider": provider,
+                    "api_key": api_key,
+                    "use_cache": use_cache,
+                    "chunk_text": doc_text if chunked else "",  # oversize input -> map-reduce
+                }
         with run_cols[1]:
             if st.button("Auto-run (scaffold)", use_container_width=True):
                 st.session_state.pipeline_status = "running"
                 st.session_state.pipeline_step = st.session_state.pipeline_total_steps
                 st.session_state.last_latency_ms = 420
                 st.session_state.pipeline_status = "completed"
-                st.rerun()
+                rerun()
         with run_cols[2]:
             if st.button("Reset Pipeline", use_container_width=True):
                 st.session_state.pipeline_status = "idle"
                 st.session_state.pipeline_step = 0
                 st.session_state.last_latency_ms = None
-                st.rerun()
+                st.session_state.last_ttft_ms = None
+                st.session_state.last_tokens_per_s = None
+                st.session_state.last_cache_read_tokens = None
+                st.session_state.last_error = ""
+                st.session_state.last_violations = []
+                st.session_state.run_id = ""
+                st.session_state.carry_output = ""
+                st.session_state.dag_summary = ""
+                rerun()
+
+        if st.session_state.last_error:
+            st.error(st.session_state.last_error)
+
+        st.write("")
+        with st.expander("Fan-out Review (parallel specialists → review_memo_builder)"):
+            review_ids = st.multiselect(
+                "Specialist agents",
+                [a for a in agents.ids() if a != MEMO_AGENT],
+                default=[a for a in DEFAULT_REVIEW_AGENTS if a in agents],
+            )
+            submission_text = st.text_area("Submission text", key="fanout_submission", height=160)
+            checklist_md = st.text_area("Checklist (optional, Markdown)", key="fanout_checklist", height=100)
+            retrieval_tokens = st.number_input(
+                "Input budget per specialist (tokens, 0 = whole submission)", min_value=0, step=1000, value=RETRIEVAL_TOKENS,
+                help="Longer submissions are indexed once; each specialist reads only its most relevant sections.",
+            )
+            if st.button("Run Fan-out Review", use_container_width=True, disabled=not review_ids):
+                st.session_state.pipeline_status = "running"
+                fanout_progress = st.progress(0.0)
+                fanout_done: List[StepResult] = []
+
+                def _on_specialist(r: StepResult) -> None:
+                    fanout_done.append(r)
+                    fanout_progress.progress(len(fanout_done) / len(review_ids), text=f"{len(fanout_done)}/{len(review_ids)} • {r.agent_id}")
+
+                start = time.time()
+                results, memo = run_review(
+                    get_provider_pool(),
+                    agents,
+                    review_ids,
+                    submission_text,
+                    current_api_keys(),
+                    checklist_markdown=checklist_md,
+                    on_result=_on_specialist,
+                    retrieval_tokens=int(retrieval_tokens),
+                    cache=session_cache(),
+                    router=session_router(),
+                    validator=session_validator(),
+                )
+                st.session_state.last_latency_ms = int((time.time() - start) * 1000)
+                for r in results:
+                    if r.ok:
+                        record_usage(st.session_state.pipeline_step, r.agent_id, r.result)
+                st.session_state.fanout_results = [
+                    (r.agent_id, r.result.latency_ms if r.ok else None, r.error) for r in results + [memo]
+                ]
+                record_run_step(MEMO_AGENT, submission_text, memo.result, status="completed" if memo.ok else "error")
+                st.session_state.last_violations = list(memo.result.violations) if memo.ok else []
+                if memo.ok:
+                    st.session_state.agent_output = memo.result.text
+                    st.session_state.pipeline_step = min(st.session_state.pipeline_step + 1, st.session_state.pipeline_total_steps)
+                    st.session_state.last_error = ""
+                    st.session_state.pipeline_status = "awaiting_edit"
+                else:
+                    st.session_state.last_error = memo.error
+                    st.session_state.pipeline_status = "error"
+                rerun()
+            for agent_id, latency, err in st.session_state.fanout_results:
+                st.caption(f"{'✅' if not err else '⚠️'} `{agent_id}` — {f'{latency} ms' if latency is not None else err}")
+
+        if DIFF_AGENT in agents:
+            with st.expander("Version Diff (local pre-diff → diff_agent)"):
+                diff_cols = st.columns(2)
+                with diff_cols[0]:
+                    diff_old = st.text_area("Old version", key="diff_old", height=160)
+                with diff_cols[1]:
+                    diff_new = st.text_area("New version", key="diff_new", height=160)
+                diff_context = st.slider("Context lines per change", 0, 10, 2)
+                if st.button("Run Version Diff", use_container_width=True, disabled=not (diff_old or diff_new)):
+                    st.session_state.pipeline_status = "running"
+                    with st.spinner("Diffing locally, then sending changed hunks to diff_agent…"):
+                        plan, diff_result = run_diff(
+                            get_provider_pool(),
+                            agents,
+                            diff_old,
+                            diff_new,
+                            current_api_keys(),
+                            cache=session_cache(),
+                            router=session_router(),
+                            context=diff_context,
+                        )
+                    st.session_state.diff_summary = (
+                        f"{len(plan.hunks)} changes • {plan.changed_lines} changed lines of "
+                        f"{plan.old_total_lines}/{plan.new_total_lines} • sent {plan.sent_ratio:.1%} of the text"
+                    )
+                    prompt_note = f"[diff] {len(plan.hunks)} hunks, context {diff_context}" if plan.reduced else "[diff] full texts"
+                    record_run_step(DIFF_AGENT, prompt_note, diff_result.result, status="completed" if diff_result.ok else "error")
+                    st.session_state.last_violations = list(diff_result.result.violations) if diff_result.ok else []
+                    if diff_result.ok:
+                        st.session_state.agent_output = diff_result.result.text
+                        st.session_state.last_latency_ms = diff_result.result.latency_ms
+                        st.session_state.pipeline_step = min(st.session_state.pipeline_step + 1, st.session_state.pipeline_total_steps)
+                        st.session_state.last_error = ""
+                        st.session_state.pipeline_status = "awaiting_edit"
+                    else:
+                        st.session_state.last_error = diff_result.error
+                        st.session_state.pipeline_status = "error"
+                    rerun()
+                if st.session_state.diff_summary:
+                    st.caption(st.session_state.diff_summary)
+
+        if st.session_state.run_id:
+            with st.expander("Edit an earlier step (incremental re-run)"):
+                store = get_run_store()
+                run_steps = store.steps(st.session_state.run_id)
+                done_steps = [s for s in run_steps if s.status == "completed"]
+                stale = set(stale_steps(run_steps))
+                if not done_steps:
+                    st.caption("No completed steps in this run yet.")
+                else:
+                    step_labels = {
+                        s.step_index: f"#{s.step_index + 1} {s.agent_id}{' • stale' if s.step_index in stale else ''}"
+                        for s in done_steps
+                    }
+                    edit_index = st.selectbox("Step", list(step_labels), format_func=step_labels.get, key="dag_step")
+                    edit_rec = next(s for s in done_steps if s.step_index == edit_index)
+                    downstream = dependents(run_steps, edit_index)
+                    st.caption(
+                        f"Consumed by {len(downstream)} later step(s)" if downstream
+                        else "No later step consumes this output (steps run without “Use edited output” are independent)."
+                    )
+                    # Keyed by the stored hash so the box reloads after a re-run replaces the output.
+                    edited = st.text_area("Step output", value=store.text(edit_rec.final_hash), height=160,
+                                          key=f"dag_edit_{st.session_state.run_id}_{edit_index}_{edit_rec.final_hash[:12]}")
+                    if st.button("Save edit & re-run dependents", use_container_width=True):
+                        store.save_edit(st.session_state.run_id, edit_index, edited)
+                        st.session_state.pipeline_status = "running"
+
+                        def _on_rerun(i: int, req: ChatRequest, r: StepResult) -> None:
+                            if r.ok:
+                                record_usage(i, r.agent_id, r.result, req.user_prompt)
+
+                        with st.spinner("Re-running steps whose inputs changed…"):
+                            outcomes = rerun_dirty(
+                                get_provider_pool(),
+                                store,
+                                st.session_state.run_id,
+                                current_api_keys(),
+                                cache=get_response_cache(),
+                                router=session_router(),
+                                validator=session_validator(),
+                                on_step=_on_rerun,
+                            )
+                        actions = [o.action for o in outcomes]
+                        st.session_state.dag_summary = (
+                            f"Re-ran {actions.count(RERUN) + actions.count(UNCHANGED)} of {len(outcomes)} steps"
+                            + (f" • {actions.count(UNCHANGED)} reproduced their output, so nothing after them re-ran"
+                               if UNCHANGED in actions else "")
+                            + (f" • {actions.count(STALE)} stale without a recipe" if STALE in actions else "")
+                        )
+                        failed_run = next((o for o in outcomes if o.result is not None and not o.result.ok), None)
+                        latest = [s for s in store.steps(st.session_state.run_id) if s.status == "completed"]
+                        st.session_state.agent_output = store.text(latest[-1].final_hash) if latest else ""
+                        st.session_state.carry_output = ""
+                        st.session_state.last_violations = []
+                        if failed_run is not None:
+                            st.session_state.last_error = failed_run.result.error
+                            st.session_state.pipeline_status = "error"
+                        else:
+                            st.session_state.last_error = ""
+                            st.session_state.pipeline_status = "awaiting_edit"
+                        rerun()
+                    if st.session_state.dag_summary:
+                        st.caption(st.session_state.dag_summary)
+
+        with st.expander("Runs (persistent • resume)"):
+            store = get_run_store()
+            recent = store.list_runs(limit=20)
+            if not recent:
+                st.caption("No saved runs yet.")
+            else:
+                run_labels = {r.run_id: f"{r.run_id} • {r.title} • {r.status} • {r.step}/{r.total_steps}" for r in recent}
+                picked = st.selectbox("Saved runs", list(run_labels), format_func=run_labels.get)
+                picked_steps = store.steps(picked)  # metadata only; bodies load on resume
+                picked_stale = set(stale_steps(picked_steps))
+                for rec in picked_steps:
+                    st.caption(
+                        f"#{rec.step_index + 1} `{rec.agent_id}` • {rec.model} • {rec.status}"
+                        f" • {rec.latency_ms if rec.latency_ms is not None else '—'} ms"
+                        f" • {rec.output_tokens if rec.output_tokens is not None else '—'} tok"
+                        f"{' • edited' if rec.edited_hash else ''}"
+                        f"{' • stale' if rec.step_index in picked_stale else ''}"
+                    )
+                if st.button("Resume selected run", use_container_width=True):
+                    next_step, carried = store.resume_point(picked)
+                    st.session_state.run_id = picked
+                    st.session_state.pipeline_total_steps = store.get_run(picked).total_steps
+                    st.session_state.pipeline_step = min(next_step, st.session_state.pipeline_total_steps)
+                    st.session_state.agent_output = carried
+                    st.session_state.carry_output = carried
+                    st.session_state.pipeline_status = "awaiting_edit" if next_step else "idle"
+                    rerun()
 
     with right:
         st.markdown("<div class='wow-paper'><h3>Output Viewer (Editable)</h3>"
@@ -903,11 +1597,140 @@ with tabs[1]:
 
         st.write("")
         view = st.radio("View", ["Text", "Markdown"], horizontal=True)
-        output_text = st.text_area("Agent Output (editable)", value="{\n  \"title\": \"Device Application Form\",\n  \"fields\": []\n}", height=260)
-        st.button("Use edited output for next step", use_container_width=True)
+        if pending_run is not None:
+            end_span(ui_span)
+            rerun_span.set(agent_step=step_name)
+            stream_view = st.empty()
+            stream_buf = ""
+            last_paint = 0.0
+            run_req = pending_run["req"]
+            run_cached = pending_run["use_cache"]
+            run_start = time.time()
+            cache_id = cache_key(step_name, run_req)
+            with span("agent.step", agent_id=step_name, model=run_req.model, use_cache=run_cached) as step_span:
+                try:
+                    if pending_run["chunk_text"]:
+                        chunk_progress = st.progress(0.0, text="Map-reduce over document chunks…")
+                        chunk_done: List[str] = []
+
+                        def _on_chunk(r: StepResult, total: int) -> None:
+                            chunk_done.append(r.agent_id)
+                            chunk_progress.progress(len(chunk_done) / total, text=f"Chunk {len(chunk_done)}/{total}")
+
+                        reduced = map_reduce(
+                            get_provider_pool(),
+                            step_name,
+                            run_req,
+                            "pdf_text",
+                            pending_run["chunk_text"],
+                            current_api_keys(),
+                            cache=get_response_cache() if run_cached else None,
+                            on_result=_on_chunk,
+                            router=session_router(),
+                            validator=session_validator(),
+                        )
+                        if not reduced.ok:
+                            raise ProviderError(pending_run["provider"], reduced.error)
+                        result = reduced.result
+                    else:
+                        validator = session_validator()
+                        rules = validator.rules(step_name) if validator is not None else None
+                        with span("cache.lookup") as lookup:
+                            result = get_response_cache().get(cache_id) if run_cached else None
+                            lookup.set(hit=result is not None)
+                        if result is not None:
+                            result = dataclasses.replace(result, cached=True, ttft_ms=None, tokens_per_s=None, latency_ms=int((time.time() - run_start) * 1000))
+                            if rules is not None:
+                                cached_failed = failures(validator.check(step_name, result.text))
+                                result = dataclasses.replace(result, violations=tuple(f.detail or f.rule for f in cached_failed))
+                        else:
+                            attempt_req = run_req
+                            paints, paint_s = 0, 0.0  # repaint cost, kept as step attributes rather than one span per paint
+                            max_attempts = 1 + (validator.max_retries if rules is not None else 0)
+                            for attempt in range(max_attempts):
+                                checker = rules.checker() if rules is not None else None
+                                router = session_router()
+                                if router is not None:
+                                    chat_stream = router.stream(get_provider_pool(), attempt_req, current_api_keys())
+                                else:
+                                    chat_stream = get_provider_pool().stream(attempt_req, pending_run["api_key"], provider=pending_run["provider"])
+                                stream_buf = ""
+                                abort = None
+                                for delta in chat_stream:
+                                    stream_buf += delta
+                                    abort = checker.feed(delta) if checker is not None else None
+                                    if abort:  # stop paying for an output that can no longer pass
+                                        chat_stream.close()
+                                        break
+                                    if time.time() - last_paint > 0.08:  # throttle repaints; deltas arrive much faster
+                                        paint_start = time.time()
+                                        (stream_view.markdown if view == "Markdown" else stream_view.text)(stream_buf)
+                                        last_paint = time.time()
+                                        paint_s += last_paint - paint_start
+                                        paints += 1
+                                if abort:
+                                    validator.stats.record_abort(step_name)
+                                    failed = [RuleResult("early_abort", False, abort)]
+                                    result = ChatResult(
+                                        text=stream_buf,
+                                        provider=chat_stream.provider,  # the router may have served another model
+                                        model=chat_stream.model,
+                                        latency_ms=int((time.time() - run_start) * 1000),
+                                    )
+                                else:
+                                    result = chat_stream.result
+                                    with span("validate", agent_id=step_name):
+                                        checks = checker.finish() if checker is not None else []
+                                    if checks:
+                                        validator.stats.record(step_name, checks)
+                                    failed = failures(checks)
+                                if not failed:
+                                    break
+                                if attempt + 1 < max_attempts:
+                                    st.toast(f"Output failed validation ({failed[0].detail or failed[0].rule}); regenerating…")
+                                    attempt_req = dataclasses.replace(run_req, user_prompt=run_req.user_prompt + retry_feedback(failed))
+                            if failed:
+                                result = dataclasses.replace(result, violations=tuple(f.detail or f.rule for f in failed))
+                            elif run_cached and result.text:
+                                answered = dataclasses.replace(run_req, model=result.model)  # fallback answers keep their own key
+                                get_response_cache().put(cache_key(step_name, answered), result)
+                            step_span.set(attempts=attempt + 1, paints=paints, paint_ms=int(paint_s * 1000))
+                    step_span.set(answered_by=result.model, output_tokens=result.output_tokens or 0,
+                                  violations=len(result.violations))
+                    record_run_step(step_name, run_req.user_prompt, result, recipe=pending_run["recipe"])
+                    st.session_state.agent_output = result.text
+                    st.session_state.last_violations = list(result.violations)
+                    st.session_state.carry_output = ""
+                    st.session_state.last_latency_ms = result.latency_ms
+                    st.session_state.last_ttft_ms = result.ttft_ms
+                    st.session_state.last_tokens_per_s = result.tokens_per_s
+                    st.session_state.last_cache_read_tokens = result.cache_read_tokens
+                    st.session_state.last_error = ""
+                    st.session_state.pipeline_step = min(st.session_state.pipeline_step + 1, st.session_state.pipeline_total_steps)
+                    st.session_state.pipeline_status = "awaiting_edit"
+                except ProviderError as e:
+                    step_span.error = str(e)[:500]
+                    record_run_step(step_name, run_req.user_prompt, None, status="error")
+                    st.session_state.last_error = str(e)
+                    st.session_state.pipeline_status = "error"
+            rerun()
+        if st.session_state.last_violations:
+            st.warning("Output failed validation: " + " • ".join(st.session_state.last_violations))
+        output_text = st.text_area("Agent Output (editable)", key="agent_output", height=260)
+        if st.button("Use edited output for next step", use_container_width=True):
+            st.session_state.carry_output = st.session_state.agent_output
+            if st.session_state.run_id:
+                produced = get_run_store().next_step_index(st.session_state.run_id) - 1  # the step agent_output came from
+                if produced >= 0:
+                    get_run_store().save_edit(st.session_state.run_id, produced, st.session_state.agent_output)
+            st.toast("Edited output will feed the next step.")
+
+
+end_span(ui_span)
 
 
 # ---- AI Note Keeper (Scaffold) ----
+ui_span = start_span("ui.notes")
 with tabs[2]:
     a, b = st.columns([1.05, 1.0], gap="large")
 
@@ -918,30 +1741,134 @@ with tabs[2]:
         st.write("")
 
         note_in = st.text_area("Paste note (txt/markdown)", value="Meeting Notes:\n- Discussed FormAgent UI\n- Need WOW theme + i18n\n- Decide models list\n", height=220)
+        note_is_organized = bool(st.session_state.note_organized) and st.session_state.note_source == note_in
         cols = st.columns([1, 1, 1])
         with cols[0]:
-            st.button("Organize Note", type="primary", use_container_width=True)
+            organize_clicked = st.button("Organize Note", type="primary", use_container_width=True, disabled=not note_in.strip())
         with cols[1]:
-            st.button("AI Keywords (Magic)", use_container_width=True)
+            keywords_clicked = st.button("AI Keywords (Magic)", use_container_width=True, disabled=not note_in.strip())
         with cols[2]:
-            st.button("More Magics…", use_container_width=True)
+            magics_clicked = st.button("Run All Magics", use_container_width=True, disabled=not note_in.strip(),
+                                       help="Organize once, then run every magic on the organized note concurrently.")
+
+        if organize_clicked:
+            organized = organize_note(get_provider_pool(), get_agents(), note_in, current_api_keys(),
+                                      cache=session_cache(), router=session_router(), validator=session_validator())
+            if organized.ok:
+                record_usage(st.session_state.pipeline_step, organized.agent_id, organized.result)
+                st.session_state.note_source = note_in
+                st.session_state.note_organized = organized.result.text
+                st.session_state.note_knowledge = None
+            else:
+                st.session_state.last_error = organized.error
+            rerun()
+
+        if keywords_clicked or magics_clicked:
+            magic_ids = MAGIC_AGENTS if magics_clicked else ("magic_keywords_agent",)
+            magic_progress = st.progress(0.0, text="Running magics…")
+            magic_done: List[str] = []
+            magic_total = len(magic_ids) + (0 if note_is_organized else 1)
+
+            def _on_magic(r: StepResult) -> None:
+                magic_done.append(r.agent_id)
+                magic_progress.progress(len(magic_done) / magic_total, text=f"{len(magic_done)}/{magic_total} • {r.agent_id}")
+
+            knowledge = run_magics(
+                get_provider_pool(),
+                get_agents(),
+                st.session_state.note_organized if note_is_organized else note_in,
+                current_api_keys(),
+                organized=note_is_organized,
+                magic_ids=magic_ids,
+                on_result=_on_magic,
+                cache=session_cache(),
+                router=session_router(),
+                validator=session_validator(),
+            )
+            for r in knowledge.results.values():
+                if r.ok:
+                    record_usage(st.session_state.pipeline_step, r.agent_id, r.result)
+            previous: Optional[NoteKnowledge] = st.session_state.note_knowledge
+            if previous is not None and previous.note == knowledge.note:  # keep magics this run did not repeat
+                for agent_id, r in previous.results.items():
+                    if agent_id not in knowledge.results:
+                        knowledge.merge(r)
+            if NOTE_AGENT in knowledge.results and knowledge.results[NOTE_AGENT].ok:
+                st.session_state.note_source = note_in
+                st.session_state.note_organized = knowledge.note
+            st.session_state.note_knowledge = knowledge
+            st.session_state.last_latency_ms = knowledge.wall_ms
+            if NOTE_AGENT in knowledge.errors:  # organizing failed, so no magic ran
+                st.session_state.last_error = knowledge.errors[NOTE_AGENT]
+            rerun()
 
     with b:
-        st.markdown("<div class='wow-paper'><h3>Organized Markdown Preview</h3>"
-                    "<div style='color:var(--wow-subtle)'>"
-                    "In the full implementation: the system outputs organized markdown and highlights keywords in "
-                    "<span class='wow-coral'>coral</span>."
-                    "</div>"
-                    "<hr style='border:none; border-top:1px solid var(--wow-paper-border); margin:12px 0;'>"
-                    "<div><b>Summary</b>: WOW UI shell scaffolded.</div>"
-                    "<div style='margin-top:10px;'><b>Keywords</b>: "
-                    "<span class='wow-coral'>WOW UI</span>, <span class='wow-coral'>i18n</span>, <span class='wow-coral'>Jackpot</span>"
-                    "</div>"
-                    "</div>",
-                    unsafe_allow_html=True)
+        knowledge = st.session_state.note_knowledge
+        if knowledge is not None:
+            st.markdown("<div class='wow-paper'><h3>Note Knowledge</h3>"
+                        "<div style='color:var(--wow-subtle)'>Merged output of the magics over the organized note.</div>"
+                        "</div>", unsafe_allow_html=True)
+            for agent_id, r in knowledge.results.items():
+                st.caption(f"{'✅' if r.ok else '⚠️'} `{agent_id}` — "
+                           + (f"{r.result.latency_ms} ms{' • cached' if r.result.cached else ''}" if r.ok else r.error))
+            st.caption(f"Wall time `{knowledge.wall_ms} ms` for {len(knowledge.results)} agents.")
+            k_tabs = st.tabs(["Organized", "Keywords", "Action Items", "Concept Map", "Glossary"])
+            with k_tabs[0]:
+                st.markdown(knowledge.formatted or knowledge.note)
+            with k_tabs[1]:
+                kw_cols = st.columns([1, 3])
+                with kw_cols[0]:
+                    keyword_color = st.color_picker("Keyword color", value=CORAL, key="note_keyword_color")
+                with kw_cols[1]:
+                    extra_keywords = st.text_area("More keywords", key="note_extra_keywords", height=90,
+                                                  placeholder="One per line; optionally `keyword | #3366ff`")
+                try:
+                    custom_keywords = parse_keywords(extra_keywords, keyword_color)
+                except ValueError as e:
+                    st.error(f"More keywords: {e}")
+                    custom_keywords = {}
+                if knowledge.keywords:
+                    chip_style = "" if keyword_color.upper() == CORAL else f" style='color:{html.escape(keyword_color)}'"
+                    st.markdown(" ".join(f"<span class='wow-coral'{chip_style}>{html.escape(k)}</span>" for k in knowledge.keywords),
+                                unsafe_allow_html=True)
+                keyword_colors = {**dict.fromkeys(knowledge.keywords, keyword_color), **custom_keywords}
+                if keyword_colors:
+                    highlighter = get_highlighter(tuple(keyword_colors.items()))
+                    st.markdown(highlighter.highlight(knowledge.formatted or knowledge.note), unsafe_allow_html=True)
+                else:
+                    st.markdown("—")
+                if knowledge.highlighted:
+                    with st.expander("As marked by magic_keywords_agent"):
+                        st.markdown(knowledge.highlighted, unsafe_allow_html=True)
+            for tab, agent_id in zip(k_tabs[2:], ("magic_action_items_agent", "magic_concept_map_agent", "magic_glossary_agent")):
+                with tab:
+                    r = knowledge.results.get(agent_id)
+                    st.markdown(r.result.text if r is not None and r.ok else "—")
+            dl = st.columns(2)
+            with dl[0]:
+                st.download_button("Download knowledge (JSON)", data=knowledge.to_json(), file_name="note_knowledge.json",
+                                   mime="application/json", use_container_width=True)
+            with dl[1]:
+                st.download_button("Download knowledge (Markdown)", data=knowledge.to_markdown(), file_name="note_knowledge.md",
+                                   mime="text/markdown", use_container_width=True)
+        elif note_is_organized:
+            st.markdown("<div class='wow-paper'><h3>Organized Markdown Preview</h3></div>", unsafe_allow_html=True)
+            st.markdown(st.session_state.note_organized)
+        else:
+            st.markdown("<div class='wow-paper'><h3>Organized Markdown Preview</h3>"
+                        "<div style='color:var(--wow-subtle)'>"
+                        "Organize the note, or run all magics: the note is organized into Markdown, then formatting, "
+                        "<span class='wow-coral'>coral</span> keywords, action items, a concept map and a glossary "
+                        "are produced side by side."
+                        "</div></div>",
+                        unsafe_allow_html=True)
+
+
+end_span(ui_span)
 
 
 # ---- Dashboard (WOW Indicators Scaffold) ----
+ui_span = start_span("ui.dashboard")
 with tabs[3]:
     st.markdown(f"<div class='wow-card'><h3>{t('dash_scaffold_title')}</h3>"
                 f"<div style='color:var(--wow-subtle)'>{t('dash_scaffold_body')}</div></div>",
@@ -950,24 +1877,122 @@ with tabs[3]:
 
     c1, c2, c3 = st.columns([1, 1, 1], gap="large")
 
+    # This run's trace is still open, so the timeline shows the session's earlier reruns.
+    trace_roots = TRACER.roots(limit=30, session=st.session_state.trace_session)
+
     with c1:
         st.markdown("<div class='wow-paper'><h4>Run Timeline</h4>"
                     "<div style='color:var(--wow-subtle)'>"
-                    "Show nodes: step name • model • tokens • elapsed • status."
+                    "Where each rerun's time went: provider • queue • UI • local."
                     "</div></div>", unsafe_allow_html=True)
         st.write("")
         st.progress(st.session_state.pipeline_step / max(1, st.session_state.pipeline_total_steps))
+        step_roots = [r for r in trace_roots if r.attributes.get("agent_step")]
+        if step_roots:
+            split = breakdown(TRACER.spans(step_roots[0].trace_id))
+            st.write(
+                f"- **Last step** `{step_roots[0].attributes['agent_step']}`: `{step_roots[0].duration_ms:.0f} ms`\n"
+                + "\n".join(f"- **{k}**: `{v:.0f} ms`" for k, v in split.items())
+            )
+        else:
+            st.caption("No traced agent steps yet.")
 
     with c2:
         st.markdown("<div class='wow-paper'><h4>Provider Readiness</h4></div>", unsafe_allow_html=True)
         for provider, env_key in PROVIDER_ENV_KEYS.items():
             st.write(f"- **{provider}**: `{provider_status(env_key)}`")
+        st.write("")
+        st.markdown("<div class='wow-paper'><h4>Model Latency & Health</h4></div>", unsafe_allow_html=True)
+        router_health = [get_router().tracker.health(m) for m in get_router().policy.candidates]
+        if get_router().policy.ignored:
+            st.warning("FORMAGENT_ROUTE_MODELS: ignored unknown models " + ", ".join(f"`{m}`" for m in get_router().policy.ignored))
+        for h in router_health:
+            if h.samples or h.failures:
+                st.write(
+                    f"- **{h.model}**: p50 `{h.p50_ms if h.p50_ms is not None else '—'} ms` • "
+                    f"p95 `{h.p95_ms if h.p95_ms is not None else '—'} ms` • n `{h.samples}`"
+                    + (" • circuit `open`" if h.open else (f" • failures `{h.failures}`" if h.failures else ""))
+                )
+        if not any(h.samples or h.failures for h in router_health):
+            st.caption("No routed calls yet.")
+        st.write("")
+        st.markdown("<div class='wow-paper'><h4>Provider Throttling</h4></div>", unsafe_allow_html=True)
+        for provider, ps in get_provider_pool().stats.items():
+            st.write(
+                f"- **{provider}**: queued `{ps.waiting}` • in-flight `{ps.in_flight}` • "
+                f"throttled `{ps.throttled_s:.1f}s` • retries `{ps.retries}` • 429s `{ps.rejections}`"
+            )
 
     with c3:
         st.markdown("<div class='wow-paper'><h4>Artifacts</h4>"
                     "<div style='color:var(--wow-subtle)'>"
                     "Schema • Python • jsPDF • Preview PDF readiness."
                     "</div></div>", unsafe_allow_html=True)
+        st.write("")
+        cache = get_response_cache()
+        cache_usage = cache.usage()
+        st.markdown("<div class='wow-paper'><h4>Response Cache</h4></div>", unsafe_allow_html=True)
+        st.write(
+            f"- **Hits**: `{cache.stats.hits}` (memory `{cache.stats.memory_hits}`)\n"
+            f"- **Misses**: `{cache.stats.misses}`\n"
+            f"- **Hit rate**: `{cache.stats.hit_rate:.0%}`\n"
+            f"- **Entries**: `{cache_usage['entries']}` • `{cache_usage['bytes'] / 1024:.1f} KB`"
+        )
+
+    st.write("")
+    st.markdown("<div class='wow-paper'><h4>Trace Explorer</h4></div>", unsafe_allow_html=True)
+    if trace_roots:
+        root_labels = {
+            r.trace_id: f"{time.strftime('%H:%M:%S', time.localtime(r.start_ns / 1e9))} • {r.duration_ms:.0f} ms"
+                        + (f" • step `{r.attributes['agent_step']}`" if r.attributes.get("agent_step") else "")
+                        + (" • interrupted" if r.attributes.get("interrupted") else "")
+            for r in trace_roots
+        }
+        step_ids = [r.trace_id for r in trace_roots if r.attributes.get("agent_step")]
+        picked_trace = st.selectbox("Rerun", list(root_labels), format_func=root_labels.get,
+                                    index=list(root_labels).index(step_ids[0]) if step_ids else 0)
+        trace_spans = TRACER.spans(picked_trace)
+        st.markdown(timeline_html(trace_spans), unsafe_allow_html=True)
+        st.caption(" • ".join(f"{k} `{v:.0f} ms`" for k, v in breakdown(trace_spans).items()))
+        st.download_button(
+            "Export trace (OTLP JSON)",
+            data=json.dumps(to_otlp(trace_spans), ensure_ascii=False, indent=2),
+            file_name=f"trace-{picked_trace}.json",
+            mime="application/json",
+        )
+    else:
+        st.caption("No finished reruns traced yet. Set FORMAGENT_TRACE_FILE to also append every trace to a file.")
+
+    st.write("")
+    st.markdown("<div class='wow-paper'><h4>Output Validation</h4></div>", unsafe_allow_html=True)
+    validation_rows = get_validation_stats().pass_rates()
+    if validation_rows:
+        st.dataframe(validation_rows, use_container_width=True, hide_index=True)
+    else:
+        st.caption("No validated outputs yet.")
+
+    st.write("")
+    st.markdown("<div class='wow-paper'><h4>Token & Cost</h4></div>", unsafe_allow_html=True)
+    ledger = st.session_state.usage_ledger
+    cost_cols = st.columns([1, 1, 2])
+    with cost_cols[0]:
+        group_by = st.selectbox("Group by", GROUP_KEYS, index=2)
+    with cost_cols[1]:
+        st.metric("Session spend (USD)", f"${ledger.total_cost():.4f}")
+        st.caption(f"Prompt-cache savings: ${ledger.cache_saved_usd():.4f}")
+        if st.session_state.run_id:
+            run_ledger = ledger_from_steps(get_run_store().steps(st.session_state.run_id), get_run_store().text)
+            st.caption(f"Run `{st.session_state.run_id}`: ${run_ledger.total_cost():.4f}")
+    with cost_cols[2]:
+        cost_rows = ledger.table(by=(group_by,))
+        if cost_rows:
+            st.dataframe(cost_rows, use_container_width=True, hide_index=True)
+        else:
+            st.caption("No provider calls yet this session. Cached calls count as $0; `estimated` marks locally counted usage; "
+                       "`cache_read_tokens` are billed at the provider's cached-input rate.")
 
     st.write("")
     st.caption(t("footer"))
+end_span(ui_span)
+end_span(rerun_span)
+deactivate(rerun_token)
@@ -0,0 +1,4 @@
+"""FormAgent AI execution layer (provider clients, agents, pipelines).
+
+Modules here never import Streamlit so they can be reused by headless runners.
+"""
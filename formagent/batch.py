@@ -0,0 +1,198 @@
+"""
+Headless batch runner for agents.yaml pipelines.
+
+    python -m formagent.batch \
+        --pipeline "pdf_to_markdown_agent,summary_entities_agent,review_memo_builder:review_results" \
+        --inputs ./submissions --out results.jsonl --workers 8 --per-provider 4
+
+Each input file (.pdf/.md/.txt) runs the pipeline in order; the JSONL output doubles
+as the checkpoint (documents already present are skipped on restart) and completed
+calls are replayed from the response cache. Keys come from the usual *_API_KEY env vars.
+"""
+import argparse
+import dataclasses
+import fnmatch
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from multiprocessing import get_context
+from typing import Dict, List, Optional, Set
+
+from formagent.cache import ResponseCache
+from formagent.dag import StepRecipe
+from formagent.executor import PipelineStep, StepResult, parse_pipeline, pipeline_request, run_pipeline
+from formagent.pdf_ingest import PageCache, file_sha256, iter_pages
+from formagent.providers import PROVIDER_ENV_KEYS, ChatRequest, ProviderPool, ProviderSettings
+from formagent.registry import AGENTS_YAML, RegistryLoader
+from formagent.routing import Router, RoutingPolicy
+from formagent.run_store import RunStore
+from formagent.usage import UsageLedger
+from formagent.validation import Validator
+
+
+def load_text(path: str, file_hash: str, page_cache: PageCache, ocr: bool, pdf_pool: Optional[Executor]) -> str:
+    if path.lower().endswith(".pdf"):
+        return "\n\n".join(p.text for p in iter_pages(path, file_hash, page_cache, ocr=ocr, executor=pdf_pool))
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+
+def discover(inputs: str, patterns: List[str]) -> List[str]:
+    if os.path.isfile(inputs):
+        return [inputs]
+    found = []
+    for root, _, files in os.walk(inputs):
+        for name in sorted(files):
+            if any(fnmatch.fnmatch(name.lower(), p) for p in patterns):
+                found.append(os.path.join(root, name))
+    return sorted(found)
+
+
+def checkpoint_key(file_hash: str, pipeline: str, model: str, values: Dict[str, str], agents_hash: str) -> str:
+    """Identity of one document's result: changing the agents.yaml contents or a --set value re-runs it."""
+    ident = json.dumps([file_hash, pipeline, model, sorted(values.items()), agents_hash], ensure_ascii=False)
+    return hashlib.sha256(ident.encode("utf-8")).hexdigest()[:24]
+
+
+def completed_keys(out_path: str) -> Set[str]:
+    done: Set[str] = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue  # a torn last line from a crash
+            if row.get("status") == "completed":
+                done.add(row.get("checkpoint", ""))
+    return done
+
+
+def _step_row(r: StepResult) -> Dict[str, object]:
+    row: Dict[str, object] = {"agent_id": r.agent_id, "ok": r.ok, "error": r.error}
+    if r.ok:
+        res = dataclasses.asdict(r.result)
+        row.update({k: res[k] for k in ("model", "provider", "latency_ms", "input_tokens", "output_tokens", "cached", "violations")})
+        row["output"] = r.result.text
+    return row
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m formagent.batch", description="Run an agents.yaml pipeline over many documents.")
+    ap.add_argument("--pipeline", required=True, help="Comma-separated agent ids; 'agent:placeholder' picks the input slot.")
+    ap.add_argument("--inputs", required=True, help="Input file or directory (searched recursively).")
+    ap.add_argument("--out", required=True, help="JSONL output (also the checkpoint).")
+    ap.add_argument("--glob", default="*.pdf,*.md,*.txt", help="Comma-separated filename patterns.")
+    ap.add_argument("--agents", default=AGENTS_YAML, help="Path to agents.yaml.")
+    ap.add_argument("--workers", type=int, default=4, help="Documents processed concurrently.")
+    ap.add_argument("--per-provider", type=int, default=None, help="Max in-flight requests per provider.")
+    ap.add_argument("--model", default=None, help="Override every agent's model.")
+    ap.add_argument("--set", action="append", default=[], metavar="NAME=VALUE", help="Fixed placeholder value (repeatable).")
+    ap.add_argument("--route", action="store_true",
+                    help="Pick models per call from the FORMAGENT_ROUTE_* policy and fall back across providers.")
+    ap.add_argument("--validate-retries", type=int, default=1,
+                    help="Regenerations for outputs failing the agent's validation rules.")
+    ap.add_argument("--no-validate", action="store_true", help="Skip output_requirements / validation_rules checks.")
+    ap.add_argument("--no-cache", action="store_true", help="Bypass the response cache.")
+    ap.add_argument("--no-ocr", action="store_true", help="Skip OCR for PDF pages without a text layer.")
+    args = ap.parse_args(argv)
+
+    registry = RegistryLoader(args.agents).current()
+    steps: List[PipelineStep] = parse_pipeline(args.pipeline, registry)
+    bad = [kv for kv in args.set if "=" not in kv]
+    if bad:
+        ap.error(f"--set expects NAME=VALUE, got {bad[0]!r}")
+    values = dict(kv.split("=", 1) for kv in args.set)
+    agents_hash = file_sha256(args.agents)
+
+    settings = ProviderSettings.from_env()
+    if args.per_provider:
+        settings = dataclasses.replace(settings, max_concurrency=args.per_provider)
+    pool = ProviderPool(settings)
+    cache = None if args.no_cache else ResponseCache()
+    page_cache = PageCache()
+    runs = RunStore()
+    router = Router(RoutingPolicy.from_env()) if args.route else None
+    validator = None if args.no_validate else Validator(registry, max_retries=max(0, args.validate_retries))
+    api_keys = {p: os.getenv(k, "") for p, k in PROVIDER_ENV_KEYS.items()}
+
+    files = discover(args.inputs, [p.strip().lower() for p in args.glob.split(",") if p.strip()])
+    # One extraction pool for the whole batch: large PDFs share it instead of each spawning its own.
+    pdf_pool = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=get_context("spawn")) \
+        if any(f.lower().endswith(".pdf") for f in files) else None
+    done = completed_keys(args.out)
+    write_lock = threading.Lock()
+    ledger = UsageLedger()
+    started = time.perf_counter()
+
+    def process(path: str) -> bool:
+        file_hash = file_sha256(path)
+        key = checkpoint_key(file_hash, args.pipeline, args.model or "", values, agents_hash)
+        if key in done:
+            return True
+        t0 = time.perf_counter()
+        text = load_text(path, file_hash, page_cache, not args.no_ocr, pdf_pool)
+        run_id = runs.create_run(f"batch:{os.path.basename(path)}", len(steps))
+
+        def on_step(i: int, step: PipelineStep, req: ChatRequest, r: StepResult) -> None:
+            # Recipes let formagent.dag.rerun_dirty re-run only what an edit invalidates.
+            recipe = StepRecipe(step.agent_id, pipeline_request(registry.get(step.agent_id), step, values, args.model), step.field)
+            runs.record_step(run_id, i, step.agent_id, req.user_prompt, r.result, model=req.model,
+                             status="completed" if r.ok else "error", recipe=recipe.to_json(), deps=(i - 1,) if i else ())
+            if r.ok:
+                ledger.record(i, step.agent_id, r.result, req.user_prompt)
+
+        results = run_pipeline(pool, registry, steps, text, api_keys, values=values, cache=cache,
+                               model=args.model, on_step=on_step, router=router,
+                               validator=validator)
+        ok = len(results) == len(steps) and all(r.ok for r in results)
+        runs.update_run(run_id, "completed" if ok else "error", len(results))
+        row = {
+            "checkpoint": key,
+            "file": path,
+            "sha256": file_hash,
+            "run_id": run_id,
+            "status": "completed" if ok else "error",
+            "elapsed_ms": int((time.perf_counter() - t0) * 1000),
+            "steps": [_step_row(r) for r in results],
+        }
+        with write_lock, open(args.out, "a", encoding="utf-8") as f:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        return ok
+
+    failures = 0
+    with ThreadPoolExecutor(max_workers=max(1, args.workers), thread_name_prefix="batch") as ex:
+        futures = {ex.submit(process, path): path for path in files}
+        for n, fut in enumerate(as_completed(futures), start=1):
+            path = futures[fut]
+            try:
+                ok = fut.result()
+            except Exception as e:  # one bad document must not stop the batch
+                ok = False
+                print(f"[{n}/{len(files)}] {path}: {type(e).__name__}: {e}", file=sys.stderr)
+            else:
+                print(f"[{n}/{len(files)}] {'ok ' if ok else 'ERR'} {path}", file=sys.stderr)
+            failures += not ok
+
+    pool.close()
+    if pdf_pool is not None:
+        pdf_pool.shutdown()
+    print(f"{len(files)} documents, {failures} failed, {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    if validator is not None:
+        for row in validator.stats.pass_rates():
+            if row["pass_rate"] < 1:
+                print(f"  {row['agent_id']} {row['rule']}: {row['passed']}/{row['checked']} passed", file=sys.stderr)
+    for row in ledger.table(by=("model",)):
+        cost = f"${row['cost_usd']:.4f}" if row["cost_usd"] is not None else "unpriced"
+        print(f"  {row['model']}: {row['calls']} calls ({row['cached']} cached), "
+              f"{row['input_tokens']:,} in / {row['output_tokens']:,} out tokens, {cost}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,434 @@
+"""
+Benchmarks against the local mock provider server (formagent.mockllm); no API keys needed.
+
+    python -m formagent.bench --out bench.json
+    python -m formagent.bench --scenarios step_stream,fanout_review --ttft-ms 800 --error-rate 0.05 \
+        --baseline bench.json --out bench-new.json
+
+Each scenario runs in a fresh process (so peak RSS is its own) and reports throughput,
+p50/p95/p99 latency and peak RSS. With --baseline, a p95 or throughput regression beyond
+--tolerance makes the command exit with status 1, as does a cold start over
+--startup-budget-ms or one that loads a module from HEAVY_MODULES.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from multiprocessing import get_context
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from formagent.mockllm import MockLLMServer, add_config_args, config_from_args
+
+APP_PY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+# Must stay unloaded until a feature needs them: each costs 0.1–0.5 s on a cold start.
+HEAVY_MODULES = ("altair", "pandas", "pyarrow", "numpy", "pypdf", "docx", "reportlab", "fpdf",
+                 "openai", "anthropic", "google.generativeai")
+
+
+@dataclass(frozen=True)
+class BenchOptions:
+    requests: int = 40  # calls per single-step scenario
+    concurrency: int = 8
+    model: str = "gpt-4o-mini"
+    reviews: int = 3  # fan-out reviews (12 specialists + memo each)
+    pdf_pages: int = 300
+    pdf_runs: int = 3  # cold extractions (fresh page cache each)
+    reruns: int = 5  # app.py script reruns after the first (cold) run
+    startups: int = 5  # fresh interpreters for the cold-start scenario
+    startup_budget_ms: float = 1000.0  # app imports + first script run, p50
+
+
+@dataclass
+class Sample:
+    latencies_ms: List[float] = field(default_factory=list)
+    errors: int = 0
+    wall_s: float = 0.0
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+
+def percentile(values: Sequence[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile; None for no samples."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[max(0, math.ceil(q * len(ordered)) - 1)], 1)
+
+
+def peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)  # bytes on macOS, KiB elsewhere
+
+
+def _timed(fn: Callable[[], bool], sample: Sample) -> None:
+    start = time.perf_counter()
+    ok = fn()
+    if ok:
+        sample.latencies_ms.append((time.perf_counter() - start) * 1000)
+    else:
+        sample.errors += 1
+
+
+def _parallel(opts: BenchOptions, fn: Callable[[], bool], n: int) -> Sample:
+    sample = Sample()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=opts.concurrency) as ex:
+        list(ex.map(lambda _: _timed(fn, sample), range(n)))
+    sample.wall_s = time.perf_counter() - start
+    return sample
+
+
+# =========================
+# Scenarios (run inside the child process)
+# =========================
+def _pool():
+    from formagent.providers import ProviderPool, ProviderSettings
+
+    return ProviderPool(ProviderSettings.from_env())
+
+
+def _keys() -> Dict[str, str]:
+    from formagent.providers import PROVIDER_ENV_KEYS
+
+    return {p: os.getenv(k, "") for p, k in PROVIDER_ENV_KEYS.items()}
+
+
+def _submission(chars: int = 4000) -> str:
+    line = "本裝置為第二類醫療器材，預期用途為居家量測。The device is intended for home use. "
+    return (line * (chars // len(line) + 1))[:chars]
+
+
+def scenario_step_complete(opts: BenchOptions) -> Sample:
+    """One agent step per call (non-streaming), `concurrency` calls in flight."""
+    from formagent.executor import run_request
+    from formagent.providers import ChatRequest, ProviderError
+
+    pool, keys = _pool(), _keys()
+    req = ChatRequest(model=opts.model, user_prompt=_submission(), max_tokens=512)
+
+    def call() -> bool:
+        try:
+            return bool(run_request(pool, req, keys).text)
+        except ProviderError:
+            return False
+
+    sample = _parallel(opts, call, opts.requests)
+    pool.close()
+    return sample
+
+
+def scenario_step_stream(opts: BenchOptions) -> Sample:
+    """Streaming steps as Agent Studio runs them; also reports time to first token."""
+    from formagent.providers import ChatRequest, ProviderError, provider_for_model
+
+    pool, keys = _pool(), _keys()
+    req = ChatRequest(model=opts.model, user_prompt=_submission(), max_tokens=512)
+    api_key = keys[provider_for_model(opts.model)]
+    ttfts: List[float] = []
+
+    def call() -> bool:
+        try:
+            stream = pool.stream(req, api_key)
+            text = "".join(stream)
+        except ProviderError:
+            return False
+        if stream.result.ttft_ms is not None:
+            ttfts.append(stream.result.ttft_ms)
+        return bool(text)
+
+    sample = _parallel(opts, call, opts.requests)
+    sample.extra["ttft_p50_ms"] = percentile(ttfts, 0.50)
+    sample.extra["ttft_p95_ms"] = percentile(ttfts, 0.95)
+    pool.close()
+    return sample
+
+
+def scenario_fanout_review(opts: BenchOptions) -> Sample:
+    """run_review: the default specialists in parallel, then review_memo_builder."""
+    from formagent.executor import DEFAULT_REVIEW_AGENTS, run_review
+    from formagent.registry import RegistryLoader
+
+    pool, keys = _pool(), _keys()
+    registry = RegistryLoader().current()
+    agent_ids = [a for a in DEFAULT_REVIEW_AGENTS if a in registry]
+    sample = Sample()
+    start = time.perf_counter()
+    for _ in range(opts.reviews):
+        def review() -> bool:
+            results, memo = run_review(pool, registry, agent_ids, _submission(), keys)
+            sample.errors += sum(not r.ok for r in results)
+            return memo.ok
+
+        _timed(review, sample)
+    sample.wall_s = time.perf_counter() - start
+    sample.extra["specialists"] = len(agent_ids)
+    pool.close()
+    return sample
+
+
+def write_pdf(path: str, pages: int, lines_per_page: int = 45) -> None:
+    """Minimal text-only PDF (Helvetica), so ingestion can be benchmarked without fixtures."""
+    objects: List[bytes] = [b"<< /Type /Catalog /Pages 2 0 R >>", b"", b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for p in range(pages):
+        text = " T* ".join(f"(Page {p + 1} line {i + 1}: device performance testing per IEC 60601-1.) Tj" for i in range(lines_per_page))
+        stream = f"BT /F1 10 Tf 12 TL 40 800 Td {text} ET".encode("ascii")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % k for k in kids), pages)
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for n, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (n, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def scenario_pdf_ingest(opts: BenchOptions) -> Sample:
+    """
+    Text extraction of a synthetic PDF with an empty page cache each run; the warm
+    (fully cached) read is reported separately. Peak RSS excludes extraction workers.
+    """
+    from formagent.pdf_ingest import PageCache, file_sha256, iter_pages
+
+    sample = Sample()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.pdf")
+        write_pdf(path, opts.pdf_pages)
+        digest = file_sha256(path)
+        start = time.perf_counter()
+        for run in range(opts.pdf_runs):
+            cache = PageCache(os.path.join(tmp, f"pages{run}.sqlite3"))
+            _timed(lambda: sum(1 for _ in iter_pages(path, digest, cache, ocr=False)) == opts.pdf_pages, sample)
+        sample.wall_s = time.perf_counter() - start
+        t0 = time.perf_counter()
+        sum(1 for _ in iter_pages(path, digest, cache, ocr=False))
+        sample.extra["warm_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    sample.extra["pages"] = opts.pdf_pages
+    p50 = percentile(sample.latencies_ms, 0.50)
+    sample.extra["cold_pages_per_s"] = round(opts.pdf_pages / (p50 / 1000), 1) if p50 else None
+    return sample
+
+
+def scenario_app_rerun(opts: BenchOptions) -> Sample:
+    """Full `app.py` script runs (Streamlit AppTest): the cold first run, then plain reruns."""
+    from streamlit.testing.v1 import AppTest
+
+    sample = Sample()
+    at = AppTest.from_file(APP_PY, default_timeout=120)
+    start = time.perf_counter()
+    t0 = time.perf_counter()
+    at.run()
+    sample.extra["cold_run_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    sample.extra["exceptions"] = [str(e.value)[:200] for e in at.exception]
+    for _ in range(opts.reruns):
+        _timed(lambda: (at.run(), not at.exception)[1], sample)
+    sample.wall_s = time.perf_counter() - start
+    return sample
+
+
+# Runs in a fresh interpreter. Streamlit itself is imported first and not counted: the
+# server has it loaded before the first session arrives.
+_STARTUP_PROBE = """
+import ast, json, sys, time
+import streamlit
+from streamlit.testing.v1 import AppTest
+
+app_py, heavy = sys.argv[1], sys.argv[2].split(",")
+before = set(sys.modules)
+with open(app_py, encoding="utf-8") as f:
+    tree = ast.parse(f.read())
+imports = ast.Module(body=[n for n in tree.body if isinstance(n, (ast.Import, ast.ImportFrom))], type_ignores=[])
+sys.path.insert(0, __import__("os").path.dirname(app_py))
+t0 = time.perf_counter()
+exec(compile(imports, app_py, "exec"), {})
+import_ms = (time.perf_counter() - t0) * 1000
+at = AppTest.from_file(app_py, default_timeout=120)
+t0 = time.perf_counter()
+at.run()
+run_ms = (time.perf_counter() - t0) * 1000
+from formagent.bench import peak_rss_mb
+print(json.dumps({
+    "import_ms": import_ms,
+    "run_ms": run_ms,
+    "heavy": [m for m in heavy if m in sys.modules and m not in before],
+    "exceptions": [str(e.value)[:200] for e in at.exception],
+    "peak_rss_mb": peak_rss_mb(),
+}))
+"""
+
+
+def scenario_startup(opts: BenchOptions) -> Sample:
+    """
+    Cold start: `app.py`'s imports plus its first script run, each in a fresh interpreter
+    with an empty data dir. Latency is import + first run; the budget applies to its p50.
+    """
+    sample = Sample()
+    imports_ms: List[float] = []
+    rss_mb: List[float] = []
+    heavy: List[str] = []
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(opts.startups):
+            env = {**os.environ, "FORMAGENT_DATA_DIR": os.path.join(tmp, str(i))}
+            proc = subprocess.run([sys.executable, "-c", _STARTUP_PROBE, APP_PY, ",".join(HEAVY_MODULES)],
+                                  capture_output=True, text=True, env=env, timeout=300)
+            if proc.returncode != 0:
+                sample.errors += 1
+                sample.extra["stderr"] = proc.stderr[-500:]
+                continue
+            probe = json.loads(proc.stdout.strip().splitlines()[-1])
+            if probe["exceptions"]:
+                sample.errors += 1
+                sample.extra["exceptions"] = probe["exceptions"]
+                continue
+            imports_ms.append(probe["import_ms"])
+            rss_mb.append(probe["peak_rss_mb"] or 0.0)
+            heavy.extend(m for m in probe["heavy"] if m not in heavy)
+            sample.latencies_ms.append(probe["import_ms"] + probe["run_ms"])
+    sample.wall_s = time.perf_counter() - start
+    p50 = percentile(sample.latencies_ms, 0.50)
+    sample.extra["import_p50_ms"] = percentile(imports_ms, 0.50)
+    sample.extra["app_peak_rss_mb"] = max(rss_mb, default=None)  # the row's peak_rss_mb is only the driver
+    sample.extra["heavy_modules"] = heavy
+    sample.extra["budget_ms"] = opts.startup_budget_ms
+    violations = [f"loaded {', '.join(heavy)}"] if heavy else []
+    if p50 is not None and p50 > opts.startup_budget_ms:
+        violations.append(f"p50 {p50} ms over the {opts.startup_budget_ms:.0f} ms budget")
+    sample.extra["budget_violations"] = violations
+    return sample
+
+
+SCENARIOS: Dict[str, Callable[[BenchOptions], Sample]] = {
+    "step_complete": scenario_step_complete,
+    "step_stream": scenario_step_stream,
+    "fanout_review": scenario_fanout_review,
+    "pdf_ingest": scenario_pdf_ingest,
+    "app_rerun": scenario_app_rerun,
+    "startup": scenario_startup,
+}
+
+
+def _child(name: str, opts: BenchOptions, env: Dict[str, str]) -> Dict[str, Any]:
+    os.environ.update(env)
+    try:
+        sample = SCENARIOS[name](opts)
+    except Exception as e:  # report and keep going with the other scenarios
+        return {"scenario": name, "error": f"{type(e).__name__}: {e}", "peak_rss_mb": peak_rss_mb()}
+    ok = len(sample.latencies_ms)
+    return {
+        "scenario": name,
+        "count": ok,
+        "errors": sample.errors,
+        "wall_s": round(sample.wall_s, 3),
+        "throughput_per_s": round(ok / sample.wall_s, 3) if sample.wall_s else None,
+        "p50_ms": percentile(sample.latencies_ms, 0.50),
+        "p95_ms": percentile(sample.latencies_ms, 0.95),
+        "p99_ms": percentile(sample.latencies_ms, 0.99),
+        "peak_rss_mb": peak_rss_mb(),
+        **sample.extra,
+    }
+
+
+def compare(current: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float) -> List[str]:
+    """Human-readable regressions of p95 latency / throughput beyond `tolerance` (0.2 = 20%)."""
+    before = {row["scenario"]: row for row in baseline}
+    out = []
+    for row in current:
+        old = before.get(row["scenario"])
+        if old is None or "error" in row or "error" in old:
+            continue
+        if row.get("p95_ms") and old.get("p95_ms") and row["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+            out.append(f"{row['scenario']}: p95 {old['p95_ms']} -> {row['p95_ms']} ms")
+        if row.get("throughput_per_s") and old.get("throughput_per_s") and row["throughput_per_s"] < old["throughput_per_s"] * (1 - tolerance):
+            out.append(f"{row['scenario']}: throughput {old['throughput_per_s']} -> {row['throughput_per_s']}/s")
+    return out
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m formagent.bench", description="Benchmark FormAgent against mock providers.")
+    ap.add_argument("--out", default="bench.json", help="JSON report path.")
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma-separated subset of: {', '.join(SCENARIOS)}.")
+    d = BenchOptions()
+    ap.add_argument("--requests", type=int, default=d.requests, help="Calls per single-step scenario.")
+    ap.add_argument("--concurrency", type=int, default=d.concurrency, help="Calls in flight for single-step scenarios.")
+    ap.add_argument("--model", default=d.model, help="Model for single-step scenarios.")
+    ap.add_argument("--reviews", type=int, default=d.reviews, help="Fan-out reviews to run.")
+    ap.add_argument("--pdf-pages", type=int, default=d.pdf_pages, help="Pages in the synthetic PDF.")
+    ap.add_argument("--pdf-runs", type=int, default=d.pdf_runs, help="Cold extractions of the synthetic PDF.")
+    ap.add_argument("--reruns", type=int, default=d.reruns, help="app.py reruns after the cold run.")
+    ap.add_argument("--startups", type=int, default=d.startups, help="Fresh interpreters for the cold-start scenario.")
+    ap.add_argument("--startup-budget-ms", type=float, default=d.startup_budget_ms,
+                    help="Cold-start budget (p50 of app imports + first run).")
+    ap.add_argument("--baseline", default=None, help="Earlier report to compare against.")
+    ap.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression vs --baseline (0.2 = 20%%).")
+    add_config_args(ap)
+    args = ap.parse_args(argv)
+
+    names = [n.strip() for n in args.scenarios.split(",") if n.strip()]
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        ap.error(f"unknown scenarios: {', '.join(unknown)}")
+    opts = BenchOptions(args.requests, args.concurrency, args.model, args.reviews, args.pdf_pages, args.pdf_runs, args.reruns,
+                        args.startups, args.startup_budget_ms)
+    mock = config_from_args(args)
+
+    rows: List[Dict[str, Any]] = []
+    with MockLLMServer(mock) as server, tempfile.TemporaryDirectory() as data:
+        env = {**server.env(), "FORMAGENT_DATA_DIR": data}  # empty caches/stores: every call reaches the server
+        for name in names:
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as ex:
+                row = ex.submit(_child, name, opts, env).result()
+            rows.append(row)
+            for line in row.get("budget_violations", []):
+                print(f"BUDGET {name}: {line}", file=sys.stderr)
+            if "error" in row:
+                print(f"{name:15s} ERROR {row['error']}", file=sys.stderr)
+            else:
+                print(f"{name:15s} {row['count']:4d} ok {row['errors']:3d} err  {row['throughput_per_s'] or 0:8.2f}/s"
+                      f"  p50 {row['p50_ms']} p95 {row['p95_ms']} p99 {row['p99_ms']} ms  rss {row['peak_rss_mb']} MB",
+                      file=sys.stderr)
+        requests_served = server.counts
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "options": asdict(opts),
+        "mock": asdict(mock),
+        "mock_requests": requests_served,
+        "scenarios": rows,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(rows, json.load(f).get("scenarios", []), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 1 if any("error" in row or row.get("budget_violations") for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+import dataclasses
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from formagent.config import data_dir
+from formagent.providers import ChatRequest, ChatResult
+
+TOUCH_BATCH = 64  # memory hits whose `accessed` time is written back to SQLite in one statement
+RECOUNT_EVERY = 256  # writes between re-reading entry/byte totals (other processes share the file)
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def cache_key(agent_id: str, req: ChatRequest) -> str:
+    """Content address of one agent call: same inputs -> same key, across processes."""
+    ident = {
+        "agent_id": agent_id,
+        "model": req.model,
+        "temperature": req.temperature,
+        "max_tokens": req.max_tokens,
+        "system": _sha256(req.system_prompt),
+        "user": _sha256(req.user_prompt),
+    }
+    if req.context:  # absent key keeps entries written before requests carried a context
+        ident["context"] = _sha256(req.context)
+    return _sha256(json.dumps(ident, sort_keys=True))
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    memory_hits: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+# =========================
+# Response Cache (in-memory LRU in front of SQLite)
+# =========================
+class ResponseCache:
+    """
+    Persistent content-addressed store of ChatResults. Reads hit the in-memory LRU
+    first, then SQLite. Entries expire after `ttl_s`; the disk store is trimmed
+    (least recently used first) to `max_entries` / `max_bytes` on write. Memory hits
+    still count as uses on disk: their access times are written back in batches.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl_s: float = 7 * 24 * 3600,
+        max_entries: int = 5000,
+        max_bytes: int = 256 * 1024 * 1024,
+        memory_entries: int = 256,
+    ):
+        self.path = path or os.path.join(data_dir(), "responses.sqlite3")
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self.stats = CacheStats()
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (created, ChatResult)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, created REAL NOT NULL, accessed REAL NOT NULL,"
+            " size INTEGER NOT NULL, payload TEXT NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses(created)")
+        self._touched: Dict[str, float] = {}  # key -> last memory hit, not yet written to SQLite
+        self._writes = 0
+        self._count, self._bytes = self._totals()
+
+    def get(self, key: str) -> Optional[ChatResult]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[0] <= self.ttl_s:
+                self._memory.move_to_end(key)
+                self._touched[key] = now
+                if len(self._touched) >= TOUCH_BATCH:
+                    self._flush_touched()
+                self.stats.hits += 1
+                self.stats.memory_hits += 1
+                return entry[1]
+            row = self._db.execute("SELECT created, payload FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[0] > self.ttl_s:
+                if row is not None:
+                    self._delete([(key, len(row[1]))])
+                self._memory.pop(key, None)
+                self.stats.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            result = ChatResult(**json.loads(row[1]))
+            self._remember(key, row[0], result)
+            self.stats.hits += 1
+            return result
+
+    def put(self, key: str, result: ChatResult) -> None:
+        payload = json.dumps(dataclasses.asdict(result), ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            old = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, created, accessed, size, payload) VALUES (?, ?, ?, ?, ?)",
+                (key, now, now, len(payload), payload),
+            )
+            self._touched.pop(key, None)
+            if old is None:
+                self._count += 1
+            self._bytes += len(payload) - (old[0] if old else 0)
+            self._remember(key, now, result)
+            self._writes += 1
+            if self._writes % RECOUNT_EVERY == 0:
+                self._count, self._bytes = self._totals()
+            self._trim()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._memory.clear()
+            self._touched.clear()
+            self._count = self._bytes = 0
+
+    def usage(self) -> Dict[str, int]:
+        with self._lock:
+            self._flush_touched()
+            count, size = self._totals()
+        return {"entries": count, "bytes": size, "memory_entries": len(self._memory)}
+
+    def _totals(self) -> Tuple[int, int]:
+        return self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+
+    def _flush_touched(self) -> None:
+        if self._touched:
+            self._db.executemany("UPDATE responses SET accessed = ? WHERE key = ?", [(t, k) for k, t in self._touched.items()])
+            self._touched.clear()
+
+    def _delete(self, rows: List[Tuple[str, int]]) -> None:
+        """Delete (key, size) rows, keeping the running totals and eviction count in step."""
+        if not rows:
+            return
+        self._db.executemany("DELETE FROM responses WHERE key = ?", [(k,) for k, _ in rows])
+        self._count -= len(rows)
+        self._bytes -= sum(size for _, size in rows)
+        self.stats.evictions += len(rows)
+        for key, _ in rows:
+            self._memory.pop(key, None)
+            self._touched.pop(key, None)
+
+    def _remember(self, key: str, created: float, result: ChatResult) -> None:
+        self._memory[key] = (created, result)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _trim(self) -> None:
+        cutoff = time.time() - self.ttl_s
+        self._delete(self._db.execute("SELECT key, size FROM responses WHERE created < ?", (cutoff,)).fetchall())
+        if self._count <= self.max_entries and self._bytes <= self.max_bytes:
+            return
+        self._flush_touched()  # memory hits must count before choosing what is least recently used
+        while self._count > self.max_entries or self._bytes > self.max_bytes:
+            # Drop least recently used rows in batches of ~10% until within limits.
+            excess = max(self._count - self.max_entries, self._count // 10, 1)
+            rows = self._db.execute("SELECT key, size FROM responses ORDER BY accessed ASC LIMIT ?", (excess,)).fetchall()
+            if not rows:
+                self._count, self._bytes = self._totals()
+                break
+            self._delete(rows)
@@ -0,0 +1,130 @@
+import re
+from typing import List, Tuple
+
+
+# Context window (tokens) by model-name prefix; longest matching prefix wins.
+CONTEXT_WINDOWS: Tuple[Tuple[str, int], ...] = (
+    ("gemini", 1_048_576),
+    ("gpt-4.1", 1_047_576),
+    ("gpt-4o", 128_000),
+    ("gpt-5", 400_000),
+    ("gpt", 128_000),
+    ("claude", 200_000),
+    ("grok-4", 256_000),
+    ("grok", 131_072),
+)
+DEFAULT_CONTEXT = 128_000
+SAFETY_MARGIN = 0.05  # estimator error headroom
+
+HEADING_RE = re.compile(r"^(?=#{1,6}\s)", re.MULTILINE)
+FENCE_RE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+LINE_RE = re.compile(r"[^\n]*\n|[^\n]+")
+PARAGRAPH_RE = re.compile(r"\n\s*\n")
+CJK_RE = re.compile(r"[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap estimate: ~1 token per CJK character, ~4 characters per token otherwise."""
+    if not text:
+        return 0
+    cjk = len(CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def context_window(model: str) -> int:
+    name = model.lower()
+    best = ("", DEFAULT_CONTEXT)
+    for prefix, size in CONTEXT_WINDOWS:
+        if name.startswith(prefix) and len(prefix) > len(best[0]):
+            best = (prefix, size)
+    return best[1]
+
+
+def chunk_budget(model: str, max_tokens: int, overhead_tokens: int, output_ratio: float = 1.0) -> int:
+    """
+    Input tokens one chunk may carry: what fits in the context next to the prompt
+    overhead and reserved output, and no more than the output budget can cover
+    (`output_ratio` = expected output tokens per input token for this agent).
+    """
+    room = int(context_window(model) * (1 - SAFETY_MARGIN)) - max_tokens - overhead_tokens
+    by_output = int(max_tokens / output_ratio) if output_ratio > 0 else room
+    return max(256, min(room, by_output))
+
+
+# =========================
+# Splitting (Markdown sections -> paragraphs -> lines -> characters)
+# =========================
+def closes_fence(line: str, fence: str) -> bool:
+    """Whether `line` closes a code block opened with `fence` (same character, at least as long)."""
+    s = line.strip()
+    return len(s) >= len(fence) and not s.strip(fence[0])
+
+
+def split_headings(text: str) -> List[str]:
+    """
+    Cut `text` before every Markdown heading line, except inside fenced code blocks
+    (a `# comment` in a code sample is not a heading). The pieces concatenate to `text`.
+    """
+    if "```" not in text and "~~~" not in text:
+        return HEADING_RE.split(text)
+    pieces: List[str] = []
+    buf: List[str] = []
+    fence = ""
+    for line in LINE_RE.findall(text):
+        if fence:
+            if closes_fence(line, fence):
+                fence = ""
+        else:
+            m = FENCE_RE.match(line)
+            if m:
+                fence = m.group(1)
+            elif buf and HEADING_RE.match(line):
+                pieces.append("".join(buf))
+                buf = []
+        buf.append(line)
+    if buf:
+        pieces.append("".join(buf))
+    return pieces
+
+
+def _split_oversize(block: str, budget: int) -> List[str]:
+    if estimate_tokens(block) <= budget:
+        return [block]
+    for pattern in (PARAGRAPH_RE, re.compile(r"\n")):
+        parts = [p for p in pattern.split(block) if p.strip()]
+        if len(parts) > 1:
+            out: List[str] = []
+            for p in parts:
+                out.extend(_split_oversize(p, budget))
+            return out
+    # A single line longer than the budget: cut by characters (CJK-safe upper bound).
+    step = max(1, budget)
+    return [block[i:i + step] for i in range(0, len(block), step)]
+
+
+def split_markdown(text: str, budget: int) -> List[str]:
+    """
+    Split on Markdown heading boundaries and greedily pack whole sections into
+    chunks of at most `budget` estimated tokens. Sections larger than the budget
+    fall back to paragraph, line and finally character splits.
+    """
+    if estimate_tokens(text) <= budget:
+        return [text]
+    pieces: List[str] = []
+    for section in split_headings(text):
+        if section.strip():
+            pieces.extend(_split_oversize(section, budget))
+
+    chunks: List[str] = []
+    current: List[str] = []
+    used = 0
+    for piece in pieces:
+        cost = estimate_tokens(piece)
+        if current and used + cost > budget:
+            chunks.append("\n\n".join(current))
+            current, used = [], 0
+        current.append(piece.strip("\n"))
+        used += cost
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
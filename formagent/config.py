@@ -0,0 +1,8 @@
+import os
+
+
+def data_dir() -> str:
+    """Writable directory for local stores (cache, runs). Override with FORMAGENT_DATA_DIR."""
+    path = os.getenv("FORMAGENT_DATA_DIR") or os.path.join(os.path.expanduser("~"), ".formagent")
+    os.makedirs(path, exist_ok=True)
+    return path
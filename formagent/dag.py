@@ -0,0 +1,147 @@
+import json
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Mapping, Optional, Sequence, Set
+
+from formagent.cache import ResponseCache
+from formagent.executor import StepResult, run_step
+from formagent.providers import ChatRequest, ProviderPool
+from formagent.routing import Router
+from formagent.run_store import RunStore, StepRecord, content_hash
+from formagent.validation import Validator
+
+
+# What happened to each step of an incremental re-run.
+REUSED = "reused"  # inputs unchanged: stored output kept, no call
+RERUN = "rerun"  # inputs changed: re-ran and the output changed, so its dependents are checked next
+UNCHANGED = "unchanged"  # inputs changed but the re-run produced the same output: dependents stay clean
+STALE = "stale"  # inputs changed but the step has no recipe: it keeps its old output
+FAILED = "failed"
+
+
+@dataclass(frozen=True)
+class StepRecipe:
+    """What a step needs to run again once its upstream outputs change."""
+
+    agent_id: str
+    request: ChatRequest  # user_prompt keeps "{field}" where the upstream output goes
+    field: str
+
+    def to_json(self) -> str:
+        r = self.request
+        body = {
+            "agent_id": self.agent_id,
+            "field": self.field,
+            "model": r.model,
+            "user_prompt": r.user_prompt,
+            "system_prompt": r.system_prompt,
+            "max_tokens": r.max_tokens,
+            "temperature": r.temperature,
+        }
+        if r.context:
+            body["context"] = r.context
+        return json.dumps(body, ensure_ascii=False, sort_keys=True)
+
+    @classmethod
+    def from_json(cls, body: str) -> "StepRecipe":
+        d = json.loads(body)
+        req = ChatRequest(
+            model=d["model"],
+            user_prompt=d["user_prompt"],
+            system_prompt=d["system_prompt"],
+            max_tokens=d["max_tokens"],
+            temperature=d["temperature"],
+            context=d.get("context", ""),
+        )
+        return cls(agent_id=d["agent_id"], request=req, field=d["field"])
+
+
+@dataclass(frozen=True)
+class StepOutcome:
+    step_index: int
+    agent_id: str
+    action: str
+    result: Optional[StepResult] = None  # set for re-run steps
+
+
+# =========================
+# Dependency bookkeeping over a run's recorded steps
+# =========================
+def dependents(steps: Sequence[StepRecord], index: int) -> Set[int]:
+    """Every step that consumes `index`'s output, directly or through other steps."""
+    out: Set[int] = set()
+    frontier = {index}
+    for s in sorted(steps, key=lambda s: s.step_index):  # deps always point to earlier steps
+        if frontier.intersection(s.deps):
+            out.add(s.step_index)
+            frontier.add(s.step_index)
+    return out
+
+
+def dirty_steps(steps: Sequence[StepRecord]) -> List[int]:
+    """Steps whose recorded inputs no longer match their upstream steps' current outputs."""
+    final: Dict[int, str] = {s.step_index: s.final_hash for s in steps}
+    return [
+        s.step_index
+        for s in sorted(steps, key=lambda s: s.step_index)
+        if s.deps and tuple(final.get(d, "") for d in s.deps) != s.inputs
+    ]
+
+
+def stale_steps(steps: Sequence[StepRecord]) -> List[int]:
+    """Dirty steps plus everything downstream of them: what an incremental re-run has to look at."""
+    stale: Set[int] = set()
+    for i in dirty_steps(steps):
+        stale.add(i)
+        stale |= dependents(steps, i)
+    return sorted(stale)
+
+
+# =========================
+# Incremental re-execution
+# =========================
+def rerun_dirty(
+    pool: ProviderPool,
+    store: RunStore,
+    run_id: str,
+    api_keys: Mapping[str, str],
+    cache: Optional[ResponseCache] = None,
+    router: Optional[Router] = None,
+    validator: Optional[Validator] = None,
+    on_step: Optional[Callable[[int, ChatRequest, StepResult], None]] = None,
+) -> List[StepOutcome]:
+    """
+    Bring a run up to date after an edit: walk its steps in order and re-run only those
+    whose upstream outputs changed since they ran. A re-run that reproduces its old
+    output stops the change from propagating, so a small correction typically re-runs
+    one or two agents. Re-running a step replaces its output (and drops any edit of it).
+    Stops at the first failure; the failed step and those after it keep their old outputs
+    and stay dirty, so the next call picks up where this one stopped.
+    """
+    steps = store.steps(run_id)
+    final: Dict[int, str] = {s.step_index: s.final_hash for s in steps}
+    outcomes: List[StepOutcome] = []
+    for s in steps:
+        current = tuple(final.get(d, "") for d in s.deps)
+        if not s.deps or current == s.inputs:
+            outcomes.append(StepOutcome(s.step_index, s.agent_id, REUSED))
+            continue
+        if not s.recipe_hash:
+            outcomes.append(StepOutcome(s.step_index, s.agent_id, STALE))
+            continue
+        recipe_json = store.text(s.recipe_hash)
+        recipe = StepRecipe.from_json(recipe_json)
+        upstream = "\n\n".join(store.text(h) for h in current)
+        req, r = run_step(pool, recipe.agent_id, recipe.request, recipe.field, upstream, api_keys,
+                          cache, router, validator)
+        if on_step is not None:
+            on_step(s.step_index, req, r)
+        if not r.ok:
+            outcomes.append(StepOutcome(s.step_index, s.agent_id, FAILED, r))
+            break
+        store.record_step(run_id, s.step_index, s.agent_id, req.user_prompt, r.result, recipe=recipe_json, deps=s.deps)
+        new_hash = content_hash(r.result.text)
+        # Compare with what dependents consumed (the edit, if any), not the raw output: reproducing
+        # the raw output of an edited step drops the edit, which is a change downstream.
+        outcomes.append(StepOutcome(s.step_index, s.agent_id, UNCHANGED if new_hash == s.final_hash else RERUN, r))
+        final[s.step_index] = new_hash
+    return outcomes
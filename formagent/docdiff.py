@@ -0,0 +1,285 @@
+import re
+from dataclasses import dataclass
+from typing import Dict, Hashable, List, Sequence, Tuple
+
+from formagent.chunking import split_headings
+
+
+Opcode = Tuple[str, int, int, int, int]  # (tag, i1, i2, j1, j2) like difflib: equal/replace/delete/insert
+
+SECTION_NUMBER_RE = re.compile(r"^[\d.\s)（）()、]+")
+
+
+# =========================
+# Linear-space Myers diff (divide and conquer on the middle snake)
+# =========================
+def _middle_snake(a: Sequence[int], a0: int, a1: int, b: Sequence[int], b0: int, b1: int) -> Tuple[int, int, int, int]:
+    """Return (x_start, y_start, x_end, y_end) of the middle snake, relative to (a0, b0)."""
+    n, m = a1 - a0, b1 - b0
+    delta = n - m
+    odd = delta & 1
+    limit = (n + m + 1) // 2 + 1
+    vf = [0] * (2 * limit + 1)
+    vb = [0] * (2 * limit + 1)
+    for d in range(limit):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and vf[k - 1] < vf[k + 1]):
+                x = vf[k + 1]
+            else:
+                x = vf[k - 1] + 1
+            y = x - k
+            xs, ys = x, y
+            while x < n and y < m and a[a0 + x] == b[b0 + y]:
+                x += 1
+                y += 1
+            vf[k] = x
+            c = delta - k
+            if odd and -(d - 1) <= c <= d - 1 and x + vb[c] >= n:
+                return xs, ys, x, y
+        for c in range(-d, d + 1, 2):
+            if c == -d or (c != d and vb[c - 1] < vb[c + 1]):
+                x = vb[c + 1]
+            else:
+                x = vb[c - 1] + 1
+            y = x - c
+            xs, ys = x, y
+            while x < n and y < m and a[a1 - 1 - x] == b[b1 - 1 - y]:
+                x += 1
+                y += 1
+            vb[c] = x
+            k = delta - c
+            if not odd and -d <= k <= d and vf[k] + x >= n:
+                return n - x, m - y, n - xs, m - ys
+    raise AssertionError("middle snake not found")  # unreachable for valid input
+
+
+def diff_sequences(a: Sequence[Hashable], b: Sequence[Hashable]) -> List[Opcode]:
+    """
+    Minimal edit script between `a` and `b` as difflib-style opcodes, in O((N+M)·D)
+    time and O(N+M) space. Iterative, so very long documents do not hit the recursion limit.
+    """
+    ids: Dict[Hashable, int] = {}
+    ia = [ids.setdefault(x, len(ids)) for x in a]
+    ib = [ids.setdefault(x, len(ids)) for x in b]
+    raw: List[Tuple[str, int, int, int, int]] = []
+    stack = [(0, len(ia), 0, len(ib))]
+    while stack:
+        a0, a1, b0, b1 = stack.pop()
+        while a0 < a1 and b0 < b1 and ia[a0] == ib[b0]:  # common prefix
+            raw.append(("equal", a0, a0 + 1, b0, b0 + 1))
+            a0 += 1
+            b0 += 1
+        s1, s2 = a1, b1
+        while a0 < a1 and b0 < b1 and ia[a1 - 1] == ib[b1 - 1]:  # common suffix
+            a1 -= 1
+            b1 -= 1
+        if a1 > a0 and b1 > b0:
+            xs, ys, xe, ye = _middle_snake(ia, a0, a1, ib, b0, b1)
+            # Solve the left box first: the stack pops the last push first.
+            stack.append((a1, s1, b1, s2))  # suffix (all equal, emitted via the prefix loop)
+            stack.append((a0 + xe, a1, b0 + ye, b1))
+            stack.append((a0 + xs, a0 + xe, b0 + ys, b0 + ye))  # the snake itself
+            stack.append((a0, a0 + xs, b0, b0 + ys))
+            continue
+        if a1 > a0:
+            raw.append(("delete", a0, a1, b0, b0))
+        if b1 > b0:
+            raw.append(("insert", a1, a1, b0, b1))
+        if s1 > a1:
+            raw.append(("equal", a1, s1, b1, s2))
+    return _merge(raw)
+
+
+def _merge(raw: List[Opcode]) -> List[Opcode]:
+    """Coalesce adjacent ops; delete+insert at the same spot becomes replace."""
+    out: List[List] = []
+    for tag, i1, i2, j1, j2 in raw:
+        if i1 == i2 and j1 == j2:
+            continue
+        if out:
+            prev = out[-1]
+            if prev[0] == tag and prev[2] == i1 and prev[4] == j1:
+                prev[2], prev[4] = i2, j2
+                continue
+            if prev[0] != "equal" and tag != "equal" and prev[2] == i1 and prev[4] == j1:
+                prev[0], prev[2], prev[4] = "replace", i2, j2
+                continue
+        out.append([tag, i1, i2, j1, j2])
+    return [tuple(o) for o in out]
+
+
+# =========================
+# Section alignment
+# =========================
+@dataclass(frozen=True)
+class Section:
+    title: str
+    key: str  # normalized title used for alignment
+    start: int  # 0-based line number of the section's first line in the document
+    lines: Tuple[str, ...]
+
+
+def _section_key(title: str) -> str:
+    return " ".join(SECTION_NUMBER_RE.sub("", title.lstrip("#").strip()).lower().split())
+
+
+def split_sections(text: str) -> List[Section]:
+    sections: List[Section] = []
+    line_no = 0
+    for block in split_headings(text):
+        if not block:
+            continue
+        lines = tuple(block.split("\n"))
+        if block.endswith("\n"):
+            lines = lines[:-1]
+        first = lines[0] if lines else ""
+        title = first.lstrip("#").strip() if first.startswith("#") else ""
+        sections.append(Section(title=title, key=_section_key(title), start=line_no, lines=lines))
+        line_no += len(lines)
+    return sections
+
+
+def align_sections(old: List[Section], new: List[Section]) -> List[Tuple[int, int]]:
+    """(old index | -1, new index | -1) pairs in document order; unmatched sections pair with -1."""
+    pairs: List[Tuple[int, int]] = []
+    for tag, i1, i2, j1, j2 in diff_sequences([s.key for s in old], [s.key for s in new]):
+        if tag == "equal":
+            pairs.extend(zip(range(i1, i2), range(j1, j2)))
+            continue
+        common = min(i2 - i1, j2 - j1) if tag == "replace" else 0  # renamed sections pair up in order
+        pairs.extend(zip(range(i1, i1 + common), range(j1, j1 + common)))
+        pairs.extend((i, -1) for i in range(i1 + common, i2))
+        pairs.extend((-1, j) for j in range(j1 + common, j2))
+    return pairs
+
+
+# =========================
+# Hunks -> compact model input
+# =========================
+@dataclass(frozen=True)
+class Hunk:
+    section: str
+    old_start: int  # 0-based document line numbers, end exclusive
+    old_end: int
+    new_start: int
+    new_end: int
+    old_lines: Tuple[str, ...]
+    new_lines: Tuple[str, ...]
+
+
+@dataclass(frozen=True)
+class DiffPlan:
+    hunks: Tuple[Hunk, ...]
+    old_text: str  # what diff_agent receives as {old_text}
+    new_text: str  # ... and as {new_text}
+    old_total_lines: int
+    new_total_lines: int
+    changed_lines: int  # deleted + inserted lines
+    source_chars: int = 0  # len(old) + len(new) before reduction
+    context: int = 2
+    reduced: bool = True  # False: the hunks were not smaller, old_text/new_text are the full versions
+
+    @property
+    def unchanged(self) -> bool:
+        return not self.hunks
+
+    @property
+    def sent_ratio(self) -> float:
+        total = len(self.old_text) + len(self.new_text)
+        return total / max(1, self.source_chars)
+
+
+def _norm(line: str) -> str:
+    return " ".join(line.split())  # PDF re-extraction often changes spacing only
+
+
+def _section_hunks(title: str, old: Section, new: Section, context: int) -> Tuple[List[Hunk], int]:
+    ops = diff_sequences([_norm(l) for l in old.lines], [_norm(l) for l in new.lines])
+    changed = sum((i2 - i1) + (j2 - j1) for tag, i1, i2, j1, j2 in ops if tag != "equal")
+    hunks: List[Hunk] = []
+    group: List[Opcode] = []
+    for op in ops:
+        tag, i1, i2, j1, j2 = op
+        if tag == "equal":
+            if group and i2 - i1 > 2 * context:
+                hunks.append(_hunk(title, old, new, group, context))
+                group = []
+            continue
+        group.append(op)
+    if group:
+        hunks.append(_hunk(title, old, new, group, context))
+    return hunks, changed
+
+
+def _hunk(title: str, old: Section, new: Section, group: List[Opcode], context: int) -> Hunk:
+    i1 = max(0, group[0][1] - context)
+    j1 = max(0, group[0][3] - context)
+    i2 = min(len(old.lines), group[-1][2] + context)
+    j2 = min(len(new.lines), group[-1][4] + context)
+    return Hunk(
+        section=title,
+        old_start=old.start + i1,
+        old_end=old.start + i2,
+        new_start=new.start + j1,
+        new_end=new.start + j2,
+        old_lines=old.lines[i1:i2],
+        new_lines=new.lines[j1:j2],
+    )
+
+
+def _whole(section: Section, side: str) -> Hunk:
+    empty = Section(title=section.title, key=section.key, start=0, lines=())
+    old, new = (section, empty) if side == "old" else (empty, section)
+    return Hunk(section.title, old.start, old.start + len(old.lines), new.start, new.start + len(new.lines), old.lines, new.lines)
+
+
+def render_hunks(hunks: Sequence[Hunk], side: str, context: int, first: int = 1) -> str:
+    """One side ("old" / "new") of `hunks` as diff_agent input, numbered from `first`."""
+    blocks = [f"（僅列出變更處及前後各 {context} 行；未變更內容已省略。本段共 {len(hunks)} 處變更。）"]
+    for n, h in enumerate(hunks, start=first):
+        lines = h.old_lines if side == "old" else h.new_lines
+        start, end = (h.old_start, h.old_end) if side == "old" else (h.new_start, h.new_end)
+        where = f"第 {start + 1}–{end} 行" if lines else "（此版本無對應內容）"
+        blocks.append(f"【變更 {n}｜章節：{h.section or '（前言）'}｜{where}】\n" + "\n".join(lines))
+    return "\n\n".join(blocks)
+
+
+def plan_diff(old_text: str, new_text: str, context: int = 2) -> DiffPlan:
+    """
+    Align sections by heading, diff each aligned pair line by line, and keep only the
+    changed hunks plus `context` lines around them. Hunks share numbering across both
+    sides so the model can match 【變更 n】 in {old_text} to 【變更 n】 in {new_text}.
+    When the rendered hunks are not smaller than the two versions (short or mostly
+    rewritten documents), the plan sends the full texts instead, so sent_ratio <= 1.
+    """
+    old_secs, new_secs = split_sections(old_text), split_sections(new_text)
+    hunks: List[Hunk] = []
+    changed = 0
+    for oi, ni in align_sections(old_secs, new_secs):
+        if ni < 0:
+            hunks.append(_whole(old_secs[oi], "old"))
+            changed += len(old_secs[oi].lines)
+        elif oi < 0:
+            hunks.append(_whole(new_secs[ni], "new"))
+            changed += len(new_secs[ni].lines)
+        else:
+            o, n = old_secs[oi], new_secs[ni]
+            sec_hunks, sec_changed = _section_hunks(n.title or o.title, o, n, context)
+            hunks.extend(sec_hunks)
+            changed += sec_changed
+    sent_old = render_hunks(hunks, "old", context) if hunks else ""
+    sent_new = render_hunks(hunks, "new", context) if hunks else ""
+    reduced = len(sent_old) + len(sent_new) < len(old_text) + len(new_text)
+    if hunks and not reduced:
+        sent_old, sent_new = old_text, new_text
+    return DiffPlan(
+        hunks=tuple(hunks),
+        old_text=sent_old,
+        new_text=sent_new,
+        old_total_lines=sum(len(s.lines) for s in old_secs),
+        new_total_lines=sum(len(s.lines) for s in new_secs),
+        changed_lines=changed,
+        source_chars=len(old_text) + len(new_text),
+        context=context,
+        reduced=reduced or not hunks,
+    )
@@ -0,0 +1,196 @@
+"""
+Raw form text -> pdf_spec schema. Most forms are written with the same few conventions
+(`Name: ______`, `Type: [New/Update]`, `[ ] I agree`, `Date: YYYY-MM-DD`), so a rule pass
+classifies those locally; only lines that look like fields but match no rule are sent to
+form_structure_agent, in one request.
+
+    extraction, step = extract_structure(pool, registry, raw_text, api_keys)
+    spec_markdown = extraction.schema.to_spec()
+"""
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from formagent.cache import ResponseCache
+from formagent.executor import StepResult, build_request, run_request
+from formagent.forms import FormField, FormSchema, SpecError, field_name, parse_spec
+from formagent.providers import ProviderError, ProviderPool
+from formagent.registry import AgentRegistry
+from formagent.routing import Router
+from formagent.tracing import span
+from formagent.validation import Validator
+
+STRUCTURE_AGENT = "form_structure_agent"
+
+BLANK = r"(?:_{3,}|\.{4,}|…{2,})"
+CHECKBOX = r"(?:\[\s?\]|\(\s\)|☐|□)"
+BLANK_RE = re.compile(rf"^{BLANK}$")
+CHECKBOX_RE = re.compile(rf"^{CHECKBOX}$")
+LEADING_CHECKBOX_RE = re.compile(rf"^{CHECKBOX}\s*(?P<label>\S.*)$")
+INLINE_CHOICES_RE = re.compile(rf"{CHECKBOX}\s*([^☐□\[\](]+)")
+BRACKET_OPTIONS_RE = re.compile(r"^[\[(（]\s*([^\[\]()（）]+?)\s*[\])）]$")
+OPTION_SPLIT_RE = re.compile(r"\s*[/|,、]\s*")
+LABELED_RE = re.compile(r"^(?P<label>[^:：]{1,80}?)\s*[:：]\s*(?P<rest>.*)$")
+TRAILING_BLANK_RE = re.compile(rf"^(?P<label>.*?\S)\s*{BLANK}$")
+DATE_PATTERN_RE = re.compile(
+    r"(?i)\b(?:yyyy|yy)[-/.](?:mm)[-/.](?:dd)\b|\b(?:mm|dd)[-/.](?:dd|mm)[-/.](?:yyyy|yy)\b"
+    r"|_{1,4}\s*/\s*_{1,4}\s*/\s*_{2,4}|年\s*_*\s*月\s*_*\s*日"
+)
+DATE_LABEL_RE = re.compile(r"(?i)\bdate\b|\bdob\b|日期|生日")
+PAREN_HINT_RE = re.compile(r"\s*[(（][^()（）]*[)）]\s*$")
+NUMBERING_RE = re.compile(r"^(?:\d{1,3}[.)]|[a-zA-Z][.)]|[-*•])\s+")
+REQUIRED_RE = re.compile(r"\s*(?:\*|[(（](?:required|必填)[)）])\s*$", re.I)
+HEADING_RE = re.compile(r"^#{1,6}\s+(?P<title>.+?)\s*#*$")
+
+
+# =========================
+# Rule pass (local, no tokens)
+# =========================
+@dataclass(frozen=True)
+class ExtractedField:
+    field: FormField
+    line: int  # 1-based line of the raw text
+    rule: str  # which rule classified it ("agent" when form_structure_agent did)
+
+
+@dataclass
+class Extraction:
+    title: str = "Form"
+    fields: List[ExtractedField] = field(default_factory=list)
+    unresolved: List[Tuple[int, str]] = field(default_factory=list)  # (line, text) no rule classified
+
+    @property
+    def local_fields(self) -> int:
+        return sum(f.rule != "agent" for f in self.fields)
+
+    @property
+    def schema(self) -> FormSchema:
+        """Fields in document order; repeated names get a numeric suffix."""
+        seen: Dict[str, int] = {}
+        fields = []
+        for ef in sorted(self.fields, key=lambda ef: ef.line):
+            f = ef.field
+            seen[f.name] = seen.get(f.name, 0) + 1
+            if seen[f.name] > 1:
+                f = FormField(name=f"{f.name}_{seen[f.name]}", label=f.label, type=f.type, options=f.options, required=f.required)
+            fields.append(f)
+        return FormSchema(title=self.title, fields=tuple(fields))
+
+
+def _clean_label(label: str) -> Tuple[str, bool]:
+    label = NUMBERING_RE.sub("", label.strip())
+    required = bool(REQUIRED_RE.search(label))
+    label = REQUIRED_RE.sub("", label)
+    return PAREN_HINT_RE.sub("", label).strip() or label.strip(), required
+
+
+def _options(text: str) -> Tuple[str, ...]:
+    return tuple(dict.fromkeys(o.strip() for o in OPTION_SPLIT_RE.split(text) if o.strip()))
+
+
+def classify_line(line: str) -> Optional[Tuple[str, str, Tuple[str, ...], str]]:
+    """(label, type, options, rule) for a line that is clearly one field, else None."""
+    m = LEADING_CHECKBOX_RE.match(line)
+    if m and not INLINE_CHOICES_RE.search(m.group("label")):
+        return m.group("label"), "checkbox", (), "leading_checkbox"
+    m = LABELED_RE.match(line)
+    if m:
+        label, rest = m.group("label"), m.group("rest").strip()
+    else:
+        m = TRAILING_BLANK_RE.match(line)
+        if not m:
+            return None
+        label, rest = m.group("label"), "______"
+    if DATE_PATTERN_RE.search(rest) or DATE_PATTERN_RE.search(label):
+        return label, "date", (), "date_pattern"
+    if CHECKBOX_RE.match(rest):
+        return label, "checkbox", (), "checkbox"
+    choices = [c.strip() for c in INLINE_CHOICES_RE.findall(rest) if c.strip()]
+    if len(choices) >= 2:
+        return label, "dropdown", tuple(dict.fromkeys(choices)), "checkbox_choices"
+    b = BRACKET_OPTIONS_RE.match(rest)
+    if b and len(_options(b.group(1))) >= 2:
+        return label, "dropdown", _options(b.group(1)), "bracket_options"
+    if not rest or BLANK_RE.match(rest):
+        return label, "date" if DATE_LABEL_RE.search(label) else "text", (), "date_label" if DATE_LABEL_RE.search(label) else "blank"
+    return None
+
+
+def extract_local(raw: str) -> Extraction:
+    """
+    One pass over the lines. The first heading (or the first plain line before any field)
+    is the title; `Label: value` lines no rule recognizes are left for the agent, and other
+    prose is ignored.
+    """
+    out = Extraction()
+    title = ""
+    for n, raw_line in enumerate(raw.splitlines(), 1):
+        line = raw_line.strip()
+        if not line:
+            continue
+        h = HEADING_RE.match(line)
+        if h:
+            title = title or h.group("title")
+            continue
+        hit = classify_line(line)
+        if hit is None:
+            if LABELED_RE.match(line):
+                out.unresolved.append((n, line))
+            elif not title and not out.fields:
+                title = line
+            continue
+        label, kind, options, rule = hit
+        label, required = _clean_label(label)
+        name = field_name(label)
+        if not name:
+            out.unresolved.append((n, line))
+            continue
+        out.fields.append(ExtractedField(FormField(name=name, label=label, type=kind, options=options, required=required), n, rule))
+    out.title = title or "Form"
+    return out
+
+
+# =========================
+# Agent fallback (only the unresolved lines)
+# =========================
+def _line_of(label: str, unresolved: List[Tuple[int, str]], fallback: int) -> int:
+    key = label.strip().lower()
+    return next((n for n, text in unresolved if key and key in text.lower()), fallback)
+
+
+def extract_structure(
+    pool: ProviderPool,
+    registry: AgentRegistry,
+    raw: str,
+    api_keys: Mapping[str, str],
+    cache: Optional[ResponseCache] = None,
+    router: Optional[Router] = None,
+    validator: Optional[Validator] = None,
+    model: Optional[str] = None,
+) -> Tuple[Extraction, Optional[StepResult]]:
+    """
+    Rule pass first; form_structure_agent sees only the lines it left unresolved, and
+    is not called at all when there are none. The StepResult is None without a call.
+    If the agent fails, the locally classified fields are still returned.
+    """
+    with span("form.extract", lines=raw.count("\n") + 1) as traced:
+        extraction = extract_local(raw)
+        traced.set(local_fields=len(extraction.fields), unresolved=len(extraction.unresolved))
+        if not extraction.unresolved or STRUCTURE_AGENT not in registry:
+            return extraction, None
+        lines = "\n".join(f"{n}: {text}" for n, text in extraction.unresolved)
+        req = build_request(registry.get(STRUCTURE_AGENT), {"form_lines": lines}, model=model)
+        try:
+            result = run_request(pool, req, api_keys, cache, STRUCTURE_AGENT, router, validator)
+        except ProviderError as e:
+            return extraction, StepResult(agent_id=STRUCTURE_AGENT, error=str(e))
+        try:
+            schema = parse_spec(result.text)
+        except SpecError as e:
+            return extraction, StepResult(agent_id=STRUCTURE_AGENT, error=f"unusable pdf_spec from {STRUCTURE_AGENT}: {e}")
+        last = extraction.unresolved[-1][0]
+        for i, f in enumerate(schema.fields, 1):
+            extraction.fields.append(ExtractedField(f, _line_of(f.label, extraction.unresolved, last + i), "agent"))
+        extraction.unresolved = []
+        traced.set(agent_fields=len(schema.fields))
+    return extraction, StepResult(agent_id=STRUCTURE_AGENT, result=result)
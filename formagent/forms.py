@@ -0,0 +1,576 @@
+"""
+Form specs (the `## pdf_spec` block of the Forms workspace) compiled once into a validated
+schema and a page layout, then filled for any number of records locally: no model call
+per form. fpdf2 is imported only when something is actually rendered.
+
+    schema = parse_spec(markdown)
+    layout = compile_layout(schema)
+    report = render_batch(layout, iter_records(open("portfolio.csv", "rb"), "portfolio.csv"), out_dir)
+"""
+import csv
+import datetime as dt
+import functools
+import io
+import json
+import os
+import pprint
+import re
+import time
+from dataclasses import dataclass, field
+from typing import IO, Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+import yaml
+
+FIELD_TYPES: Tuple[str, ...] = ("text", "dropdown", "checkbox", "date")
+SPEC_HEADING_RE = re.compile(r"^#{1,6}\s*pdf_spec\s*$", re.M | re.I)
+FENCE_RE = re.compile(r"^```[\w-]*\s*$", re.M)
+TRUE_VALUES = frozenset({"1", "true", "yes", "y", "x", "v", "✓", "✔", "on", "checked", "是", "有"})
+DATE_FORMATS: Tuple[str, ...] = ("%Y-%m-%d", "%Y/%m/%d", "%Y.%m.%d", "%Y%m%d", "%m/%d/%Y", "%d.%m.%Y", "%Y-%m-%dT%H:%M:%S")
+
+# Page geometry in mm (A4 portrait). Every row is the same height so a layout is pure arithmetic.
+PAGE_SIZES: Dict[str, Tuple[float, float]] = {"A4": (210.0, 297.0), "Letter": (215.9, 279.4)}
+MARGIN = 18.0
+TITLE_H = 16.0
+ROW_H = 13.0
+LABEL_W = 62.0
+BOX_H = 8.0
+CHECK_SIZE = 5.0
+FOOTER_H = 10.0
+
+# Unicode fonts tried in order when FORMAGENT_FORM_FONT is unset; core Helvetica (Latin-1 only) otherwise.
+FONT_CANDIDATES: Tuple[str, ...] = (
+    "/usr/share/fonts/truetype/noto/NotoSansTC-Regular.ttf",
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/arphic/uming.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/Library/Fonts/Arial Unicode.ttf",
+    "C:/Windows/Fonts/msjh.ttc",
+)
+
+
+class SpecError(ValueError):
+    """A pdf_spec that cannot be compiled into a form."""
+
+
+# =========================
+# Schema
+# =========================
+@dataclass(frozen=True)
+class FormField:
+    name: str
+    label: str
+    type: str
+    options: Tuple[str, ...] = ()
+    required: bool = False
+
+
+@dataclass(frozen=True)
+class FormSchema:
+    title: str
+    fields: Tuple[FormField, ...]
+
+    def to_dict(self) -> Dict[str, Any]:
+        fields = []
+        for f in self.fields:
+            d: Dict[str, Any] = {"label": f.label, "name": f.name, "type": f.type}
+            if f.options:
+                d["options"] = list(f.options)
+            if f.required:
+                d["required"] = True
+            fields.append(d)
+        return {"title": self.title, "fields": fields}
+
+    def to_spec(self) -> str:
+        """Canonical `## pdf_spec` block; parse_spec(schema.to_spec()) == schema."""
+        return "## pdf_spec\n" + yaml.safe_dump(self.to_dict(), allow_unicode=True, sort_keys=False, default_flow_style=None)
+
+
+def _spec_body(text: str) -> str:
+    m = SPEC_HEADING_RE.search(text)
+    body = text[m.end():] if m else text
+    nxt = re.search(r"^#{1,6}\s", body, re.M)
+    body = body[:nxt.start()] if nxt else body
+    fences = list(FENCE_RE.finditer(body))
+    if len(fences) >= 2:  # ```yaml ... ``` inside the section
+        body = body[fences[0].end():fences[1].start()]
+    return body
+
+
+def field_name(label: str) -> str:
+    return re.sub(r"\W+", "_", label.strip().lower()).strip("_")
+
+
+@functools.lru_cache(maxsize=64)
+def parse_spec(text: str) -> FormSchema:
+    """Validate a pdf_spec (Markdown section, fenced block or bare YAML) into a FormSchema."""
+    try:
+        data = yaml.load(_spec_body(text), Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+    except yaml.YAMLError as e:
+        raise SpecError(f"pdf_spec is not valid YAML: {e}") from e
+    if not isinstance(data, dict):
+        raise SpecError("pdf_spec must be a mapping with `title` and `fields`")
+    raw_fields = data.get("fields")
+    if not isinstance(raw_fields, list) or not raw_fields:
+        raise SpecError("pdf_spec needs a non-empty `fields` list")
+    fields: List[FormField] = []
+    seen: Dict[str, int] = {}
+    for i, raw in enumerate(raw_fields, 1):
+        if not isinstance(raw, dict):
+            raise SpecError(f"field #{i} must be a mapping")
+        label = str(raw.get("label") or raw.get("name") or "").strip()
+        name = str(raw.get("name") or field_name(label)).strip()
+        if not name:
+            raise SpecError(f"field #{i} has neither `label` nor `name`")
+        if name in seen:
+            raise SpecError(f"field #{i}: duplicate name `{name}` (first used by field #{seen[name]})")
+        seen[name] = i
+        kind = str(raw.get("type") or "text").strip().lower()
+        if kind not in FIELD_TYPES:
+            raise SpecError(f"field `{name}`: unknown type `{kind}` (expected one of {', '.join(FIELD_TYPES)})")
+        options = raw.get("options") or ()
+        if isinstance(options, str):
+            options = [o.strip() for o in re.split(r"[/,|]", options)]
+        options = tuple(str(o).strip() for o in options if str(o).strip())
+        if kind == "dropdown" and not options:
+            raise SpecError(f"field `{name}`: dropdown needs `options`")
+        if kind != "dropdown" and options:
+            raise SpecError(f"field `{name}`: only dropdown fields take `options`")
+        fields.append(FormField(name=name, label=label or name, type=kind, options=options, required=bool(raw.get("required"))))
+    return FormSchema(title=str(data.get("title") or "Form").strip(), fields=tuple(fields))
+
+
+# =========================
+# Layout (positions and pagination, computed once per schema)
+# =========================
+@dataclass(frozen=True)
+class FieldBox:
+    field: FormField
+    page: int  # 0-based within one form
+    y: float  # top of the row, mm
+    box_x: float
+    box_w: float
+    box_h: float
+
+
+@dataclass(frozen=True)
+class FormLayout:
+    schema: FormSchema
+    page_w: float
+    page_h: float
+    pages: int
+    boxes: Tuple[FieldBox, ...]
+
+    @property
+    def label_x(self) -> float:
+        return MARGIN
+
+    @property
+    def label_w(self) -> float:
+        return LABEL_W
+
+    def on_page(self, page: int) -> Tuple[FieldBox, ...]:
+        return tuple(b for b in self.boxes if b.page == page)
+
+
+@functools.lru_cache(maxsize=64)
+def compile_layout(schema: FormSchema, page_size: str = "A4") -> FormLayout:
+    page_w, page_h = PAGE_SIZES[page_size]
+    box_x = MARGIN + LABEL_W
+    box_w = page_w - MARGIN - box_x
+    boxes: List[FieldBox] = []
+    page, y = 0, MARGIN + TITLE_H
+    for f in schema.fields:
+        if y + ROW_H > page_h - MARGIN - FOOTER_H:
+            page, y = page + 1, MARGIN
+        if f.type == "checkbox":
+            boxes.append(FieldBox(f, page, y, box_x, CHECK_SIZE, CHECK_SIZE))
+        else:
+            boxes.append(FieldBox(f, page, y, box_x, box_w if f.type != "date" else min(box_w, 45.0), BOX_H))
+        y += ROW_H
+    return FormLayout(schema=schema, page_w=page_w, page_h=page_h, pages=page + 1, boxes=tuple(boxes))
+
+
+# =========================
+# Record values
+# =========================
+def field_value(f: FormField, raw: Any) -> Tuple[str, str]:
+    """(text to print, problem or "") for one record value."""
+    if raw is None or (isinstance(raw, str) and not raw.strip()):
+        return "", "required value missing" if f.required else ""
+    if f.type == "checkbox":
+        if isinstance(raw, bool):
+            return ("X" if raw else ""), ""
+        return ("X" if str(raw).strip().lower() in TRUE_VALUES else ""), ""
+    if f.type == "date":
+        if isinstance(raw, (dt.date, dt.datetime)):
+            return raw.strftime("%Y-%m-%d"), ""
+        text = str(raw).strip()
+        for fmt in DATE_FORMATS:
+            try:
+                return dt.datetime.strptime(text, fmt).strftime("%Y-%m-%d"), ""
+            except ValueError:
+                continue
+        return text, f"unrecognized date `{text}`"
+    text = str(raw).strip()
+    if f.type == "dropdown":
+        match = next((o for o in f.options if o.lower() == text.lower()), None)
+        return (match, "") if match is not None else (text, f"`{text}` is not one of: {', '.join(f.options)}")
+    return text, ""
+
+
+def iter_records(stream: IO[bytes], name: str = "") -> Iterator[Dict[str, Any]]:
+    """Rows of an uploaded CSV (default) or JSON Lines file (.jsonl / .ndjson), read lazily."""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if name.lower().endswith((".jsonl", ".ndjson")):
+        for line in text:
+            if line.strip():
+                yield json.loads(line)
+        return
+    yield from csv.DictReader(text)
+
+
+def _lookup(layout: FormLayout) -> Callable[[Mapping[str, Any]], Dict[str, Any]]:
+    """Map a record's keys (field names or labels, any case) onto field names."""
+    aliases: Dict[str, str] = {}
+    for f in layout.schema.fields:
+        aliases[f.name.lower()] = f.name
+        aliases.setdefault(f.label.strip().lower(), f.name)
+
+    def values(record: Mapping[str, Any]) -> Dict[str, Any]:
+        out: Dict[str, Any] = {}
+        for k, v in record.items():
+            name = aliases.get(str(k).strip().lower())
+            if name is not None:
+                out[name] = v
+        return out
+
+    return values
+
+
+# =========================
+# Rendering (fpdf2)
+# =========================
+def _font_path() -> str:
+    configured = os.getenv("FORMAGENT_FORM_FONT", "")
+    if configured:
+        return configured
+    return next((p for p in FONT_CANDIDATES if os.path.exists(p)), "")
+
+
+class FormRenderer:
+    """
+    Draws a compiled layout with fpdf2. Labels are fitted to their column once; per
+    record only the values are measured. One renderer serves a whole batch.
+    """
+
+    def __init__(self, layout: FormLayout, font_path: Optional[str] = None):
+        from fpdf import FPDF  # deferred: only rendering needs it (see bench.HEAVY_MODULES)
+
+        self._fpdf = FPDF
+        self.layout = layout
+        self.font_path = _font_path() if font_path is None else font_path
+        self.family = "Helvetica"
+        self.unicode = False
+        probe = self._new()
+        self._labels = {b.field.name: self._fit(probe, b.field.label, LABEL_W - 2, 10) for b in layout.boxes}
+        self._title = self._fit(probe, layout.schema.title, layout.page_w - 2 * MARGIN, 16, style="B")
+        self._hints = {b.field.name: self._hint(probe, b) for b in layout.boxes}
+
+    def _new(self):
+        pdf = self._fpdf(unit="mm", format=(self.layout.page_w, self.layout.page_h))
+        pdf.set_auto_page_break(False)
+        pdf.set_creator("FormAgent")
+        if self.font_path:
+            try:
+                pdf.add_font("FormFont", "", self.font_path)
+                pdf.add_font("FormFont", "B", self.font_path)
+                self.family, self.unicode = "FormFont", True
+            except Exception:  # unreadable or unsupported font file: fall back to the core font
+                self.font_path = ""
+        return pdf
+
+    def _safe(self, text: str) -> str:
+        return text if self.unicode else text.encode("latin-1", "replace").decode("latin-1")
+
+    def _fit(self, pdf, text: str, width: float, size: float, style: str = "", min_size: float = 7) -> Tuple[str, float]:
+        """Shrink to fit `width`, then truncate with an ellipsis."""
+        text = self._safe(text)
+        pdf.set_font(self.family, style, size)
+        while size > min_size and pdf.get_string_width(text) > width:
+            size -= 0.5
+            pdf.set_font(self.family, style, size)
+        if pdf.get_string_width(text) > width:
+            ell = "..." if not self.unicode else "…"
+            while text and pdf.get_string_width(text + ell) > width:
+                text = text[:-1]
+            text += ell
+        return text, size
+
+    def _hint(self, pdf, b: FieldBox) -> str:
+        if b.field.type == "dropdown":
+            hint = " / ".join(b.field.options)
+        elif b.field.type == "date":
+            hint = "YYYY-MM-DD"
+        else:
+            return ""
+        return self._fit(pdf, hint, b.box_w, 7, min_size=7)[0]
+
+    def draw(self, pdf, values: Mapping[str, Any], record_no: int = 0, problems: Optional[List[Tuple[int, str, str]]] = None) -> None:
+        layout = self.layout
+        for page in range(layout.pages):
+            pdf.add_page()
+            if page == 0:
+                text, size = self._title
+                pdf.set_font(self.family, "B", size)
+                pdf.text(MARGIN, MARGIN + 8, text)
+                pdf.set_draw_color(180, 180, 180)
+                pdf.line(MARGIN, MARGIN + 11, layout.page_w - MARGIN, MARGIN + 11)
+            pdf.set_draw_color(90, 90, 90)
+            for b in layout.on_page(page):
+                text, size = self._labels[b.field.name]
+                pdf.set_text_color(0, 0, 0)
+                pdf.set_font(self.family, "", size)
+                pdf.text(MARGIN, b.y + 5.5, text)
+                pdf.rect(b.box_x, b.y, b.box_w, b.box_h)
+                shown, problem = field_value(b.field, values.get(b.field.name))
+                if problem and problems is not None and len(problems) < 1000:
+                    problems.append((record_no, b.field.name, problem))
+                if shown and b.field.type == "checkbox":
+                    pdf.line(b.box_x + 1, b.y + 1, b.box_x + b.box_w - 1, b.y + b.box_h - 1)
+                    pdf.line(b.box_x + 1, b.y + b.box_h - 1, b.box_x + b.box_w - 1, b.y + 1)
+                elif shown:
+                    value, vsize = self._fit(pdf, shown, b.box_w - 3, 10)
+                    pdf.set_font(self.family, "", vsize)
+                    pdf.text(b.box_x + 1.5, b.y + 5.6, value)
+                hint = self._hints[b.field.name]
+                if hint:
+                    pdf.set_text_color(130, 130, 130)
+                    pdf.set_font(self.family, "", 7)
+                    pdf.text(b.box_x, b.y + b.box_h + 3, hint)
+            pdf.set_text_color(130, 130, 130)
+            pdf.set_font(self.family, "", 7)
+            footer = f"{layout.schema.title} - {f'#{record_no} - ' if record_no else ''}{page + 1}/{layout.pages}"
+            pdf.text(MARGIN, layout.page_h - MARGIN + 4, self._safe(footer))
+
+    def blank(self) -> bytes:
+        pdf = self._new()
+        self.draw(pdf, {})
+        return bytes(pdf.output())
+
+
+@dataclass
+class RenderReport:
+    files: List[str] = field(default_factory=list)
+    records: int = 0
+    pages: int = 0
+    seconds: float = 0.0
+    problems: List[Tuple[int, str, str]] = field(default_factory=list)  # (record #, field, problem); first 1000
+
+    @property
+    def records_per_s(self) -> float:
+        return self.records / self.seconds if self.seconds else 0.0
+
+
+def render_batch(
+    layout: FormLayout,
+    records: Iterable[Mapping[str, Any]],
+    out_dir: str,
+    per_file: int = 500,
+    basename: str = "forms",
+    font_path: Optional[str] = None,
+    on_progress: Optional[Callable[[int], None]] = None,
+) -> RenderReport:
+    """
+    Fill `layout` once per record. Records are consumed lazily and every `per_file`
+    forms are written out as one PDF, so memory stays flat for any batch size.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    start = time.perf_counter()
+    renderer = FormRenderer(layout, font_path)
+    values_of = _lookup(layout)
+    report = RenderReport()
+    pdf = None
+
+    def flush() -> None:
+        path = os.path.join(out_dir, f"{basename}-{len(report.files) + 1:04d}.pdf")
+        pdf.output(path)
+        report.files.append(path)
+
+    for record in records:
+        if pdf is None:
+            pdf = renderer._new()
+        report.records += 1
+        renderer.draw(pdf, values_of(record), report.records, report.problems)
+        report.pages += layout.pages
+        if report.records % per_file == 0:
+            flush()
+            pdf = None
+        if on_progress is not None and report.records % 50 == 0:
+            on_progress(report.records)
+    if pdf is not None:
+        flush()
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+# =========================
+# Source artifacts (same layout, for use outside the app)
+# =========================
+def _layout_rows(layout: FormLayout) -> List[Dict[str, Any]]:
+    return [
+        {
+            "name": b.field.name,
+            "label": b.field.label,
+            "type": b.field.type,
+            "options": list(b.field.options),
+            "page": b.page,
+            "x": round(b.box_x, 2),
+            "y": round(b.y, 2),
+            "w": round(b.box_w, 2),
+            "h": round(b.box_h, 2),
+        }
+        for b in layout.boxes
+    ]
+
+
+_PYTHON_TEMPLATE = '''"""
+__TITLE__: generated by FormAgent from a pdf_spec. Fills the form once per CSV row:
+
+    pip install fpdf2
+    python __MODULE__.py records.csv forms.pdf [font.ttf]
+"""
+import csv
+import sys
+
+from fpdf import FPDF
+
+TITLE = __TITLE_REPR__
+PAGE_W, PAGE_H, PAGES = __PAGE__
+MARGIN = __MARGIN__
+FIELDS = __FIELDS__
+TRUE_VALUES = __TRUE__
+
+
+def draw(pdf, family, record):
+    for page in range(PAGES):
+        pdf.add_page()
+        if page == 0:
+            pdf.set_font(family, "B", 16)
+            pdf.text(MARGIN, MARGIN + 8, TITLE)
+        for f in FIELDS:
+            if f["page"] != page:
+                continue
+            value = str(record.get(f["name"], record.get(f["label"], "")) or "").strip()
+            pdf.set_font(family, "", 10)
+            pdf.text(MARGIN, f["y"] + 5.5, f["label"])
+            pdf.rect(f["x"], f["y"], f["w"], f["h"])
+            if f["type"] == "checkbox":
+                if value.lower() in TRUE_VALUES:
+                    pdf.line(f["x"] + 1, f["y"] + 1, f["x"] + f["w"] - 1, f["y"] + f["h"] - 1)
+                    pdf.line(f["x"] + 1, f["y"] + f["h"] - 1, f["x"] + f["w"] - 1, f["y"] + 1)
+            elif value:
+                pdf.text(f["x"] + 1.5, f["y"] + 5.6, value)
+            if f["type"] == "dropdown":
+                pdf.set_font(family, "", 7)
+                pdf.text(f["x"], f["y"] + f["h"] + 3, " / ".join(f["options"]))
+
+
+def main(argv):
+    pdf = FPDF(unit="mm", format=(PAGE_W, PAGE_H))
+    pdf.set_auto_page_break(False)
+    family = "Helvetica"
+    if len(argv) > 3:
+        pdf.add_font("FormFont", "", argv[3])
+        pdf.add_font("FormFont", "B", argv[3])
+        family = "FormFont"
+    with open(argv[1], newline="", encoding="utf-8-sig") as f:
+        for record in csv.DictReader(f):
+            draw(pdf, family, record)
+    pdf.output(argv[2])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        sys.exit(__doc__)
+    main(sys.argv)
+'''
+
+
+def python_source(layout: FormLayout, module: str = "fill_form") -> str:
+    """A standalone fpdf2 script that fills this layout from a CSV."""
+    fields = pprint.pformat(_layout_rows(layout), width=120, sort_dicts=False)
+    return (
+        _PYTHON_TEMPLATE.replace("__TITLE_REPR__", repr(layout.schema.title))
+        .replace("__TITLE__", layout.schema.title)
+        .replace("__MODULE__", module)
+        .replace("__PAGE__", f"{layout.page_w}, {layout.page_h}, {layout.pages}")
+        .replace("__MARGIN__", str(MARGIN))
+        .replace("__FIELDS__", fields)
+        .replace("__TRUE__", repr(sorted(TRUE_VALUES)))
+    )
+
+
+_JSPDF_TEMPLATE = '''// __TITLE__: generated by FormAgent from a pdf_spec.
+// Builds a fillable PDF (AcroForm fields) with jsPDF 2.x:
+//   <script src="https://cdnjs.cloudflare.com/ajax/libs/jspdf/2.5.1/jspdf.umd.min.js"></script>
+//   buildForm().save("form.pdf");            // blank, fillable
+//   buildForm({device_name: "X"}).save(...); // prefilled
+const FORM = __FORM__;
+
+function buildForm(values = {}) {
+  const { jsPDF } = window.jspdf;
+  const doc = new jsPDF({ unit: "mm", format: [FORM.pageW, FORM.pageH] });
+  for (let page = 0; page < FORM.pages; page++) {
+    if (page > 0) doc.addPage([FORM.pageW, FORM.pageH]);
+    if (page === 0) {
+      doc.setFontSize(16);
+      doc.text(FORM.title, FORM.margin, FORM.margin + 8);
+    }
+    for (const f of FORM.fields.filter((f) => f.page === page)) {
+      doc.setFontSize(10);
+      doc.text(f.label, FORM.margin, f.y + 5.5);
+      const value = values[f.name] ?? "";
+      let field;
+      if (f.type === "dropdown") {
+        field = new doc.AcroFormComboBox();
+        field.setOptions(f.options);
+        field.value = f.options.includes(value) ? value : f.options[0];
+      } else if (f.type === "checkbox") {
+        field = new doc.AcroFormCheckBox();
+        field.appearanceState = value ? "On" : "Off";
+      } else {
+        field = new doc.AcroFormTextField();
+        field.value = String(value);
+        if (f.type === "date") field.defaultValue = "YYYY-MM-DD";
+      }
+      field.fieldName = f.name;
+      field.Rect = [f.x, f.y, f.w, f.h];
+      doc.addField(field);
+    }
+  }
+  return doc;
+}
+'''
+
+
+def jspdf_source(layout: FormLayout) -> str:
+    """Browser-side jsPDF code producing the same layout as a fillable (AcroForm) PDF."""
+    form = {
+        "title": layout.schema.title,
+        "pageW": layout.page_w,
+        "pageH": layout.page_h,
+        "pages": layout.pages,
+        "margin": MARGIN,
+        "fields": _layout_rows(layout),
+    }
+    return _JSPDF_TEMPLATE.replace("__TITLE__", layout.schema.title).replace("__FORM__", json.dumps(form, ensure_ascii=False, indent=2))
+
+
+def zip_files(paths: Sequence[str], out_path: str) -> str:
+    import zipfile
+
+    with zipfile.ZipFile(out_path, "w", compression=zipfile.ZIP_STORED) as z:  # PDFs are already compressed
+        for p in paths:
+            z.write(p, os.path.basename(p))
+    return out_path
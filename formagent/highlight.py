@@ -0,0 +1,190 @@
+"""
+Keyword highlighting for long Markdown notes. All keywords are found with one
+Aho-Corasick pass (`textmatch.KeywordAutomaton`) rather than one replace per keyword,
+and overlapping terms resolve to the leftmost, then longest, match.
+
+    hl = Highlighter({"predicate device": CORAL, "ISO 10993": "#3366ff"})
+    html_md = hl.highlight(note)            # pass to st.markdown(..., unsafe_allow_html=True)
+
+Code blocks, inline code, links, URLs, HTML tags and the contents of existing
+<span>/<a>/<code> elements are left untouched. The note is highlighted per block
+(paragraph or fenced code block) and each block's result is kept, so after an edit
+only the changed blocks are scanned again.
+"""
+import html
+import re
+import string
+import threading
+from typing import Dict, Iterable, List, Mapping, Tuple, Union
+
+from formagent.chunking import FENCE_RE, closes_fence
+from formagent.textmatch import KeywordAutomaton
+from formagent.tracing import span
+
+CORAL = "#FF7F50"  # --wow-coral; keywords in this color get the .wow-coral class only
+BLOCK_CACHE = 4096  # highlighted blocks kept per Highlighter
+
+COLOR_RE = re.compile(r"^(?:#[0-9a-fA-F]{3,8}|[a-zA-Z]{3,20}|(?:rgb|hsl)a?\(\s*[\d\s.,%]+\))$")
+PARAGRAPH_END_RE = re.compile(r"\n[ \t\r]*\n")
+KEYWORD_LINE_RE = re.compile(r"^(?P<keyword>.+?)\s*[|｜]\s*(?P<color>[^|｜]+?)\s*$")
+PROTECTED_RE = re.compile(
+    r"<!--.*?-->"  # HTML comment
+    r"|<(?P<tag>span|a|code|pre|kbd|mark|script|style)\b[^>]*>.*?</(?P=tag)\s*>"  # element incl. its text
+    r"|</?[A-Za-z][^>]*>"  # any other tag, and <https://...> autolinks
+    r"|``.+?``|`[^`]+`"  # inline code
+    r"|!?\[[^\]\n]*\](?:\([^)\n]*\)|\[[^\]\n]*\])"  # [text](url), ![alt](src), [text][ref]
+    r"|^ {0,3}\[[^\]\n]+\]:.*$"  # [ref]: url
+    r"|(?:https?://|www\.)[^\s<>)]+"  # bare URL
+    r"|&#?\w+;",  # entity
+    re.S | re.I | re.M,
+)
+_WORD = frozenset(string.ascii_letters + string.digits + "_")
+
+
+def parse_keywords(text: str, color: str = CORAL) -> Dict[str, str]:
+    """
+    One keyword per line, optionally followed by `| color` (hex, CSS name, rgb()/hsl()).
+    Lines without a color get `color`. Raises ValueError naming the first bad color.
+    """
+    out: Dict[str, str] = {}
+    for n, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line:
+            continue
+        m = KEYWORD_LINE_RE.match(line)
+        keyword, kw_color = (m.group("keyword"), m.group("color")) if m else (line, color)
+        if not COLOR_RE.match(kw_color):
+            raise ValueError(f"line {n}: {kw_color!r} is not a color")
+        out.setdefault(keyword, kw_color)
+    return out
+
+
+def split_blocks(text: str) -> List[Tuple[str, bool]]:
+    """
+    (block, is_code) pieces whose concatenation is `text`: paragraphs end after a blank
+    line, and a fenced code block is one piece from its opening to its closing fence.
+    """
+    blocks: List[Tuple[str, bool]] = []
+    if "```" not in text and "~~~" not in text:  # no fences: cut at blank lines without a per-line loop
+        pos = 0
+        for m in PARAGRAPH_END_RE.finditer(text):
+            blocks.append((text[pos:m.end()], False))
+            pos = m.end()
+        if pos < len(text):
+            blocks.append((text[pos:], False))
+        return blocks
+    buf: List[str] = []
+    fence = ""
+    for line in text.splitlines(keepends=True):
+        if fence:
+            buf.append(line)
+            if closes_fence(line, fence):
+                blocks.append(("".join(buf), True))
+                buf, fence = [], ""
+            continue
+        m = FENCE_RE.match(line)
+        if m:
+            if buf:
+                blocks.append(("".join(buf), False))
+            buf, fence = [line], m.group(1)
+        elif not line.strip():
+            buf.append(line)
+            blocks.append(("".join(buf), False))
+            buf = []
+        else:
+            buf.append(line)
+    if buf:
+        blocks.append(("".join(buf), bool(fence)))  # an unclosed fence runs to the end
+    return blocks
+
+
+class Highlighter:
+    """
+    Wraps every occurrence of the keywords in `<span class="wow-coral">`, with an inline
+    color for keywords not in CORAL. ASCII matching is case-insensitive and Latin
+    keywords only match whole words; CJK keywords match anywhere. Safe to share between
+    sessions.
+    """
+
+    def __init__(self, keywords: Union[Mapping[str, str], Iterable[str]], color: str = CORAL, cache_blocks: int = BLOCK_CACHE):
+        colors = dict(keywords) if isinstance(keywords, Mapping) else dict.fromkeys(keywords, color)
+        colors = {k.strip(): c for k, c in colors.items() if k.strip()}
+        for c in colors.values():
+            if not COLOR_RE.match(c):
+                raise ValueError(f"{c!r} is not a color")
+        self.automaton = KeywordAutomaton(colors)
+        self._opening = tuple(
+            "<span class='wow-coral'>" if colors[k].upper() == CORAL else f"<span class='wow-coral' style='color:{html.escape(colors[k])}'>"
+            for k in self.automaton.keywords
+        )
+        self._bounded = tuple((k[0] in _WORD, k[-1] in _WORD) for k in self.automaton.keywords)
+        self._cache_blocks = cache_blocks
+        self._blocks: Dict[str, str] = {}
+        self._last: Tuple[str, str] = ("", "")
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.automaton.keywords)
+
+    def matches(self, block: str) -> List[Tuple[int, int, int]]:
+        """(start, end, keyword_index) outside protected markup, leftmost-longest, non-overlapping."""
+        hits: List[Tuple[int, int, int]] = []
+        words = self.automaton.keywords
+        pos = 0
+        gaps = [(m.start(), m.end()) for m in PROTECTED_RE.finditer(block)] + [(len(block), len(block))]
+        for start, end in gaps:
+            if start > pos:
+                for e, k in self.automaton.scan(block[pos:start], 0, pos)[1]:
+                    s = e - len(words[k])
+                    left, right = self._bounded[k]
+                    if (left and s > 0 and block[s - 1] in _WORD) or (right and e < len(block) and block[e] in _WORD):
+                        continue
+                    hits.append((s, e, k))
+            pos = end
+        hits.sort(key=lambda h: (h[0], h[0] - h[1]))
+        chosen: List[Tuple[int, int, int]] = []
+        taken = 0
+        for s, e, k in hits:
+            if s >= taken:
+                chosen.append((s, e, k))
+                taken = e
+        return chosen
+
+    def _mark(self, block: str) -> str:
+        out: List[str] = []
+        pos = 0
+        for s, e, k in self.matches(block):
+            out.extend((block[pos:s], self._opening[k], block[s:e], "</span>"))
+            pos = e
+        out.append(block[pos:])
+        return "".join(out)
+
+    def highlight(self, text: str) -> str:
+        """`text` with keywords wrapped; unchanged blocks come from the block cache."""
+        last_text, last_html = self._last
+        if text == last_text:
+            return last_html
+        if not self.automaton.keywords:
+            return text
+        with span("note.highlight", chars=len(text), keywords=len(self)) as traced:
+            out: List[str] = []
+            scanned = 0
+            blocks = split_blocks(text)
+            for block, is_code in blocks:
+                if is_code or not block.strip():
+                    out.append(block)
+                    continue
+                with self._lock:
+                    marked = self._blocks.get(block)
+                if marked is None:
+                    marked = self._mark(block)
+                    scanned += 1
+                    with self._lock:
+                        if len(self._blocks) >= self._cache_blocks:
+                            del self._blocks[next(iter(self._blocks))]
+                        self._blocks[block] = marked
+                out.append(marked)
+            result = "".join(out)
+            traced.set(blocks=len(blocks), scanned=scanned)
+        self._last = (text, result)
+        return result
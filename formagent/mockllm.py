@@ -0,0 +1,379 @@
+"""
+Local stand-in for the OpenAI / Anthropic / Gemini / Grok chat APIs, for benchmarks and
+offline development. Latency, decode rate, output length and error injection are configurable.
+Prompt caching is simulated: the longest run of leading prompt blocks (system prompt, then
+all but the last part of the user turn) seen before, 1024+ tokens, is reported as cached
+input in each provider's usage format.
+
+    python -m formagent.mockllm --port 8765 --ttft-ms 300 --tokens-per-s 80 --error-rate 0.02
+
+prints the environment that points the app (or formagent.batch) at it, e.g.
+
+    FORMAGENT_OPENAI_BASE_URL=http://127.0.0.1:8765/openai/v1 OPENAI_API_KEY=mock streamlit run app.py
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from formagent.chunking import estimate_tokens
+from formagent.providers import MIN_CACHE_TOKENS, PROVIDER_ENV_KEYS
+
+
+# URL prefix per provider; the rest of the path is the provider's own API path.
+PREFIXES: Dict[str, str] = {"OpenAI": "openai/v1", "Grok": "grok/v1", "Anthropic": "anthropic/v1", "Gemini": "gemini/v1beta"}
+
+_WORDS = ("器材", "測試", "風險", "標準", "審查", "results", "device", "510(k)", "ISO 10993", "IEC 60601")
+
+
+@dataclass(frozen=True)
+class MockConfig:
+    ttft_ms: float = 200.0  # delay before the first token (whole response for non-streaming calls)
+    tokens_per_s: float = 100.0  # decode rate after the first token; 0 = instant
+    output_tokens: int = 256  # per response, capped by the request's max tokens
+    jitter: float = 0.2  # +/- fraction applied to ttft_ms
+    error_rate: float = 0.0  # fraction of requests answered with error_status
+    error_status: int = 503
+    retry_after_s: float = 0.0  # sent as Retry-After on injected errors when > 0
+    seed: Optional[int] = None
+    prompt_cache: bool = True  # report repeated long system prefixes as cached input
+
+
+def mock_text(tokens: int) -> List[str]:
+    """`tokens` pieces of Markdown (one token each): headings, a table and list items."""
+    pieces: List[str] = ["# Mock report\n\n", "| 項目 | 說明 |\n", "|---|---|\n"]
+    line = 0
+    while len(pieces) < tokens:
+        line += 1
+        if line % 40 == 0:
+            pieces.append(f"\n## Section {line // 40}\n\n")
+        elif line % 2:
+            pieces.append(f"| {_WORDS[line % len(_WORDS)]} {line} | ")
+            pieces.append(f"{_WORDS[(line * 7) % len(_WORDS)]} |\n")
+        else:
+            pieces.append(f"- {_WORDS[(line * 3) % len(_WORDS)]} ")
+            pieces.append(f"{line}\n")
+    return pieces[:max(0, tokens)]
+
+
+# =========================
+# Wire formats
+# =========================
+Cache = Tuple[int, int]  # (prompt-cache read, write) tokens
+
+
+def _openai_usage(tin: int, tout: int, cache: Cache) -> Dict[str, Any]:
+    return {"prompt_tokens": tin, "completion_tokens": tout, "total_tokens": tin + tout,
+            "prompt_tokens_details": {"cached_tokens": cache[0]}}
+
+
+def _openai_body(model: str, text: str, tin: int, tout: int, cache: Cache = (0, 0)) -> Dict[str, Any]:
+    return {
+        "id": "mock", "object": "chat.completion", "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        "usage": _openai_usage(tin, tout, cache),
+    }
+
+
+def _openai_events(model: str, pieces: List[str], tin: int, cache: Cache = (0, 0)) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    for p in pieces:
+        yield "", {"id": "mock", "object": "chat.completion.chunk", "model": model,
+                   "choices": [{"index": 0, "delta": {"content": p}}]}
+    yield "", {"id": "mock", "object": "chat.completion.chunk", "model": model, "choices": [],
+               "usage": _openai_usage(tin, len(pieces), cache)}
+
+
+def _anthropic_usage(tin: int, cache: Cache) -> Dict[str, Any]:
+    # Anthropic reports cache reads and writes separately from (not inside) input_tokens.
+    return {"input_tokens": tin - cache[0] - cache[1], "cache_read_input_tokens": cache[0],
+            "cache_creation_input_tokens": cache[1]}
+
+
+def _anthropic_body(model: str, text: str, tin: int, tout: int, cache: Cache = (0, 0)) -> Dict[str, Any]:
+    return {
+        "id": "mock", "type": "message", "role": "assistant", "model": model,
+        "content": [{"type": "text", "text": text}], "stop_reason": "end_turn",
+        "usage": {**_anthropic_usage(tin, cache), "output_tokens": tout},
+    }
+
+
+def _anthropic_events(model: str, pieces: List[str], tin: int, cache: Cache = (0, 0)) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    yield "message_start", {"type": "message_start", "message": {"id": "mock", "model": model, "usage": _anthropic_usage(tin, cache)}}
+    for p in pieces:
+        yield "content_block_delta", {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": p}}
+    yield "message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": len(pieces)}}
+    yield "message_stop", {"type": "message_stop"}
+
+
+def _gemini_body(model: str, text: str, tin: int, tout: int, cache: Cache = (0, 0)) -> Dict[str, Any]:
+    return {
+        "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+        "usageMetadata": {"promptTokenCount": tin, "candidatesTokenCount": tout, "totalTokenCount": tin + tout,
+                          "cachedContentTokenCount": cache[0]},
+    }
+
+
+def _gemini_events(model: str, pieces: List[str], tin: int, cache: Cache = (0, 0)) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    for n, p in enumerate(pieces, start=1):
+        yield "", {"candidates": [{"content": {"role": "model", "parts": [{"text": p}]}}],
+                   "usageMetadata": {"promptTokenCount": tin, "candidatesTokenCount": n, "cachedContentTokenCount": cache[0]}}
+
+
+def _texts(content: Any) -> List[str]:
+    """A message's content as text parts (plain string or a list of typed blocks)."""
+    if isinstance(content, str):
+        return [content]
+    return [b.get("text", "") for b in content or [] if isinstance(b, dict)]
+
+
+def _request_shape(provider: str, path: str, body: Dict[str, Any]) -> Tuple[str, List[str], str, int, bool]:
+    """
+    (model, cacheable prefix blocks, rest of the prompt, requested max tokens, stream?) in the
+    provider's request format. The prefix is the system prompt plus every part of the user
+    turn but the last.
+    """
+    if provider == "Gemini":
+        model = path.split("/models/", 1)[-1].split(":", 1)[0]
+        prefix = [p.get("text", "") for p in (body.get("systemInstruction") or {}).get("parts") or []]
+        user = [[p.get("text", "") for p in c.get("parts") or []] for c in body.get("contents") or []]
+        cap = (body.get("generationConfig") or {}).get("maxOutputTokens") or 0
+        stream = ":streamGenerateContent" in path
+    else:
+        model = body.get("model", "")
+        messages = body.get("messages") or []
+        prefix = [t for m in messages if m.get("role") == "system" for t in _texts(m.get("content"))]
+        prefix += _texts(body.get("system") or "")
+        user = [_texts(m.get("content")) for m in messages if m.get("role") != "system"]
+        cap = body.get("max_tokens") or body.get("max_completion_tokens") or 0
+        stream = bool(body.get("stream"))
+    if user and len(user[0]) > 1:
+        prefix += user[0][:-1]
+        user[0] = user[0][-1:]
+    rest = "\n".join(t for parts in user for t in parts)
+    return model, [p for p in prefix if p], rest, int(cap), stream
+
+
+_FORMATS = {
+    "OpenAI": (_openai_body, _openai_events),
+    "Grok": (_openai_body, _openai_events),
+    "Anthropic": (_anthropic_body, _anthropic_events),
+    "Gemini": (_gemini_body, _gemini_events),
+}
+
+
+# =========================
+# Server
+# =========================
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real APIs
+    server: "MockLLMServer"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        prefix, _, _ = self.path.lstrip("/").partition("/")
+        provider = next((p for p, pre in PREFIXES.items() if pre.split("/")[0] == prefix), "")
+        try:
+            body = json.loads(raw or b"{}")
+        except ValueError:
+            body = None
+        if not provider or body is None:
+            self._json(404 if not provider else 400, {"error": {"message": f"unsupported request {self.path}"}})
+            return
+        cfg = self.server.config
+        model, prefix, rest, cap, stream = _request_shape(provider, self.path, body)
+        failed = self.server.roll(cfg.error_rate)
+        self.server.count(provider, stream, failed)
+        ttft = self.server.ttft_s()
+        if failed:
+            time.sleep(ttft)
+            headers = {"Retry-After": f"{cfg.retry_after_s:g}"} if cfg.retry_after_s > 0 else {}
+            self._json(cfg.error_status, {"error": {"message": "injected error", "type": "mock"}}, headers)
+            return
+        tin = sum(estimate_tokens(b) for b in prefix) + estimate_tokens(rest)
+        cache = self.server.prompt_cache(provider, prefix, writes=provider == "Anthropic" and "cache_control" in raw.decode("utf-8", "replace"))
+        pieces = mock_text(min(cfg.output_tokens, cap) if cap else cfg.output_tokens)
+        to_body, to_events = _FORMATS[provider]
+        if not stream:
+            time.sleep(ttft + (len(pieces) / cfg.tokens_per_s if cfg.tokens_per_s > 0 else 0.0))
+            self._json(200, to_body(model, "".join(pieces), tin, len(pieces), cache))
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        time.sleep(ttft)
+        # Batch tokens so sleeps stay >= ~10 ms; finer sleeps only measure the scheduler.
+        per_event = max(1, math.ceil(cfg.tokens_per_s * 0.01)) if cfg.tokens_per_s > 0 else len(pieces) or 1
+        interval = per_event / cfg.tokens_per_s if cfg.tokens_per_s > 0 else 0.0
+        events = list(to_events(model, pieces, tin, cache))
+        try:
+            for i in range(0, len(events), per_event):
+                out = b"".join(
+                    (f"event: {name}\n" if name else "").encode() + b"data: " + json.dumps(data, ensure_ascii=False).encode() + b"\n\n"
+                    for name, data in events[i:i + per_event]
+                )
+                if provider in ("OpenAI", "Grok") and i + per_event >= len(events):
+                    out += b"data: [DONE]\n\n"
+                self._chunk(out)
+                if interval and i + per_event < len(events):
+                    time.sleep(interval)
+            self._chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):  # client closed early (e.g. validation abort)
+            self.close_connection = True
+
+    def _chunk(self, data: bytes) -> None:
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    """One server for every provider (URL prefix per provider). Use as a context manager."""
+
+    daemon_threads = True
+    request_queue_size = 256  # fan-out benchmarks open many connections at once
+
+    def __init__(self, config: Optional[MockConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _Handler)
+        self.config = config or MockConfig()
+        self.counts: Dict[str, Dict[str, int]] = {}
+        self._prefixes: set = set()  # (provider, digest) of prompt prefixes already "cached"
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def base_urls(self) -> Dict[str, str]:
+        return {p: f"{self.url}/{prefix}" for p, prefix in PREFIXES.items()}
+
+    def env(self) -> Dict[str, str]:
+        """FORMAGENT_<PROVIDER>_BASE_URL for every provider, plus placeholder API keys."""
+        env = {f"FORMAGENT_{p.upper()}_BASE_URL": url for p, url in self.base_urls().items()}
+        env.update({key: "mock" for key in PROVIDER_ENV_KEYS.values()})
+        return env
+
+    def roll(self, rate: float) -> bool:
+        with self._lock:
+            return rate > 0 and self._rng.random() < rate
+
+    def ttft_s(self) -> float:
+        cfg = self.config
+        with self._lock:
+            factor = 1.0 + self._rng.uniform(-cfg.jitter, cfg.jitter) if cfg.jitter else 1.0
+        return max(0.0, cfg.ttft_ms * factor / 1000.0)
+
+    def count(self, provider: str, stream: bool, failed: bool) -> None:
+        with self._lock:
+            c = self.counts.setdefault(provider, {"requests": 0, "streams": 0, "errors": 0})
+            c["requests"] += 1
+            c["streams"] += int(stream)
+            c["errors"] += int(failed)
+
+    def prompt_cache(self, provider: str, blocks: List[str], writes: bool = False) -> Cache:
+        """
+        (read, write) tokens for leading prompt `blocks`: the longest block prefix seen before
+        is read; with `writes` (Anthropic) the remainder is written. Prefixes under
+        MIN_CACHE_TOKENS are never cached.
+        """
+        if not self.config.prompt_cache:
+            return 0, 0
+        digest = hashlib.sha256()
+        read = total = 0
+        with self._lock:
+            for b in blocks:
+                digest.update(b.encode("utf-8") + b"\x00")
+                total += estimate_tokens(b)
+                key = (provider, digest.hexdigest())
+                if key in self._prefixes:
+                    read = total
+                elif total >= MIN_CACHE_TOKENS:
+                    self._prefixes.add(key)
+        read = read if read >= MIN_CACHE_TOKENS else 0
+        write = total - read if writes and total >= MIN_CACHE_TOKENS else 0
+        return read, write
+
+    def start(self) -> "MockLLMServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="mockllm", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self) -> "MockLLMServer":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+
+def add_config_args(ap: argparse.ArgumentParser) -> None:
+    d = MockConfig()
+    ap.add_argument("--ttft-ms", type=float, default=d.ttft_ms, help="Delay before the first token.")
+    ap.add_argument("--tokens-per-s", type=float, default=d.tokens_per_s, help="Decode rate (0 = instant).")
+    ap.add_argument("--output-tokens", type=int, default=d.output_tokens, help="Tokens per response.")
+    ap.add_argument("--jitter", type=float, default=d.jitter, help="+/- fraction applied to --ttft-ms.")
+    ap.add_argument("--error-rate", type=float, default=d.error_rate, help="Fraction of requests that fail.")
+    ap.add_argument("--error-status", type=int, default=d.error_status, help="HTTP status of injected failures.")
+    ap.add_argument("--retry-after", type=float, default=d.retry_after_s, help="Retry-After seconds on failures.")
+    ap.add_argument("--seed", type=int, default=d.seed, help="Seed for jitter and error injection.")
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+    return MockConfig(
+        ttft_ms=args.ttft_ms,
+        tokens_per_s=args.tokens_per_s,
+        output_tokens=args.output_tokens,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        retry_after_s=args.retry_after,
+        seed=args.seed,
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m formagent.mockllm", description="Serve mock chat APIs for every provider.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    add_config_args(ap)
+    args = ap.parse_args(argv)
+    server = MockLLMServer(config_from_args(args), args.host, args.port)
+    print(json.dumps(asdict(server.config)), file=sys.stderr)
+    for k, v in server.env().items():
+        print(f"export {k}={v}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+import html
+import json
+import re
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from formagent.cache import ResponseCache
+from formagent.executor import StepResult, build_request, context_pointer, fan_out, framed_context, run_request
+from formagent.providers import ChatRequest, ProviderError, ProviderPool
+from formagent.registry import AgentRegistry, AgentSpec
+from formagent.routing import Router
+from formagent.tracing import span
+from formagent.validation import Validator
+
+
+NOTE_AGENT = "note_keeper_agent"
+
+# Magics that each read the organized note independently and can run side by side.
+MAGIC_AGENTS: Tuple[str, ...] = (
+    "magic_formatting_agent",
+    "magic_keywords_agent",
+    "magic_action_items_agent",
+    "magic_concept_map_agent",
+    "magic_glossary_agent",
+)
+
+# The note as user content, framed as data: byte-identical for every magic and re-run.
+NOTE_LABEL = "筆記"
+NOTE_POINTER = context_pointer(NOTE_LABEL)
+
+KEYWORD_SPAN_RE = re.compile(r"<span\b[^>]*>(.*?)</span>", re.S | re.I)
+TABLE_DIVIDER_RE = re.compile(r"^\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?$")
+
+
+# =========================
+# Requests
+# =========================
+def magic_request(spec: AgentSpec, note: str, model: Optional[str] = None) -> ChatRequest:
+    """
+    Each magic's own system_prompt stays in the system role; the note is user content
+    (the request context, leading the user turn), never system instructions. Re-running a
+    magic over the same note repeats the same prompt prefix, which providers cache.
+    """
+    return build_request(spec, {}, default_text=NOTE_POINTER, model=model,
+                         context=framed_context(NOTE_LABEL, note))
+
+
+# =========================
+# Parsing magic outputs
+# =========================
+def highlighted_keywords(text: str) -> Tuple[str, ...]:
+    """Distinct keywords wrapped in <span> by magic_keywords_agent, in first-seen order."""
+    found = (html.unescape(re.sub(r"<[^>]+>", "", m)).strip() for m in KEYWORD_SPAN_RE.findall(text))
+    return tuple(dict.fromkeys(k for k in found if k))
+
+
+def _cells(line: str) -> List[str]:
+    return [c.strip() for c in line.strip().strip("|").split("|")]
+
+
+def table_rows(text: str) -> List[Dict[str, str]]:
+    """Body rows of every Markdown table in `text`, keyed by that table's header cells."""
+    rows: List[Dict[str, str]] = []
+    lines = text.splitlines()
+    i = 1
+    while i < len(lines):
+        if lines[i - 1].lstrip().startswith("|") and TABLE_DIVIDER_RE.match(lines[i].strip()):
+            header = _cells(lines[i - 1])
+            i += 1
+            while i < len(lines) and lines[i].lstrip().startswith("|"):
+                cells = _cells(lines[i])
+                rows.append({h or f"col{j + 1}": (cells[j] if j < len(cells) else "") for j, h in enumerate(header)})
+                i += 1
+        i += 1
+    return rows
+
+
+# =========================
+# Knowledge object
+# =========================
+@dataclass
+class NoteKnowledge:
+    """Everything the magics produced for one note, merged."""
+
+    note: str  # the organized Markdown every magic read
+    formatted: str = ""
+    highlighted: str = ""  # note with keyword <span>s
+    keywords: Tuple[str, ...] = ()
+    action_items: List[Dict[str, str]] = field(default_factory=list)
+    concept_map: str = ""
+    glossary: List[Dict[str, str]] = field(default_factory=list)
+    results: Dict[str, StepResult] = field(default_factory=dict)  # per agent, incl. note_keeper_agent
+    wall_ms: int = 0
+
+    @property
+    def errors(self) -> Dict[str, str]:
+        return {a: r.error for a, r in self.results.items() if not r.ok}
+
+    def merge(self, r: StepResult) -> None:
+        self.results[r.agent_id] = r
+        if not r.ok:
+            return
+        text = r.result.text
+        if r.agent_id == "magic_formatting_agent":
+            self.formatted = text
+        elif r.agent_id == "magic_keywords_agent":
+            self.highlighted = text
+            self.keywords = highlighted_keywords(text)
+        elif r.agent_id == "magic_action_items_agent":
+            self.action_items = table_rows(text)
+        elif r.agent_id == "magic_concept_map_agent":
+            self.concept_map = text
+        elif r.agent_id == "magic_glossary_agent":
+            self.glossary = table_rows(text)
+
+    def to_markdown(self) -> str:
+        blocks = [("整理後筆記", self.formatted or self.note), ("概念地圖", self.concept_map)]
+        for title, key in (("行動事項", "magic_action_items_agent"), ("術語表", "magic_glossary_agent")):
+            r = self.results.get(key)
+            blocks.append((title, r.result.text if r is not None and r.ok else ""))
+        if self.keywords:
+            blocks.append(("關鍵字", "、".join(self.keywords)))
+        return "\n\n".join(f"## {title}\n\n{body}" for title, body in blocks if body)
+
+    def to_json(self) -> str:
+        body: Dict[str, Any] = {
+            "note": self.note,
+            "formatted": self.formatted,
+            "highlighted": self.highlighted,
+            "keywords": list(self.keywords),
+            "action_items": self.action_items,
+            "concept_map": self.concept_map,
+            "glossary": self.glossary,
+            "errors": self.errors,
+        }
+        return json.dumps(body, ensure_ascii=False, indent=2)
+
+
+# =========================
+# Organize + all magics
+# =========================
+def organize_note(
+    pool: ProviderPool,
+    registry: AgentRegistry,
+    raw_notes: str,
+    api_keys: Mapping[str, str],
+    cache: Optional[ResponseCache] = None,
+    router: Optional[Router] = None,
+    validator: Optional[Validator] = None,
+    model: Optional[str] = None,
+) -> StepResult:
+    req = build_request(registry.get(NOTE_AGENT), {"raw_notes": raw_notes}, model=model)
+    try:
+        return StepResult(agent_id=NOTE_AGENT, result=run_request(pool, req, api_keys, cache, NOTE_AGENT, router, validator))
+    except ProviderError as e:
+        return StepResult(agent_id=NOTE_AGENT, error=str(e))
+
+
+def run_magics(
+    pool: ProviderPool,
+    registry: AgentRegistry,
+    note: str,
+    api_keys: Mapping[str, str],
+    organized: bool = False,
+    magic_ids: Sequence[str] = MAGIC_AGENTS,
+    model: Optional[str] = None,
+    max_workers: int = 8,
+    on_result: Optional[Callable[[StepResult], None]] = None,
+    cache: Optional[ResponseCache] = None,
+    router: Optional[Router] = None,
+    validator: Optional[Validator] = None,
+) -> NoteKnowledge:
+    """
+    Organize `note` with note_keeper_agent (skipped when `organized`), then run every
+    magic on the organized note concurrently and merge their outputs. Wall time is one
+    round-trip for the magics, plus one for organizing. If organizing fails, the magics
+    do not run and the error is in `errors[NOTE_AGENT]`.
+    """
+    with span("note.magics", magics=len(magic_ids), organized=organized) as traced:
+        knowledge = NoteKnowledge(note=note)
+        if not organized:
+            r = organize_note(pool, registry, note, api_keys, cache, router, validator, model)
+            knowledge.merge(r)
+            if on_result is not None:
+                on_result(r)
+            if r.ok:
+                knowledge.note = r.result.text
+        if NOTE_AGENT not in knowledge.errors:
+            reqs = {a: magic_request(registry.get(a), knowledge.note, model) for a in magic_ids if a in registry}
+            for r in fan_out(pool, reqs, api_keys, max_workers=max_workers, cache=cache, router=router, validator=validator):
+                knowledge.merge(r)
+                if on_result is not None:
+                    on_result(r)
+        traced.set(failed=len(knowledge.errors))
+    knowledge.wall_ms = int(traced.duration_ms)
+    return knowledge
@@ -0,0 +1,231 @@
+import hashlib
+import mmap
+import os
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import get_context
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from formagent.config import data_dir
+
+
+OCR_LANGS = "eng+chi_tra"  # tesseract-ocr + tesseract-ocr-chi-tra (packages.txt)
+PAGES_PER_TASK = 16
+MAX_OPEN_READERS = 4
+IN_PROCESS_MAX_PAGES = 32  # below this, process-pool startup costs more than it saves
+
+
+@dataclass(frozen=True)
+class PageText:
+    index: int  # 0-based page number
+    text: str
+    ocr: bool = False
+    final: bool = True  # False: no text layer and OCR did not run; not cached, so a later run retries it
+
+
+# =========================
+# Upload handling (stream to disk once, keyed by content hash)
+# =========================
+def file_sha256(path: str, block: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(block), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def store_upload(stream: BinaryIO, block: int = 1 << 20) -> Tuple[str, str]:
+    """
+    Copy an uploaded file to `<data_dir>/uploads/<sha256>.pdf`, hashing while copying.
+    Returns (sha256, path). Identical uploads map to the same file.
+    """
+    folder = os.path.join(data_dir(), "uploads")
+    os.makedirs(folder, exist_ok=True)
+    h = hashlib.sha256()
+    fd, tmp = tempfile.mkstemp(dir=folder, suffix=".part")
+    with os.fdopen(fd, "wb") as out:
+        for chunk in iter(lambda: stream.read(block), b""):
+            h.update(chunk)
+            out.write(chunk)
+    sha = h.hexdigest()
+    path = os.path.join(folder, f"{sha}.pdf")
+    os.replace(tmp, path)
+    return sha, path
+
+
+# =========================
+# Per-page cache (SQLite, keyed by file hash + page)
+# =========================
+class PageCache:
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(data_dir(), "pages.sqlite3")
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " file_hash TEXT NOT NULL, page INTEGER NOT NULL, text TEXT NOT NULL, ocr INTEGER NOT NULL,"
+            " PRIMARY KEY (file_hash, page))"
+        )
+
+    def load(self, file_hash: str) -> Dict[int, PageText]:
+        with self._lock:
+            rows = self._db.execute("SELECT page, text, ocr FROM pages WHERE file_hash = ?", (file_hash,)).fetchall()
+        return {p: PageText(p, text, bool(ocr)) for p, text, ocr in rows}
+
+    def save(self, file_hash: str, pages: List[PageText]) -> None:
+        """Store final pages; pages still waiting for OCR are skipped."""
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO pages (file_hash, page, text, ocr) VALUES (?, ?, ?, ?)",
+                [(file_hash, p.index, p.text, int(p.ocr)) for p in pages if p.final],
+            )
+
+    def text(self, file_hash: str, page_sep: str = "\n\n") -> str:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT text FROM pages WHERE file_hash = ? ORDER BY page", (file_hash,)
+            ).fetchall()
+        return page_sep.join(r[0] for r in rows)
+
+
+# =========================
+# Extraction (runs inside worker processes)
+# =========================
+_READERS: Dict[str, object] = {}
+
+
+def _reader(path: str):
+    """One memory-mapped PdfReader per file per worker process."""
+    reader = _READERS.get(path)
+    if reader is None:
+        from pypdf import PdfReader
+
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        reader = PdfReader(mm)
+        while len(_READERS) >= MAX_OPEN_READERS:
+            _READERS.pop(next(iter(_READERS)))
+        _READERS[path] = reader
+    return reader
+
+
+def page_count(path: str) -> int:
+    return len(_reader(path).pages)
+
+
+def ocr_page(path: str, index: int, langs: str = OCR_LANGS, dpi: int = 300) -> Optional[str]:
+    """
+    Rasterize one page with pdftoppm and read it with tesseract. None if the tools are
+    missing or fail (OCR unavailable), as opposed to "" for a page OCR found blank.
+    """
+    if not (shutil.which("pdftoppm") and shutil.which("tesseract")):
+        return None
+    with tempfile.TemporaryDirectory() as tmp:
+        prefix = os.path.join(tmp, "page")
+        page_no = str(index + 1)
+        subprocess.run(
+            ["pdftoppm", "-f", page_no, "-l", page_no, "-r", str(dpi), "-singlefile", "-png", path, prefix],
+            check=False,
+            capture_output=True,
+        )
+        image = prefix + ".png"
+        if not os.path.exists(image):
+            return None
+        proc = subprocess.run(
+            ["tesseract", image, "stdout", "-l", langs],
+            check=False,
+            capture_output=True,
+        )
+        if proc.returncode != 0:
+            return None
+        return proc.stdout.decode("utf-8", errors="replace").strip()
+
+
+def extract_range(path: str, start: int, stop: int, ocr: bool = True) -> List[PageText]:
+    reader = _reader(path)
+    out: List[PageText] = []
+    for i in range(start, stop):
+        try:
+            text = (reader.pages[i].extract_text() or "").strip()
+        except Exception:  # malformed page content streams should not sink the whole document
+            text = ""
+        if text:
+            out.append(PageText(i, text))
+        elif not ocr:
+            out.append(PageText(i, "", final=False))
+        else:
+            ocr_text = ocr_page(path, i)
+            out.append(PageText(i, ocr_text or "", ocr=True, final=ocr_text is not None))
+    return out
+
+
+def _extract_task(args: Tuple[str, int, int, bool]) -> List[PageText]:
+    return extract_range(*args)
+
+
+# =========================
+# Public API
+# =========================
+def iter_pages(
+    path: str,
+    file_hash: Optional[str] = None,
+    cache: Optional[PageCache] = None,
+    ocr: bool = True,
+    workers: Optional[int] = None,
+    executor: Optional[Executor] = None,
+) -> Iterator[PageText]:
+    """
+    Yield pages in order. Cached pages are returned immediately; the rest are
+    extracted in page batches across a process pool, with OCR only for pages
+    that have no text layer. Newly extracted pages are written to the cache.
+    Pass `executor` to share one process pool across documents instead of
+    starting one per call.
+    """
+    file_hash = file_hash or file_sha256(path)
+    known = cache.load(file_hash) if cache is not None else {}
+    total = page_count(path)
+    missing = [i for i in range(total) if i not in known]
+
+    # Contiguous runs of uncached pages, at most PAGES_PER_TASK pages per task.
+    tasks: List[Tuple[str, int, int, bool]] = []
+    for i in missing:
+        if tasks and tasks[-1][2] == i and i - tasks[-1][1] < PAGES_PER_TASK:
+            tasks[-1] = (path, tasks[-1][1], i + 1, ocr)
+        else:
+            tasks.append((path, i, i + 1, ocr))
+
+    own_pool: Optional[ProcessPoolExecutor] = None
+    futures: List[Future] = []
+    if len(missing) <= IN_PROCESS_MAX_PAGES or (workers is not None and workers <= 1):
+        batches: Iterator[List[PageText]] = map(_extract_task, tasks)
+    else:
+        if executor is None:
+            executor = own_pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=get_context("spawn"))
+        futures = [executor.submit(_extract_task, t) for t in tasks]
+        batches = (f.result() for f in futures)
+
+    try:
+        next_page = 0
+        for batch in batches:
+            if cache is not None:
+                cache.save(file_hash, batch)
+            for page in batch:
+                while next_page < page.index:
+                    yield known[next_page]
+                    next_page += 1
+                yield page
+                next_page = page.index + 1
+        while next_page < total:
+            yield known[next_page]
+            next_page += 1
+    finally:
+        for f in futures:  # abandoned early: drop this document's queued batches only
+            f.cancel()
+        if own_pool is not None:
+            own_pool.shutdown(cancel_futures=True)
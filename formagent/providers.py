@@ -0,0 +1,680 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Tuple
+
+import httpx
+
+from formagent.chunking import estimate_tokens
+from formagent.ratelimit import RETRYABLE_STATUS, ProviderStats, RateLimiter, RetryPolicy, parse_retry_after
+from formagent.tracing import Span, end_span, span, start_span
+
+
+# =========================
+# Provider Registry
+# =========================
+PROVIDER_ENV_KEYS: Dict[str, str] = {
+    "Gemini": "GEMINI_API_KEY",
+    "OpenAI": "OPENAI_API_KEY",
+    "Anthropic": "ANTHROPIC_API_KEY",
+    "Grok": "GROK_API_KEY",
+}
+
+# Model-name prefix -> provider. Checked in order, first match wins.
+MODEL_PREFIXES: Tuple[Tuple[str, str], ...] = (
+    ("gemini", "Gemini"),
+    ("gpt", "OpenAI"),
+    ("o1", "OpenAI"),
+    ("o3", "OpenAI"),
+    ("o4", "OpenAI"),
+    ("claude", "Anthropic"),
+    ("grok", "Grok"),
+)
+
+
+def provider_for_model(model: str) -> str:
+    """Map a model name (e.g. 'gpt-4o-mini') to its provider name."""
+    name = model.strip().lower()
+    for prefix, provider in MODEL_PREFIXES:
+        if name.startswith(prefix):
+            return provider
+    raise ValueError(f"Unknown provider for model '{model}'")
+
+
+class ProviderError(RuntimeError):
+    """Raised when a provider call fails (HTTP error, timeout, bad payload)."""
+
+    def __init__(
+        self,
+        provider: str,
+        message: str,
+        status_code: Optional[int] = None,
+        retry_after: Optional[float] = None,
+    ):
+        super().__init__(f"{provider}: {message}")
+        self.provider = provider
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        """Network errors/timeouts (no status) and 408/409/429/5xx/529 are worth retrying."""
+        return self.status_code is None or self.status_code in RETRYABLE_STATUS
+
+
+def _http_error(provider: str, resp: httpx.Response) -> ProviderError:
+    return ProviderError(
+        provider,
+        f"HTTP {resp.status_code}: {resp.text[:500]}",
+        resp.status_code,
+        retry_after=parse_retry_after(resp.headers),
+    )
+
+
+# =========================
+# Settings
+# =========================
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+@dataclass(frozen=True)
+class ProviderSettings:
+    connect_timeout: float = 10.0
+    read_timeout: float = 180.0
+    max_connections: int = 20
+    max_keepalive: int = 10
+    keepalive_expiry: float = 90.0
+    max_concurrency: int = 8  # in-flight requests per provider, per process
+    base_urls: Mapping[str, str] = field(default_factory=dict)  # provider -> API root (proxies, mock servers)
+
+    @classmethod
+    def from_env(cls) -> "ProviderSettings":
+        """Read overrides from FORMAGENT_* environment variables (FORMAGENT_<PROVIDER>_BASE_URL for API roots)."""
+        d = cls()
+        base_urls = {p: os.environ[f"FORMAGENT_{p.upper()}_BASE_URL"]
+                     for p in PROVIDER_ENV_KEYS if os.getenv(f"FORMAGENT_{p.upper()}_BASE_URL")}
+        return cls(
+            connect_timeout=_env_float("FORMAGENT_CONNECT_TIMEOUT", d.connect_timeout),
+            read_timeout=_env_float("FORMAGENT_READ_TIMEOUT", d.read_timeout),
+            max_connections=_env_int("FORMAGENT_MAX_CONNECTIONS", d.max_connections),
+            max_keepalive=_env_int("FORMAGENT_MAX_KEEPALIVE", d.max_keepalive),
+            keepalive_expiry=_env_float("FORMAGENT_KEEPALIVE_EXPIRY", d.keepalive_expiry),
+            max_concurrency=_env_int("FORMAGENT_MAX_CONCURRENCY", d.max_concurrency),
+            base_urls=base_urls,
+        )
+
+
+# =========================
+# Request / Result
+# =========================
+@dataclass(frozen=True)
+class ChatRequest:
+    model: str
+    user_prompt: str
+    system_prompt: str = ""
+    max_tokens: int = 12000
+    temperature: float = 0.2
+    # Material shared by several calls (a submission, a note). Untrusted document text: it is
+    # sent as the first part of the user turn, never with system-role authority, so repeated
+    # calls over the same text share the cacheable prefix system prompt + context.
+    context: str = ""
+
+
+@dataclass(frozen=True)
+class ChatResult:
+    text: str
+    provider: str
+    model: str
+    latency_ms: int
+    input_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+    ttft_ms: Optional[int] = None  # time to first token (streaming only)
+    tokens_per_s: Optional[float] = None  # decode rate after the first token
+    cached: bool = False  # served from the response cache, no provider call
+    violations: Tuple[str, ...] = ()  # agent output rules this text fails (see formagent.validation)
+    cache_read_tokens: Optional[int] = None  # part of input_tokens served from the provider's prompt cache
+    cache_write_tokens: Optional[int] = None  # part of input_tokens written to it (Anthropic bills a premium)
+
+
+# =========================
+# Prompt layout (stable prefix first, for provider prompt caching)
+# =========================
+# Providers cache prompt prefixes of at least ~1024 tokens (OpenAI and Gemini automatically,
+# Anthropic at cache_control breakpoints). Shorter blocks are not worth a breakpoint.
+MIN_CACHE_TOKENS = 1024
+
+
+def prefix_blocks(req: ChatRequest) -> Tuple[str, ...]:
+    """The stable part of a request in wire order: the system prompt, then the shared context."""
+    return tuple(b for b in (req.system_prompt, req.context) if b)
+
+
+def user_parts(req: ChatRequest) -> Tuple[str, ...]:
+    """The user turn: the shared context (if any) as its own leading part, then the prompt."""
+    return (req.context, req.user_prompt) if req.context else (req.user_prompt,)
+
+
+def prefix_key(req: ChatRequest) -> str:
+    """Short digest of the stable prefix (OpenAI routes requests with the same key to the same cache)."""
+    return hashlib.sha256("\x00".join(prefix_blocks(req)).encode("utf-8")).hexdigest()[:32]
+
+
+# =========================
+# Provider Adapters (raw REST over a shared httpx client)
+# =========================
+class ProviderAdapter:
+    name = ""
+    base_url = ""
+
+    def endpoint(self, req: ChatRequest) -> str:
+        raise NotImplementedError
+
+    def headers(self, api_key: str) -> Dict[str, str]:
+        raise NotImplementedError
+
+    def payload(self, req: ChatRequest) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def parse(self, data: Dict[str, Any]) -> Tuple[str, Optional[int], Optional[int]]:
+        """Return (text, input_tokens, output_tokens)."""
+        raise NotImplementedError
+
+    def stream_endpoint(self, req: ChatRequest) -> str:
+        return self.endpoint(req)
+
+    def stream_payload(self, req: ChatRequest) -> Dict[str, Any]:
+        return {**self.payload(req), "stream": True}
+
+    def parse_event(self, data: Dict[str, Any]) -> Tuple[str, Optional[int], Optional[int]]:
+        """Return (text_delta, input_tokens, output_tokens) for one SSE event; usage may be None."""
+        raise NotImplementedError
+
+    def cache_usage(self, data: Dict[str, Any]) -> Tuple[Optional[int], Optional[int]]:
+        """(prompt-cache read, write) tokens reported in a response body or SSE event, if any."""
+        return None, None
+
+
+class OpenAIAdapter(ProviderAdapter):
+    name = "OpenAI"
+    base_url = "https://api.openai.com/v1"
+    max_tokens_field = "max_completion_tokens"
+    cache_key_field = "prompt_cache_key"  # routing hint for automatic prefix caching
+
+    def endpoint(self, req: ChatRequest) -> str:
+        return "/chat/completions"
+
+    def headers(self, api_key: str) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {api_key}"}
+
+    def payload(self, req: ChatRequest) -> Dict[str, Any]:
+        # Prefix caching is automatic: system prompt, then the context as the user turn's first part.
+        messages: List[Dict[str, Any]] = [{"role": "system", "content": req.system_prompt}] if req.system_prompt else []
+        parts = user_parts(req)
+        messages.append({"role": "user", "content": parts[0] if len(parts) == 1 else [{"type": "text", "text": p} for p in parts]})
+        body = {
+            "model": req.model,
+            "messages": messages,
+            "temperature": req.temperature,
+            self.max_tokens_field: req.max_tokens,
+        }
+        if self.cache_key_field and req.context:
+            body[self.cache_key_field] = prefix_key(req)
+        return body
+
+    def parse(self, data: Dict[str, Any]) -> Tuple[str, Optional[int], Optional[int]]:
+        choices = data.get("choices") or [{}]
+        text = (choices[0].get("message") or {}).get("content") or ""
+        usage = data.get("usage") or {}
+        return text, usage.get("prompt_tokens"), usage.get("completion_tokens")
+
+    def stream_payload(self, req: ChatRequest) -> Dict[str, Any]:
+        return {**self.payload(req), "stream": True, "stream_options": {"include_usage": True}}
+
+    def parse_event(self, data: Dict[str, Any]) -> Tuple[str, Optional[int], Optional[int]]:
+        choices = data.get("choices") or [{}]
+        delta = (choices[0].get("delta") or {}).get("content") or ""
+        usage = data.get("usage") or {}
+        return delta, usage.get("prompt_tokens"), usage.get("completion_tokens")
+
+    def cache_usage(self, data: Dict[str, Any]) -> Tuple[Optional[int], Optional[int]]:
+        usage = data.get("usage") or {}
+        return (usage.get("prompt_tokens_details") or {}).get("cached_tokens"), None
+
+
+class GrokAdapter(OpenAIAdapter):
+    """xAI exposes an OpenAI-compatible chat completions API."""
+
+    name = "Grok"
+    base_url = "https://api.x.ai/v1"
+    max_tokens_field = "max_tokens"
+    cache_key_field = ""
+
+
+class AnthropicAdapter(ProviderAdapter):
+    name = "Anthropic"
+    base_url = "https://api.anthropic.com/v1"
+
+    def endpoint(self, req: ChatRequest) -> str:
+        return "/messages"
+
+    def headers(self, api_key: str) -> Dict[str, str]:
+        return {"x-api-key": api_key, "anthropic-version": "2023-06-01"}
+
+    def payload(self, req: ChatRequest) -> Dict[str, Any]:
+        # Breakpoints after the system prompt and after the context when they are long
+        # enough to cache; re-runs of an agent over the same text then read both.
+        def block(text: str) -> Dict[str, Any]:
+            cached = estimate_tokens(text) >= MIN_CACHE_TOKENS
+            return {"type": "text", "text": text, **({"cache_control": {"type": "ephemeral"}} if cached else {})}
+
+        content: Any = req.user_prompt
+        if req.context:
+            content = [block(req.context), {"type": "text", "text": req.user_prompt}]
+        body: Dict[str, Any] = {
+            "model": req.model,
+            "max_tokens": req.max_tokens,
+            "temperature": req.temperature,
+            "messages": [{"role": "user", "content": content}],
+        }
+        if req.system_prompt:
+            long_system = estimate_tokens(req.system_prompt) >= MIN_CACHE_TOKENS
+            body["system"] = [block(req.system_prompt)] if long_system else req.system_prompt
+        return body
+
+    @staticmethod
+    def _input_tokens(usage: Dict[str, Any]) -> Optional[int]:
+        # Anthropic's input_tokens excludes cache reads and writes; count them like the other providers do.
+        if usage.get("input_tokens") is None:
+            return None
+        return usage["input_tokens"] + (usage.get("cache_read_input_tokens") or 0) + (usage.get("cache_creation_input_tokens") or 0)
+
+    def parse(self, data: Dict[str, Any]) -> Tuple[str, Optional[int], Optional[int]]:
+        text = "".join(b.get("text", "") for b in data.get("content") or [] if b.get("type") == "text")
+        usage = data.get("usage") or {}
+        return text, self._input_tokens(usage), usage.get("output_tokens")
+
+    def parse_event(self, data: Dict[str, Any]) -> Tuple[str, Optional[int], Optional[int]]:
+        kind = data.get("type")
+        if kind == "content_block_delta":
+            return (data.get("delta") or {}).get("text", ""), None, None
+        if kind == "message_start":
+            usage = (data.get("message") or {}).get("usage") or {}
+            return "", self._input_tokens(usage), None
+        if kind == "message_delta":
+            return "", None, (data.get("usage") or {}).get("output_tokens")
+        return "", None, None
+
+    def cache_usage(self, data: Dict[str, Any]) -> Tuple[Optional[int], Optional[int]]:
+        usage = data.get("usage") or (data.get("message") or {}).get("usage") or {}
+        return usage.get("cache_read_input_tokens"), usage.get("cache_creation_input_tokens")
+
+
+class GeminiAdapter(ProviderAdapter):
+    name = "Gemini"
+    base_url = "https://generativelanguage.googleapis.com/v1beta"
+
+    def endpoint(self, req: ChatRequest) -> str:
+        return f"/models/{req.model}:generateContent"
+
+    def headers(self, api_key: str) -> Dict[str, str]:
+        return {"x-goog-api-key": api_key}
+
+    def payload(self, req: ChatRequest) -> Dict[str, Any]:
+        # Implicit caching (Gemini 2.5+) matches on the prefix systemInstruction + leading user parts.
+        body: Dict[str, Any] = {
+            "contents": [{"role": "user", "parts": [{"text": p} for p in user_parts(req)]}],
+            "generationConfig": {
+                "temperature": req.temperature,
+                "maxOutputTokens": req.max_tokens,
+            },
+        }
+        if req.system_prompt:
+            body["systemInstruction"] = {"parts": [{"text": req.system_prompt}]}
+        return body
+
+    def parse(self, data: Dict[str, Any]) -> Tuple[str, Optional[int], Optional[int]]:
+        candidates = data.get("candidates") or [{}]
+        parts = (candidates[0].get("content") or {}).get("parts") or []
+        text = "".join(p.get("text", "") for p in parts)
+        usage = data.get("usageMetadata") or {}
+        return text, usage.get("promptTokenCount"), usage.get("candidatesTokenCount")
+
+    def cache_usage(self, data: Dict[str, Any]) -> Tuple[Optional[int], Optional[int]]:
+        return (data.get("usageMetadata") or {}).get("cachedContentTokenCount"), None
+
+    def stream_endpoint(self, req: ChatRequest) -> str:
+        return f"/models/{req.model}:streamGenerateContent?alt=sse"
+
+    def stream_payload(self, req: ChatRequest) -> Dict[str, Any]:
+        return self.payload(req)
+
+    def parse_event(self, data: Dict[str, Any]) -> Tuple[str, Optional[int], Optional[int]]:
+        # Each SSE chunk has the generateContent shape; usage counts are cumulative.
+        return self.parse(data)
+
+
+ADAPTERS: Dict[str, ProviderAdapter] = {
+    a.name: a for a in (GeminiAdapter(), OpenAIAdapter(), AnthropicAdapter(), GrokAdapter())
+}
+
+
+# =========================
+# Streaming
+# =========================
+def iter_sse_json(lines: Iterator[str]) -> Iterator[Dict[str, Any]]:
+    """Decode `data: {...}` lines of a server-sent event stream into JSON objects."""
+    for line in lines:
+        if not line.startswith("data:"):
+            continue
+        raw = line[5:].strip()
+        if not raw or raw == "[DONE]":
+            continue
+        try:
+            yield json.loads(raw)
+        except ValueError:
+            continue
+
+
+class ChatStream:
+    """
+    Iterate to receive text deltas as they arrive. Once exhausted, `result` holds
+    the full ChatResult including time-to-first-token and tokens/sec. `provider` and
+    `model` name whoever is serving the text, also when the stream is closed early.
+    """
+
+    def __init__(self, provider: str = "", model: str = "") -> None:
+        self._deltas: Iterator[str] = iter(())
+        self.result: Optional[ChatResult] = None
+        self.provider = provider
+        self.model = model
+
+    def __iter__(self) -> Iterator[str]:
+        return self._deltas
+
+    def close(self) -> None:
+        """Stop early; closes the underlying HTTP response."""
+        close = getattr(self._deltas, "close", None)
+        if close is not None:
+            close()
+
+
+# =========================
+# Connection Pool (one keep-alive client per provider per process)
+# =========================
+class ProviderPool:
+    """
+    Holds one long-lived httpx.Client per provider. httpx clients are thread-safe,
+    so a single pool can be shared by every Streamlit session and worker thread;
+    TLS sessions and connections are reused across steps instead of rebuilt per click.
+
+    Every call is admitted through the rate limiter (requests/min, tokens/min,
+    429 cooldowns) and a per-provider concurrency slot, and retryable failures are
+    retried with jittered exponential backoff that honors Retry-After.
+    """
+
+    def __init__(
+        self,
+        settings: Optional[ProviderSettings] = None,
+        limiter: Optional[RateLimiter] = None,
+        retry: Optional[RetryPolicy] = None,
+    ):
+        self.settings = settings or ProviderSettings()
+        self.limiter = limiter or RateLimiter()
+        self.retry = retry or RetryPolicy()
+        self.stats: Dict[str, ProviderStats] = {p: ProviderStats() for p in ADAPTERS}
+        self._clients: Dict[str, httpx.Client] = {}
+        self._slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    def client(self, provider: str) -> httpx.Client:
+        client = self._clients.get(provider)
+        if client is not None:
+            return client
+        with self._lock:
+            if provider not in self._clients:
+                s = self.settings
+                self._clients[provider] = httpx.Client(
+                    base_url=s.base_urls.get(provider) or ADAPTERS[provider].base_url,
+                    timeout=httpx.Timeout(s.read_timeout, connect=s.connect_timeout),
+                    limits=httpx.Limits(
+                        max_connections=s.max_connections,
+                        max_keepalive_connections=s.max_keepalive,
+                        keepalive_expiry=s.keepalive_expiry,
+                    ),
+                )
+                self._slots[provider] = threading.BoundedSemaphore(s.max_concurrency)
+            return self._clients[provider]
+
+    # ---- scheduling ----
+    def _bump(self, provider: str, **deltas: float) -> None:
+        with self._stats_lock:
+            stats = self.stats.setdefault(provider, ProviderStats())
+            for name, delta in deltas.items():
+                setattr(stats, name, getattr(stats, name) + delta)
+
+    @contextmanager
+    def _admit(self, provider: str, req: ChatRequest, parent: Optional[Span] = None) -> Iterator[int]:
+        """Wait for rate budget, then a concurrency slot. Yields the reserved token count."""
+        reserved = estimate_tokens(req.context) + estimate_tokens(req.system_prompt) + estimate_tokens(req.user_prompt) + req.max_tokens
+        slot = self._slots[provider]
+        self._bump(provider, waiting=1)
+        queued = start_span("provider.queue", parent, provider=provider, reserved_tokens=reserved)
+        start = time.perf_counter()
+        try:
+            self.limiter.acquire(provider, reserved)
+            slot.acquire()
+        finally:
+            self._bump(provider, waiting=-1, throttled_s=time.perf_counter() - start)
+            end_span(queued)
+        self._bump(provider, in_flight=1, requests=1)
+        try:
+            yield reserved
+        finally:
+            self._bump(provider, in_flight=-1)
+            slot.release()
+
+    def _backoff(self, provider: str, err: ProviderError, attempt: int, retry: RetryPolicy,
+                 parent: Optional[Span] = None) -> bool:
+        """Sleep before the next attempt if `err` is retryable; False when out of attempts."""
+        if err.status_code == 429:
+            self._bump(provider, rejections=1)
+            if err.retry_after:
+                self.limiter.cooldown(provider, err.retry_after)
+        if not err.retryable or attempt + 1 >= retry.max_attempts:
+            return False
+        delay = retry.delay(attempt, err.retry_after)
+        self._bump(provider, retries=1, throttled_s=delay)
+        waited = start_span("provider.backoff", parent, provider=provider, attempt=attempt + 1,
+                            status_code=err.status_code or 0, delay_ms=int(delay * 1000))
+        time.sleep(delay)
+        end_span(waited)
+        return True
+
+    # ---- calls ----
+    def complete(
+        self,
+        req: ChatRequest,
+        api_key: str,
+        provider: Optional[str] = None,
+        retry: Optional[RetryPolicy] = None,
+    ) -> ChatResult:
+        """
+        Run one blocking chat completion (with admission and retries) and return text + usage.
+        `retry` overrides the pool's policy, e.g. fewer attempts when a fallback model is ready.
+        """
+        provider = provider or provider_for_model(req.model)
+        retry = retry or self.retry
+        self.client(provider)
+        start = time.perf_counter()
+        attempt = 0
+        with span("provider.call", provider=provider, model=req.model) as call:
+            while True:
+                try:
+                    result = self._complete_once(req, api_key, provider)
+                    call.set(attempts=attempt + 1)
+                    return ChatResult(**{**result.__dict__, "latency_ms": int((time.perf_counter() - start) * 1000)})
+                except ProviderError as e:
+                    if not self._backoff(provider, e, attempt, retry):
+                        call.set(attempts=attempt + 1)
+                        raise
+                    attempt += 1
+
+    def _complete_once(self, req: ChatRequest, api_key: str, provider: str) -> ChatResult:
+        adapter = ADAPTERS[provider]
+        client = self.client(provider)
+        start = time.perf_counter()
+        with self._admit(provider, req) as reserved:
+            with span("provider.http", provider=provider) as http:
+                try:
+                    resp = client.post(adapter.endpoint(req), headers=adapter.headers(api_key), json=adapter.payload(req))
+                except httpx.HTTPError as e:
+                    raise ProviderError(provider, f"{type(e).__name__}: {e}") from e
+                http.set(status_code=resp.status_code, response_bytes=len(resp.content))
+            if resp.status_code >= 400:
+                raise _http_error(provider, resp)
+            try:
+                data = resp.json()
+                text, tokens_in, tokens_out = adapter.parse(data)
+                cache_read, cache_write = adapter.cache_usage(data)
+            except ValueError as e:
+                raise ProviderError(provider, f"invalid response body: {e}", resp.status_code) from e
+            if tokens_in is not None and tokens_out is not None:
+                self.limiter.settle(provider, reserved, tokens_in + tokens_out)
+        return ChatResult(
+            text=text,
+            provider=provider,
+            model=req.model,
+            latency_ms=int((time.perf_counter() - start) * 1000),
+            input_tokens=tokens_in,
+            output_tokens=tokens_out,
+            cache_read_tokens=cache_read,
+            cache_write_tokens=cache_write,
+        )
+
+    def stream(
+        self,
+        req: ChatRequest,
+        api_key: str,
+        provider: Optional[str] = None,
+        retry: Optional[RetryPolicy] = None,
+        parent: Optional[Span] = None,
+    ) -> ChatStream:
+        """
+        Start a streaming chat completion; the request is sent on first iteration. Its spans
+        go under `parent`, else under whatever span is current when iteration starts.
+        """
+        provider = provider or provider_for_model(req.model)
+        self.client(provider)
+        stream = ChatStream(provider, req.model)
+        stream._deltas = self._stream_deltas(stream, req, api_key, provider, retry or self.retry, parent)
+        return stream
+
+    def _stream_deltas(
+        self, stream: ChatStream, req: ChatRequest, api_key: str, provider: str, retry: RetryPolicy,
+        parent: Optional[Span] = None,
+    ) -> Iterator[str]:
+        adapter = ADAPTERS[provider]
+        client = self.client(provider)
+        parts = []
+        tokens_in: Optional[int] = None
+        tokens_out: Optional[int] = None
+        cache_read: Optional[int] = None
+        cache_write: Optional[int] = None
+        chunks = 0
+        start = time.perf_counter()
+        first: Optional[float] = None
+        attempt = 0
+        # Explicit spans: this generator runs in its consumer's context, so it must not change the current span.
+        call = start_span("provider.stream", parent, provider=provider, model=req.model)
+        error = ""
+        try:
+            while True:
+                try:
+                    with self._admit(provider, req, call) as reserved:
+                        http = start_span("provider.http", call, provider=provider)
+                        waiting = start_span("provider.first_token", http)
+                        try:
+                            with client.stream(
+                                "POST",
+                                adapter.stream_endpoint(req),
+                                headers=adapter.headers(api_key),
+                                json=adapter.stream_payload(req),
+                            ) as resp:
+                                http.set(status_code=resp.status_code)
+                                if resp.status_code >= 400:
+                                    resp.read()
+                                    raise _http_error(provider, resp)
+                                for event in iter_sse_json(resp.iter_lines()):
+                                    delta, e_in, e_out = adapter.parse_event(event)
+                                    tokens_in = e_in if e_in is not None else tokens_in
+                                    tokens_out = e_out if e_out is not None else tokens_out
+                                    e_read, e_write = adapter.cache_usage(event)
+                                    cache_read = e_read if e_read is not None else cache_read
+                                    cache_write = e_write if e_write is not None else cache_write
+                                    if not delta:
+                                        continue
+                                    if first is None:
+                                        first = time.perf_counter()
+                                        end_span(waiting)
+                                    chunks += 1
+                                    parts.append(delta)
+                                    yield delta
+                        except httpx.HTTPError as e:
+                            raise ProviderError(provider, f"{type(e).__name__}: {e}") from e
+                        finally:
+                            end_span(waiting)
+                            http.set(chunks=chunks)
+                            end_span(http)
+                        if tokens_in is not None and tokens_out is not None:
+                            self.limiter.settle(provider, reserved, tokens_in + tokens_out)
+                    break
+                except ProviderError as e:
+                    # Once tokens reached the caller a retry would duplicate output; surface it instead.
+                    if first is not None or not self._backoff(provider, e, attempt, retry, call):
+                        raise
+                    attempt += 1
+        except ProviderError as e:
+            error = str(e)
+            raise
+        finally:
+            call.set(attempts=attempt + 1, chunks=chunks)
+            if first is not None:
+                call.set(ttft_ms=int((first - start) * 1000))
+            end_span(call, error)
+        end = time.perf_counter()
+        generated = tokens_out if tokens_out is not None else chunks
+        decode_s = end - first if first is not None else 0.0
+        stream.result = ChatResult(
+            text="".join(parts),
+            provider=provider,
+            model=req.model,
+            latency_ms=int((end - start) * 1000),
+            input_tokens=tokens_in,
+            output_tokens=tokens_out,
+            ttft_ms=int((first - start) * 1000) if first is not None else None,
+            tokens_per_s=round(generated / decode_s, 1) if decode_s > 0 else None,
+            cache_read_tokens=cache_read,
+            cache_write_tokens=cache_write,
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
@@ -0,0 +1,156 @@
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Dict, Mapping, Optional
+
+
+RETRYABLE_STATUS = frozenset({408, 409, 429, 500, 502, 503, 504, 529})
+
+
+@dataclass(frozen=True)
+class ProviderLimits:
+    rpm: float = 0.0  # requests per minute; 0 = unlimited
+    tpm: float = 0.0  # tokens per minute (prompt + reserved output); 0 = unlimited
+
+    @classmethod
+    def from_env(cls, provider: str) -> "ProviderLimits":
+        """FORMAGENT_<PROVIDER>_RPM / FORMAGENT_<PROVIDER>_TPM, e.g. FORMAGENT_OPENAI_TPM=200000."""
+        prefix = f"FORMAGENT_{provider.upper()}_"
+        try:
+            return cls(rpm=float(os.getenv(prefix + "RPM", 0)), tpm=float(os.getenv(prefix + "TPM", 0)))
+        except ValueError:
+            return cls()
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_attempts: int = 5
+    base_delay_s: float = 1.0
+    max_delay_s: float = 60.0
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Full-jitter exponential backoff; never sooner than the server's Retry-After."""
+        backoff = random.uniform(0, min(self.max_delay_s, self.base_delay_s * (2 ** attempt)))
+        return max(backoff, retry_after or 0.0)
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """Seconds to wait from `retry-after-ms` / `retry-after` (delta-seconds or HTTP date)."""
+    ms = headers.get("retry-after-ms")
+    if ms:
+        try:
+            return float(ms) / 1000.0
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass
+class ProviderStats:
+    requests: int = 0
+    waiting: int = 0  # callers queued on rate limits or concurrency slots
+    in_flight: int = 0
+    throttled_s: float = 0.0  # total time callers spent waiting on budgets / cooldowns
+    retries: int = 0
+    rejections: int = 0  # 429 responses
+
+
+# =========================
+# Token buckets
+# =========================
+class TokenBucket:
+    """Continuous-refill bucket holding up to one minute of budget."""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        amount = min(amount, self.capacity)  # a single oversize call must still be able to run
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+    def refund(self, amount: float) -> None:
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    """
+    Per-provider requests/min and tokens/min budgets plus a provider-wide cooldown
+    that a 429 with Retry-After sets, so queued callers wait instead of burning
+    more rejected calls.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, ProviderLimits]] = None):
+        self.limits = dict(limits or {})
+        self._requests: Dict[str, TokenBucket] = {}
+        self._tokens: Dict[str, TokenBucket] = {}
+        self._cooldown_until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _buckets(self, provider: str):
+        if provider not in self.limits:
+            self.limits[provider] = ProviderLimits.from_env(provider)
+        lim = self.limits[provider]
+        if lim.rpm and provider not in self._requests:
+            self._requests[provider] = TokenBucket(lim.rpm)
+        if lim.tpm and provider not in self._tokens:
+            self._tokens[provider] = TokenBucket(lim.tpm)
+        return self._requests.get(provider), self._tokens.get(provider)
+
+    def acquire(self, provider: str, tokens: int) -> float:
+        """Block until one request of `tokens` fits the budgets. Returns seconds waited."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                req_bucket, tok_bucket = self._buckets(provider)
+                wait = max(0.0, self._cooldown_until.get(provider, 0.0) - now)
+                if req_bucket is not None:
+                    wait = max(wait, req_bucket.wait_time(1, now))
+                if tok_bucket is not None:
+                    wait = max(wait, tok_bucket.wait_time(tokens, now))
+                if wait <= 0:
+                    if req_bucket is not None:
+                        req_bucket.take(1)
+                    if tok_bucket is not None:
+                        tok_bucket.take(tokens)
+                    return waited
+            time.sleep(wait)
+            waited += wait
+
+    def settle(self, provider: str, reserved: int, used: Optional[int]) -> None:
+        """Return unused reserved tokens (e.g. max_tokens that were not generated)."""
+        if used is None or used >= reserved:
+            return
+        with self._lock:
+            bucket = self._tokens.get(provider)
+            if bucket is not None:
+                bucket.refund(reserved - used)
+
+    def cooldown(self, provider: str, seconds: float) -> None:
+        with self._lock:
+            until = time.monotonic() + seconds
+            self._cooldown_until[provider] = max(self._cooldown_until.get(provider, 0.0), until)
@@ -0,0 +1,144 @@
+import hashlib
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+import yaml
+
+
+AGENTS_YAML = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "agents.yaml")
+
+PLACEHOLDER_RE = re.compile(r"\{([A-Za-z_][A-Za-z0-9_]*)\}")
+
+
+# =========================
+# Agent Spec
+# =========================
+@dataclass(frozen=True)
+class AgentSpec:
+    agent_id: str
+    name: str
+    category: str
+    description: str
+    model: str
+    temperature: float
+    max_tokens: int
+    system_prompt: str
+    user_prompt_template: str
+    placeholders: Tuple[str, ...]  # pre-extracted, in template order, de-duplicated
+    output_requirements: Dict[str, Any] = field(default_factory=dict)
+    validation_rules: Dict[str, Any] = field(default_factory=dict)
+
+    def render(self, values: Mapping[str, str]) -> str:
+        """
+        Fill `{placeholder}` slots in one regex pass. Unknown braces are left as-is
+        (templates may contain literal JSON); missing values render as empty strings.
+        """
+        return PLACEHOLDER_RE.sub(
+            lambda m: str(values.get(m.group(1), "")) if m.group(1) in self.placeholders else m.group(0),
+            self.user_prompt_template,
+        )
+
+
+def fill_placeholders(template: str, values: Mapping[str, str]) -> str:
+    """Substitute only the placeholders present in `values`; leave the rest untouched."""
+    if not values:
+        return template
+    return PLACEHOLDER_RE.sub(lambda m: str(values[m.group(1)]) if m.group(1) in values else m.group(0), template)
+
+
+def _placeholders(template: str) -> Tuple[str, ...]:
+    return tuple(dict.fromkeys(PLACEHOLDER_RE.findall(template)))
+
+
+# =========================
+# Registry (immutable snapshot of one agents.yaml version)
+# =========================
+@dataclass(frozen=True)
+class AgentRegistry:
+    agents: Dict[str, AgentSpec]
+    by_category: Dict[str, Tuple[str, ...]]
+    by_model: Dict[str, Tuple[str, ...]]
+    digest: str
+
+    def get(self, agent_id: str) -> AgentSpec:
+        return self.agents[agent_id]
+
+    def ids(self) -> List[str]:
+        return list(self.agents.keys())
+
+    def __contains__(self, agent_id: str) -> bool:
+        return agent_id in self.agents
+
+    def __len__(self) -> int:
+        return len(self.agents)
+
+
+# libyaml's loader parses agents.yaml ~10x faster than the pure-Python one (cold start).
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def parse_registry(raw: bytes) -> AgentRegistry:
+    data = yaml.load(raw, Loader=_YAML_LOADER) or {}
+    agents: Dict[str, AgentSpec] = {}
+    by_category: Dict[str, List[str]] = {}
+    by_model: Dict[str, List[str]] = {}
+    for key, cfg in (data.get("agents") or {}).items():
+        agent_id = cfg.get("agent_id", key)
+        template = cfg.get("user_prompt_template", "")
+        spec = AgentSpec(
+            agent_id=agent_id,
+            name=cfg.get("name", agent_id),
+            category=cfg.get("category", ""),
+            description=cfg.get("description", ""),
+            model=cfg.get("model", "gemini-2.5-flash"),
+            temperature=float(cfg.get("temperature", 0.2)),
+            max_tokens=int(cfg.get("max_tokens", 12000)),
+            system_prompt=cfg.get("system_prompt", ""),
+            user_prompt_template=template,
+            placeholders=_placeholders(template),
+            output_requirements=cfg.get("output_requirements") or {},
+            validation_rules=cfg.get("validation_rules") or {},
+        )
+        agents[agent_id] = spec
+        by_category.setdefault(spec.category, []).append(agent_id)
+        by_model.setdefault(spec.model, []).append(agent_id)
+    return AgentRegistry(
+        agents=agents,
+        by_category={k: tuple(v) for k, v in by_category.items()},
+        by_model={k: tuple(v) for k, v in by_model.items()},
+        digest=hashlib.sha256(raw).hexdigest(),
+    )
+
+
+# =========================
+# Loader (parse once; hot reload on file change)
+# =========================
+class RegistryLoader:
+    """
+    Returns the same AgentRegistry object until agents.yaml changes. Each call costs
+    one os.stat(); the file is re-read only when mtime/size move, and re-parsed only
+    when the content hash actually differs (e.g. `touch` does not trigger a parse).
+    """
+
+    def __init__(self, path: str = AGENTS_YAML):
+        self.path = path
+        self._stat: Optional[Tuple[int, int]] = None
+        self._registry: Optional[AgentRegistry] = None
+        self._lock = threading.Lock()
+
+    def current(self) -> AgentRegistry:
+        st = os.stat(self.path)
+        key = (st.st_mtime_ns, st.st_size)
+        if self._registry is not None and key == self._stat:
+            return self._registry
+        with self._lock:
+            if self._registry is None or key != self._stat:
+                with open(self.path, "rb") as f:
+                    raw = f.read()
+                if self._registry is None or hashlib.sha256(raw).hexdigest() != self._registry.digest:
+                    self._registry = parse_registry(raw)
+                self._stat = key
+            return self._registry
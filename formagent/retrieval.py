@@ -0,0 +1,177 @@
+"""
+In-process BM25 over the sections of one submission, so a specialist agent reads only
+the sections relevant to it instead of the whole document.
+
+    index = index_for(submission_text)          # built once per text (LRU)
+    text = narrow(registry.get("labeling_ifu_agent"), index, budget_tokens=6000)
+
+Latin text is indexed by words, Chinese by overlapping character bigrams (no segmenter
+needed, and bigrams match most two-character terms exactly). NumPy is imported on first
+use, not at module import.
+"""
+import functools
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from formagent.chunking import estimate_tokens, split_headings, split_markdown
+from formagent.registry import PLACEHOLDER_RE, AgentSpec
+from formagent.tracing import span
+
+SECTION_TOKENS = 400  # Markdown sections above this are split further (paragraphs, then lines)
+RETRIEVAL_TOKENS = 6000  # default input budget per agent; smaller submissions pass through whole
+K1 = 1.2
+B = 0.75
+GAP = "\n\n[…]\n\n"  # marks omitted sections between retrieved ones
+
+TOKEN_RE = re.compile(r"(?P<word>[0-9a-z]{2,})|(?P<cjk>[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+)")
+STOPWORDS = frozenset(
+    "the and for with that this from are was were be been has have had not but its into than then their "
+    "there these those which will would shall should can could may might must any all each per via of to in "
+    "on at by or as is it an if no".split()
+)
+
+
+def split_sections(text: str, section_tokens: int = SECTION_TOKENS) -> List[str]:
+    """
+    One unit per Markdown section, never two headings in one unit: a unit that mixes
+    topics ranks for neither. Oversize sections (and heading-less text) are split by
+    paragraph and packed up to `section_tokens`.
+    """
+    out: List[str] = []
+    for section in split_headings(text):
+        if section.strip():
+            out.extend(s for s in split_markdown(section, section_tokens) if s.strip())
+    return out
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased words (2+ chars, minus stopwords) and CJK bigrams; a lone CJK character is kept as-is."""
+    out: List[str] = []
+    for m in TOKEN_RE.finditer(text.lower()):
+        word = m.group("word")
+        if word is not None:
+            if word not in STOPWORDS:
+                out.append(word)
+            continue
+        run = m.group("cjk")
+        if len(run) == 1:
+            out.append(run)
+        else:
+            out.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return out
+
+
+class SectionIndex:
+    """
+    BM25 with the per-(term, section) weights precomputed at build time, stored as
+    postings sorted by term. A query is then one gather and one bincount.
+    """
+
+    def __init__(self, sections: Sequence[str], k1: float = K1, b: float = B):
+        import numpy as np
+
+        self.sections: Tuple[str, ...] = tuple(sections)
+        self.tokens: Tuple[int, ...] = tuple(estimate_tokens(s) for s in self.sections)
+        self._vocab: Dict[str, int] = {}
+        terms: List[int] = []
+        docs: List[int] = []
+        tfs: List[int] = []
+        lengths: List[int] = []
+        for d, section in enumerate(self.sections):
+            counts = Counter(tokenize(section))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                terms.append(self._vocab.setdefault(term, len(self._vocab)))
+                docs.append(d)
+                tfs.append(tf)
+        n = max(1, len(self.sections))
+        term_arr = np.asarray(terms, dtype=np.int64)
+        order = np.argsort(term_arr, kind="stable")
+        self._docs = np.asarray(docs, dtype=np.int64)[order]
+        df = np.bincount(term_arr, minlength=len(self._vocab))
+        self._offsets = np.concatenate(([0], np.cumsum(df)))
+        tf = np.asarray(tfs, dtype=np.float64)[order]
+        dl = np.asarray(lengths, dtype=np.float64)[self._docs]
+        avgdl = max(1.0, float(np.mean(lengths))) if lengths else 1.0
+        idf = np.log1p((n - df + 0.5) / (df + 0.5))[term_arr[order]]
+        self._weights = idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl))
+
+    @classmethod
+    def build(cls, text: str, section_tokens: int = SECTION_TOKENS) -> "SectionIndex":
+        return cls(split_sections(text, section_tokens))
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(self.tokens)
+
+    def scores(self, query: str) -> Any:
+        """BM25 score of every section (ndarray); each distinct query term counts once."""
+        import numpy as np
+
+        ids = sorted({self._vocab[t] for t in tokenize(query) if t in self._vocab})
+        if not ids:
+            return np.zeros(len(self.sections))
+        picks = np.concatenate([np.arange(self._offsets[t], self._offsets[t + 1]) for t in ids])
+        return np.bincount(self._docs[picks], weights=self._weights[picks], minlength=len(self.sections))
+
+    def select(self, query: str, budget_tokens: int, top_k: Optional[int] = None) -> List[int]:
+        """Best-scoring sections that fit in `budget_tokens` (at most `top_k`), in document order."""
+        import numpy as np
+
+        scores = self.scores(query)
+        chosen: List[int] = []
+        used = 0
+        for i in np.argsort(-scores, kind="stable"):
+            if scores[i] <= 0 or (top_k is not None and len(chosen) >= top_k):
+                break
+            if used + self.tokens[i] > budget_tokens:
+                continue  # a smaller, lower-ranked section may still fit
+            chosen.append(int(i))
+            used += self.tokens[i]
+        return sorted(chosen)
+
+    def text(self, picks: Sequence[int]) -> str:
+        out: List[str] = []
+        for j, i in enumerate(picks):
+            if j and i != picks[j - 1] + 1:
+                out.append(GAP)
+            elif j:
+                out.append("\n\n")
+            out.append(self.sections[i].strip())
+        return "".join(out)
+
+
+@functools.lru_cache(maxsize=8)
+def index_for(text: str) -> SectionIndex:
+    """One index per distinct submission text, reused across agents and reruns."""
+    with span("retrieval.index", chars=len(text)) as traced:
+        index = SectionIndex.build(text)
+        traced.set(sections=len(index.sections))
+    return index
+
+
+def agent_query(spec: AgentSpec) -> str:
+    """What the agent is about: its name, description, instructions and template wording."""
+    return "\n".join((spec.name, spec.description, spec.system_prompt, PLACEHOLDER_RE.sub(" ", spec.user_prompt_template)))
+
+
+def narrow(spec: AgentSpec, index: SectionIndex, budget_tokens: int = RETRIEVAL_TOKENS, top_k: Optional[int] = None) -> str:
+    """
+    The submission as `spec` should see it: whole if it fits in `budget_tokens`,
+    otherwise only its most relevant sections, with omissions marked.
+    """
+    if index.total_tokens <= budget_tokens or not index.sections:
+        return index.text(range(len(index.sections)))
+    with span("retrieval.select", agent_id=spec.agent_id, sections=len(index.sections)) as traced:
+        picks = index.select(agent_query(spec), budget_tokens, top_k)
+        if not picks:  # nothing matched: fall back to the start of the document
+            used = 0
+            for i, tokens in enumerate(index.tokens):
+                if used + tokens > budget_tokens:
+                    break
+                picks.append(i)
+                used += tokens
+        traced.set(kept=len(picks), tokens_in=index.total_tokens, tokens_out=sum(index.tokens[i] for i in picks))
+    return index.text(picks)
+
@@ -0,0 +1,243 @@
+import dataclasses
+import os
+import threading
+import time
+import warnings
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Iterator, List, Mapping, Optional, Tuple
+
+from formagent.providers import ChatRequest, ChatResult, ChatStream, ProviderError, ProviderPool, provider_for_model
+from formagent.ratelimit import RetryPolicy
+from formagent.tracing import end_span, span, start_span
+from formagent.usage import count_tokens, estimate_request
+
+
+# Models the router may pick from, in the same order as the Agent Studio selectbox.
+DEFAULT_CANDIDATES: Tuple[str, ...] = (
+    "gpt-4o-mini",
+    "gpt-4.1-mini",
+    "gemini-2.5-flash",
+    "gemini-2.5-flash-lite",
+    "claude-haiku-4-5",
+    "grok-4-fast-reasoning",
+    "grok-3-mini",
+)
+PREFERENCES = ("pinned", "cost", "latency")
+
+
+@dataclass(frozen=True)
+class RoutingPolicy:
+    latency_slo_ms: int = 0  # p95 target per call; 0 = no SLO
+    max_cost_usd: float = 0.0  # worst-case cost ceiling per call; 0 = no ceiling
+    prefer: str = "pinned"  # pinned: keep the agent's model while it meets the policy
+    candidates: Tuple[str, ...] = DEFAULT_CANDIDATES
+    max_fallbacks: int = 2  # alternate models tried after the first one fails
+    ignored: Tuple[str, ...] = ()  # FORMAGENT_ROUTE_MODELS entries with no known provider
+
+    @classmethod
+    def from_env(cls) -> "RoutingPolicy":
+        """
+        FORMAGENT_ROUTE_SLO_MS / FORMAGENT_ROUTE_MAX_COST / FORMAGENT_ROUTE_PREFER / FORMAGENT_ROUTE_MODELS.
+        Route models without a known provider are dropped with a warning (and kept in `ignored`).
+        """
+        d = cls()
+        try:
+            slo = int(os.getenv("FORMAGENT_ROUTE_SLO_MS", d.latency_slo_ms))
+            ceiling = float(os.getenv("FORMAGENT_ROUTE_MAX_COST", d.max_cost_usd))
+        except ValueError:
+            slo, ceiling = d.latency_slo_ms, d.max_cost_usd
+        prefer = os.getenv("FORMAGENT_ROUTE_PREFER", d.prefer)
+        models, ignored = [], []
+        for m in (m.strip() for m in os.getenv("FORMAGENT_ROUTE_MODELS", "").split(",")):
+            if m:
+                (models if _known_model(m) else ignored).append(m)
+        if ignored:
+            warnings.warn(f"FORMAGENT_ROUTE_MODELS: ignoring models with no known provider: {', '.join(ignored)}", stacklevel=2)
+        return cls(
+            latency_slo_ms=slo,
+            max_cost_usd=ceiling,
+            prefer=prefer if prefer in PREFERENCES else d.prefer,
+            candidates=tuple(models) or d.candidates,
+            ignored=tuple(ignored),
+        )
+
+
+def _known_model(model: str) -> bool:
+    try:
+        provider_for_model(model)
+    except ValueError:
+        return False
+    return True
+
+
+# =========================
+# Latency / health tracking
+# =========================
+@dataclass(frozen=True)
+class ModelHealth:
+    model: str
+    samples: int
+    p50_ms: Optional[int]
+    p95_ms: Optional[int]
+    failures: int  # consecutive failures of the model's provider
+    open: bool  # circuit open: provider skipped until the cooldown ends
+
+
+class LatencyTracker:
+    """
+    Rolling latency window per model and a per-provider circuit breaker: after
+    `failure_threshold` consecutive failures a provider is skipped for `open_s`
+    seconds, then tried again (one success closes the circuit).
+    """
+
+    def __init__(self, window: int = 200, failure_threshold: int = 3, open_s: float = 60.0):
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.open_s = open_s
+        self._latencies: Dict[str, Deque[int]] = {}
+        self._failures: Dict[str, int] = {}
+        self._open_until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, latency_ms: int) -> None:
+        provider = provider_for_model(model)
+        with self._lock:
+            self._latencies.setdefault(model, deque(maxlen=self.window)).append(latency_ms)
+            self._failures[provider] = 0
+            self._open_until.pop(provider, None)
+
+    def record_failure(self, model: str) -> None:
+        provider = provider_for_model(model)
+        with self._lock:
+            self._failures[provider] = self._failures.get(provider, 0) + 1
+            if self._failures[provider] >= self.failure_threshold:
+                self._open_until[provider] = time.monotonic() + self.open_s
+
+    def percentile(self, model: str, q: float) -> Optional[int]:
+        with self._lock:
+            samples = sorted(self._latencies.get(model, ()))
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def is_open(self, provider: str) -> bool:
+        with self._lock:
+            return self._open_until.get(provider, 0.0) > time.monotonic()
+
+    def health(self, model: str) -> ModelHealth:
+        provider = provider_for_model(model)
+        with self._lock:
+            samples = len(self._latencies.get(model, ()))
+            failures = self._failures.get(provider, 0)
+        return ModelHealth(
+            model=model,
+            samples=samples,
+            p50_ms=self.percentile(model, 0.50),
+            p95_ms=self.percentile(model, 0.95),
+            failures=failures,
+            open=self.is_open(provider),
+        )
+
+
+# =========================
+# Router
+# =========================
+class Router:
+    """
+    Ranks candidate models for a request and runs it with fallback. Candidates need
+    an API key, a closed circuit, enough context and a worst-case cost under the
+    ceiling; models whose measured p95 breaches the SLO sink below those that meet it.
+    """
+
+    def __init__(self, policy: Optional[RoutingPolicy] = None, tracker: Optional[LatencyTracker] = None):
+        self.policy = policy or RoutingPolicy()
+        self.tracker = tracker or LatencyTracker()
+        # With a fallback ready, give up on a failing model quickly instead of backing off for a minute.
+        self.fallback_retry = RetryPolicy(max_attempts=2, base_delay_s=0.5, max_delay_s=5.0)
+
+    def rank(self, req: ChatRequest, api_keys: Mapping[str, str],
+             policy: Optional[RoutingPolicy] = None) -> List[str]:
+        policy = policy or self.policy
+        models = list(dict.fromkeys((req.model,) + tuple(policy.candidates)))
+        keyed = [m for m in models if api_keys.get(provider_for_model(m))]
+        healthy = [m for m in keyed if not self.tracker.is_open(provider_for_model(m))] or keyed
+        scored = []
+        for m in healthy:
+            est = estimate_request(m, req.system_prompt, req.user_prompt, req.max_tokens, count_tokens(req.context))
+            if not est.fits:
+                continue
+            if policy.max_cost_usd and (est.max_cost_usd is None or est.max_cost_usd > policy.max_cost_usd):
+                continue
+            p95 = self.tracker.percentile(m, 0.95)
+            breaches = bool(policy.latency_slo_ms and p95 is not None and p95 > policy.latency_slo_ms)
+            if policy.prefer == "latency":
+                primary = self.tracker.percentile(m, 0.50) or 0  # unmeasured models get sampled early
+            elif policy.prefer == "cost":
+                primary = est.max_cost_usd if est.max_cost_usd is not None else float("inf")
+            else:
+                primary = 0 if m == req.model else 1
+            scored.append(((breaches, primary, m != req.model), m))
+        ranked = [m for _, m in sorted(scored, key=lambda x: x[0])]
+        return ranked or ([req.model] if req.model in keyed else [])
+
+    def _plan(self, req: ChatRequest, api_keys: Mapping[str, str],
+              policy: Optional[RoutingPolicy]) -> Tuple[List[str], Optional[RetryPolicy]]:
+        policy = policy or self.policy
+        plan = self.rank(req, api_keys, policy)[:1 + policy.max_fallbacks]
+        if not plan:
+            raise ProviderError(provider_for_model(req.model), "no routable model (missing API keys or policy too strict)")
+        return plan, self.fallback_retry if len(plan) > 1 else None
+
+    def complete(self, pool: ProviderPool, req: ChatRequest, api_keys: Mapping[str, str],
+                 policy: Optional[RoutingPolicy] = None) -> ChatResult:
+        plan, retry = self._plan(req, api_keys, policy)
+        last: Optional[ProviderError] = None
+        with span("route", plan=plan) as routed:
+            for model in plan:
+                provider = provider_for_model(model)
+                try:
+                    result = pool.complete(dataclasses.replace(req, model=model), api_keys[provider], provider, retry=retry)
+                except ProviderError as e:
+                    self.tracker.record_failure(model)
+                    last = e
+                    continue
+                self.tracker.record(model, result.latency_ms)
+                routed.set(model=model)
+                return result
+            raise last
+
+    def stream(self, pool: ProviderPool, req: ChatRequest, api_keys: Mapping[str, str],
+               policy: Optional[RoutingPolicy] = None) -> ChatStream:
+        """Like ProviderPool.stream, falling back to the next model while no text has been yielded."""
+        plan, retry = self._plan(req, api_keys, policy)
+        stream = ChatStream(provider_for_model(plan[0]), plan[0])
+        stream._deltas = self._stream_deltas(stream, pool, req, api_keys, plan, retry)
+        return stream
+
+    def _stream_deltas(self, stream: ChatStream, pool: ProviderPool, req: ChatRequest,
+                       api_keys: Mapping[str, str], plan: List[str], retry: Optional[RetryPolicy]) -> Iterator[str]:
+        routed = start_span("route", plan=plan)
+        try:
+            for i, model in enumerate(plan):
+                provider = provider_for_model(model)
+                inner = pool.stream(dataclasses.replace(req, model=model), api_keys[provider], provider, retry=retry,
+                                    parent=routed)
+                stream.provider, stream.model = provider, model
+                started = False
+                try:
+                    for delta in inner:
+                        started = True
+                        yield delta
+                except ProviderError as e:
+                    self.tracker.record_failure(model)
+                    if started or i == len(plan) - 1:
+                        routed.error = str(e)
+                        raise
+                    continue
+                self.tracker.record(model, inner.result.latency_ms)
+                routed.set(model=model)
+                stream.result = inner.result
+                return
+        finally:
+            end_span(routed)
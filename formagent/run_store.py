@@ -0,0 +1,251 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+from formagent.config import data_dir
+from formagent.providers import ChatResult
+
+
+@dataclass(frozen=True)
+class RunRecord:
+    run_id: str
+    title: str
+    status: str
+    step: int
+    total_steps: int
+    created: float
+    updated: float
+
+
+@dataclass(frozen=True)
+class StepRecord:
+    """Step metadata only; prompt/output bodies are loaded lazily via RunStore.text()."""
+
+    run_id: str
+    step_index: int
+    agent_id: str
+    model: str
+    status: str
+    prompt_hash: str
+    output_hash: str
+    edited_hash: str
+    input_tokens: Optional[int]
+    output_tokens: Optional[int]
+    latency_ms: Optional[int]
+    ttft_ms: Optional[int]
+    created: float
+    cached: bool = False  # served from the response cache (no provider spend)
+    recipe_hash: str = ""  # StepRecipe JSON (see formagent.dag); "" = step cannot be re-run
+    deps: Tuple[int, ...] = ()  # upstream step indices whose outputs fed this step
+    inputs: Tuple[str, ...] = ()  # final_hash of each dep when this step ran
+    cache_read_tokens: Optional[int] = None  # provider prompt-cache reads (part of input_tokens)
+    cache_write_tokens: Optional[int] = None
+
+    @property
+    def final_hash(self) -> str:
+        """The output the next step consumes: the reviewer's edit if any, else the raw output."""
+        return self.edited_hash or self.output_hash
+
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS runs ("
+    " run_id TEXT PRIMARY KEY, title TEXT NOT NULL, status TEXT NOT NULL, step INTEGER NOT NULL,"
+    " total_steps INTEGER NOT NULL, created REAL NOT NULL, updated REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS steps ("
+    " run_id TEXT NOT NULL, step_index INTEGER NOT NULL, agent_id TEXT NOT NULL, model TEXT NOT NULL,"
+    " status TEXT NOT NULL, prompt_hash TEXT NOT NULL, output_hash TEXT NOT NULL, edited_hash TEXT NOT NULL,"
+    " input_tokens INTEGER, output_tokens INTEGER, latency_ms INTEGER, ttft_ms INTEGER, created REAL NOT NULL,"
+    " cached INTEGER NOT NULL DEFAULT 0, recipe_hash TEXT NOT NULL DEFAULT '', deps TEXT NOT NULL DEFAULT '',"
+    " inputs TEXT NOT NULL DEFAULT '', cache_read_tokens INTEGER, cache_write_tokens INTEGER,"
+    " PRIMARY KEY (run_id, step_index))",
+    # Content-addressed bodies: identical prompts/outputs across runs are stored once.
+    "CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, body TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS runs_updated ON runs(updated)",
+)
+
+_STEP_COLUMNS = (
+    "run_id, step_index, agent_id, model, status, prompt_hash, output_hash, edited_hash,"
+    " input_tokens, output_tokens, latency_ms, ttft_ms, created, cached, recipe_hash, deps, inputs,"
+    " cache_read_tokens, cache_write_tokens"
+)
+
+# Columns added after the first release; older stores get them on open.
+_ADDED_COLUMNS = (
+    ("cached", "INTEGER NOT NULL DEFAULT 0"),
+    ("recipe_hash", "TEXT NOT NULL DEFAULT ''"),
+    ("deps", "TEXT NOT NULL DEFAULT ''"),
+    ("inputs", "TEXT NOT NULL DEFAULT ''"),
+    ("cache_read_tokens", "INTEGER"),
+    ("cache_write_tokens", "INTEGER"),
+)
+
+
+def content_hash(body: str) -> str:
+    """Address of a stored prompt/output body (what StepRecord hashes refer to)."""
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+def _step(row: tuple) -> StepRecord:
+    *head, cached, recipe_hash, deps, inputs, cache_read_tokens, cache_write_tokens = row
+    return StepRecord(
+        *head,
+        cached=bool(cached),
+        recipe_hash=recipe_hash,
+        deps=tuple(int(d) for d in deps.split(",") if d),
+        inputs=tuple(h for h in inputs.split(",") if h),
+        cache_read_tokens=cache_read_tokens,
+        cache_write_tokens=cache_write_tokens,
+    )
+
+
+# =========================
+# Run Store (SQLite, survives reruns, session resets and restarts)
+# =========================
+class RunStore:
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(data_dir(), "runs.sqlite3")
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        for stmt in _SCHEMA:
+            self._db.execute(stmt)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(steps)")}
+        for name, decl in _ADDED_COLUMNS:
+            if name not in columns:
+                self._db.execute(f"ALTER TABLE steps ADD COLUMN {name} {decl}")
+
+    def _put_blob(self, body: str) -> str:
+        digest = content_hash(body)
+        self._db.execute("INSERT OR IGNORE INTO blobs (hash, body) VALUES (?, ?)", (digest, body))
+        return digest
+
+    def text(self, digest: str) -> str:
+        if not digest:
+            return ""
+        with self._lock:
+            row = self._db.execute("SELECT body FROM blobs WHERE hash = ?", (digest,)).fetchone()
+        return row[0] if row else ""
+
+    # ---- runs ----
+    def create_run(self, title: str, total_steps: int) -> str:
+        run_id = time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO runs (run_id, title, status, step, total_steps, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (run_id, title, "running", 0, total_steps, now, now),
+            )
+        return run_id
+
+    def update_run(self, run_id: str, status: str, step: int) -> None:
+        with self._lock:
+            self._db.execute(
+                "UPDATE runs SET status = ?, step = ?, updated = ? WHERE run_id = ?",
+                (status, step, time.time(), run_id),
+            )
+
+    def get_run(self, run_id: str) -> Optional[RunRecord]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT run_id, title, status, step, total_steps, created, updated FROM runs WHERE run_id = ?",
+                (run_id,),
+            ).fetchone()
+        return RunRecord(*row) if row else None
+
+    def list_runs(self, limit: int = 20) -> List[RunRecord]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT run_id, title, status, step, total_steps, created, updated FROM runs"
+                " ORDER BY updated DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [RunRecord(*r) for r in rows]
+
+    # ---- steps ----
+    def record_step(
+        self,
+        run_id: str,
+        step_index: int,
+        agent_id: str,
+        prompt: str,
+        result: Optional[ChatResult] = None,
+        model: str = "",
+        status: str = "completed",
+        recipe: str = "",
+        deps: Sequence[int] = (),
+    ) -> None:
+        """
+        Insert or replace one step. Re-running a step clears its previous edit.
+        `deps` are the steps whose outputs this one consumed; their current final
+        hashes are recorded as its inputs, so a later edit upstream marks it dirty.
+        """
+        with self._lock:
+            prompt_hash = self._put_blob(prompt)
+            output_hash = self._put_blob(result.text) if result is not None else ""
+            recipe_hash = self._put_blob(recipe) if recipe else ""
+            inputs = []
+            for d in deps:
+                row = self._db.execute(
+                    "SELECT edited_hash, output_hash FROM steps WHERE run_id = ? AND step_index = ?", (run_id, d)
+                ).fetchone()
+                inputs.append((row[0] or row[1]) if row else "")
+            self._db.execute(
+                f"INSERT OR REPLACE INTO steps ({_STEP_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    run_id, step_index, agent_id, result.model if result is not None else model, status,
+                    prompt_hash, output_hash, "",
+                    result.input_tokens if result is not None else None,
+                    result.output_tokens if result is not None else None,
+                    result.latency_ms if result is not None else None,
+                    result.ttft_ms if result is not None else None,
+                    time.time(),
+                    int(result.cached) if result is not None else 0,
+                    recipe_hash,
+                    ",".join(str(d) for d in deps),
+                    ",".join(inputs),
+                    result.cache_read_tokens if result is not None else None,
+                    result.cache_write_tokens if result is not None else None,
+                ),
+            )
+            self._db.execute("UPDATE runs SET updated = ? WHERE run_id = ?", (time.time(), run_id))
+
+    def save_edit(self, run_id: str, step_index: int, edited: str) -> None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT output_hash FROM steps WHERE run_id = ? AND step_index = ?", (run_id, step_index)
+            ).fetchone()
+            if row is None:
+                return
+            edited_hash = self._put_blob(edited)
+            self._db.execute(
+                "UPDATE steps SET edited_hash = ? WHERE run_id = ? AND step_index = ?",
+                ("" if edited_hash == row[0] else edited_hash, run_id, step_index),
+            )
+
+    def steps(self, run_id: str) -> List[StepRecord]:
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {_STEP_COLUMNS} FROM steps WHERE run_id = ? ORDER BY step_index", (run_id,)
+            ).fetchall()
+        return [_step(r) for r in rows]
+
+    def next_step_index(self, run_id: str) -> int:
+        """Index the run's next step is stored under: one past its last completed step."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT MAX(step_index) FROM steps WHERE run_id = ? AND status = 'completed'", (run_id,)
+            ).fetchone()
+        return row[0] + 1 if row[0] is not None else 0
+
+    def resume_point(self, run_id: str) -> Tuple[int, str]:
+        """(next step index, output to feed it) after the last completed step of a run."""
+        done = [s for s in self.steps(run_id) if s.status == "completed"]
+        if not done:
+            return 0, ""
+        last = done[-1]
+        return last.step_index + 1, self.text(last.final_hash)
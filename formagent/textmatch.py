@@ -0,0 +1,70 @@
+import string
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+
+_FOLD = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)  # length-preserving, unlike str.lower()
+
+
+# =========================
+# Aho-Corasick automaton (all keywords in one pass, resumable across chunks)
+# =========================
+class KeywordAutomaton:
+    """
+    Multi-keyword matcher: one left-to-right pass finds every occurrence of every
+    keyword, in time linear in the text regardless of the number of keywords.
+    ASCII matching is case-insensitive. `scan` takes and returns a state so a
+    stream can be matched chunk by chunk, including keywords split across chunks.
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords: Tuple[str, ...] = tuple(dict.fromkeys(k for k in keywords if k))
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Tuple[int, ...]] = [()]
+        for index, word in enumerate(self.keywords):
+            node = 0
+            for ch in word.translate(_FOLD):
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                node = nxt
+            self._out[node] += (index,)
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] += self._out[self._fail[nxt]]
+
+    def scan(self, text: str, state: int = 0, offset: int = 0) -> Tuple[int, List[Tuple[int, int]]]:
+        """
+        Feed `text`; returns (new state, [(end_offset, keyword_index), ...]) where
+        end_offset is exclusive and counted from `offset` (the chunk's position in the stream).
+        """
+        goto, fail, out = self._goto, self._fail, self._out
+        hits: List[Tuple[int, int]] = []
+        node = state
+        for i, ch in enumerate(text.translate(_FOLD)):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                end = offset + i + 1
+                hits.extend((end, k) for k in out[node])
+        return node, hits
+
+    def finditer(self, text: str) -> Iterator[Tuple[int, int, str]]:
+        """(start, end, keyword) for every occurrence, overlapping matches included."""
+        _, hits = self.scan(text)
+        for end, k in hits:
+            word = self.keywords[k]
+            yield end - len(word), end, word
@@ -0,0 +1,277 @@
+"""
+Lightweight spans for agent steps and app reruns, exportable as OpenTelemetry (OTLP/JSON).
+
+    with span("agent.request", agent_id=agent_id) as s:
+        ...
+        s.set(cached=True)
+
+Spans nest through a context variable; threads started by fan_out inherit the caller's
+span via `bind`. Code inside generators (streams) must use `start_span` / `end_span`,
+which never change the current span, because a generator's context leaks to its caller
+between yields. Set FORMAGENT_TRACE_FILE to append every finished trace to a JSONL file
+(one OTLP ExportTraceServiceRequest per line); FORMAGENT_TRACE=0 turns tracing off.
+"""
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+SERVICE_NAME = "formagent"
+
+# Span name prefix -> where the time went (Dashboard breakdown).
+CATEGORIES: Tuple[Tuple[str, str], ...] = (
+    ("provider.http", "provider"),
+    ("provider.first_token", "provider"),
+    ("provider.queue", "queue"),
+    ("provider.backoff", "queue"),
+    ("ui.", "ui"),
+)
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str = ""
+    start_ns: int = 0
+    end_ns: int = 0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: str = ""
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    @property
+    def category(self) -> str:
+        return next((c for prefix, c in CATEGORIES if self.name.startswith(prefix)), "local")
+
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("formagent_span", default=None)
+
+
+def _attr_value(v: Any) -> Dict[str, Any]:
+    if isinstance(v, bool):
+        return {"boolValue": v}
+    if isinstance(v, int):
+        return {"intValue": str(v)}  # OTLP/JSON encodes 64-bit ints as strings
+    if isinstance(v, float):
+        return {"doubleValue": v}
+    if isinstance(v, (list, tuple)):
+        return {"arrayValue": {"values": [_attr_value(x) for x in v]}}
+    return {"stringValue": str(v)}
+
+
+def to_otlp(spans: Sequence[Span]) -> Dict[str, Any]:
+    """OTLP/JSON ExportTraceServiceRequest, importable by OpenTelemetry collectors and Jaeger."""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{
+                "scope": {"name": "formagent.tracing"},
+                "spans": [
+                    {
+                        "traceId": s.trace_id,
+                        "spanId": s.span_id,
+                        "parentSpanId": s.parent_id,
+                        "name": s.name,
+                        "kind": 1,  # SPAN_KIND_INTERNAL
+                        "startTimeUnixNano": str(s.start_ns),
+                        "endTimeUnixNano": str(s.end_ns),
+                        "attributes": [{"key": k, "value": _attr_value(v)} for k, v in s.attributes.items()],
+                        "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+                    }
+                    for s in spans
+                ],
+            }],
+        }]
+    }
+
+
+class Tracer:
+    """Keeps the most recent finished spans in memory (thread-safe) and optionally appends traces to a file."""
+
+    def __init__(self, max_spans: int = 20000, export_path: str = "", enabled: bool = True):
+        self.enabled = enabled
+        self.export_path = export_path
+        self._spans: Deque[Span] = deque(maxlen=max_spans)
+        self._open: Dict[str, List[Span]] = {}  # trace_id -> finished spans awaiting the root, for file export
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "Tracer":
+        return cls(export_path=os.getenv("FORMAGENT_TRACE_FILE", ""), enabled=os.getenv("FORMAGENT_TRACE", "1") != "0")
+
+    # ---- recording ----
+    def start_span(self, name: str, parent: Optional[Span] = None, root: bool = False, **attributes: Any) -> Span:
+        """Begin a span under `parent` (default: the current span; none if `root`) without making it current."""
+        if parent is None and not root:
+            parent = _current.get()
+        return Span(
+            name=name,
+            trace_id=parent.trace_id if parent is not None else secrets.token_hex(16),
+            span_id=secrets.token_hex(8),
+            parent_id=parent.span_id if parent is not None else "",
+            start_ns=time.time_ns(),
+            attributes=attributes,
+        )
+
+    def end_span(self, span: Span, error: str = "") -> None:
+        if span.end_ns:
+            return
+        span.end_ns = time.time_ns()
+        span.error = span.error or error
+        if not self.enabled:
+            return
+        with self._lock:
+            self._spans.append(span)
+            if not self.export_path:
+                return
+            if span.parent_id:
+                if span.trace_id not in self._open and len(self._open) >= 256:  # roots that never ended
+                    self._open.pop(next(iter(self._open)))
+                self._open.setdefault(span.trace_id, []).append(span)
+                return
+            batch = self._open.pop(span.trace_id, []) + [span]
+        self._write(batch)
+
+    def _write(self, spans: List[Span]) -> None:
+        try:
+            with open(self.export_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(to_otlp(spans), ensure_ascii=False) + "\n")
+        except OSError:
+            pass  # tracing must never break a run
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+        """Child of the current span, current for the duration of the block."""
+        s = self.start_span(name, **attributes)
+        token = _current.set(s)
+        try:
+            yield s
+        except Exception as e:  # control-flow exceptions (BaseException) are not errors
+            s.error = f"{type(e).__name__}: {e}"[:500]
+            raise
+        finally:
+            _current.reset(token)
+            self.end_span(s)
+
+    # ---- reading ----
+    def spans(self, trace_id: str) -> List[Span]:
+        with self._lock:
+            found = [s for s in self._spans if s.trace_id == trace_id]
+        return sorted(found, key=lambda s: s.start_ns)
+
+    def roots(self, limit: int = 50, **match: Any) -> List[Span]:
+        """Most recent finished root spans (newest first) whose attributes include `match`."""
+        with self._lock:
+            roots = [s for s in self._spans if not s.parent_id and all(s.attributes.get(k) == v for k, v in match.items())]
+        return roots[::-1][:limit]
+
+
+TRACER = Tracer.from_env()
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def span(name: str, **attributes: Any):
+    return TRACER.span(name, **attributes)
+
+
+def start_span(name: str, parent: Optional[Span] = None, root: bool = False, **attributes: Any) -> Span:
+    return TRACER.start_span(name, parent, root, **attributes)
+
+
+def end_span(s: Span, error: str = "") -> None:
+    TRACER.end_span(s, error)
+
+
+def activate(s: Span) -> contextvars.Token:
+    """Make `s` current until `deactivate(token)` (for spans that outlive one block, e.g. a script run)."""
+    return _current.set(s)
+
+
+def deactivate(token: contextvars.Token) -> None:
+    try:
+        _current.reset(token)
+    except ValueError:  # token from another context (e.g. a different script thread)
+        _current.set(None)
+
+
+def bind(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """Run `fn` in a copy of the caller's context, so spans opened in a worker thread nest correctly."""
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
+
+
+# =========================
+# Timeline helpers
+# =========================
+def depth(spans: Sequence[Span]) -> Dict[str, int]:
+    by_id = {s.span_id: s for s in spans}
+    out: Dict[str, int] = {}
+    for s in spans:
+        d, p = 0, s.parent_id
+        while p in by_id and d < 50:
+            d, p = d + 1, by_id[p].parent_id
+        out[s.span_id] = d
+    return out
+
+
+def _union(intervals: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    merged: List[Tuple[int, int]] = []
+    for a, b in sorted(intervals):
+        if merged and a <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], b))
+        else:
+            merged.append((a, b))
+    return merged
+
+
+def _uncovered_ns(intervals: List[Tuple[int, int]], covered: List[Tuple[int, int]]) -> int:
+    """Total length of `intervals` outside `covered` (both sorted, non-overlapping)."""
+    total = 0
+    for a, b in intervals:
+        cut = a
+        for c0, c1 in covered:
+            if c1 <= cut or c0 >= b:
+                continue
+            total += max(0, c0 - cut)
+            cut = max(cut, c1)
+        total += max(0, b - cut)
+    return total
+
+
+def breakdown(spans: Sequence[Span]) -> Dict[str, float]:
+    """
+    Wall-clock ms per category across a trace. Concurrent spans of one category count
+    once; where categories overlap, provider beats queue beats ui, and whatever no
+    category covers is local (our own code). Agent steps run inside a UI section, so
+    their own time counts as local rather than ui.
+    """
+    if not spans:
+        return {}
+    out: Dict[str, float] = {}
+    covered: List[Tuple[int, int]] = []
+    for category in ("provider", "queue", "ui"):
+        if category == "ui":
+            covered = _union(covered + [(s.start_ns, s.end_ns) for s in spans if s.name.startswith("agent.") and s.end_ns])
+        own = _union([(s.start_ns, s.end_ns) for s in spans if s.category == category and s.end_ns])
+        out[category] = _uncovered_ns(own, covered) / 1e6
+        covered = _union(covered + own)
+    start = min(s.start_ns for s in spans)
+    end = max(s.end_ns or s.start_ns for s in spans)
+    out["local"] = max(0.0, (end - start) / 1e6 - sum(out.values()))
+    return out
@@ -0,0 +1,266 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from formagent.chunking import context_window, estimate_tokens
+from formagent.providers import ChatResult, provider_for_model
+from formagent.registry import AgentSpec
+from formagent.run_store import StepRecord
+
+
+# USD per 1M tokens (input, output) by model-name prefix; longest matching prefix wins.
+# List prices at the time of writing — update here when providers change them.
+PRICES: Tuple[Tuple[str, float, float], ...] = (
+    ("gpt-4o-mini", 0.15, 0.60),
+    ("gpt-4o", 2.50, 10.00),
+    ("gpt-4.1-nano", 0.10, 0.40),
+    ("gpt-4.1-mini", 0.40, 1.60),
+    ("gpt-4.1", 2.00, 8.00),
+    ("gpt-5-nano", 0.05, 0.40),
+    ("gpt-5-mini", 0.25, 2.00),
+    ("gpt-5", 1.25, 10.00),
+    ("gemini-2.5-flash-lite", 0.10, 0.40),
+    ("gemini-2.5-flash", 0.30, 2.50),
+    ("gemini-2.5-pro", 1.25, 10.00),
+    ("gemini-3-flash", 0.50, 3.00),
+    ("claude-haiku-4", 1.00, 5.00),
+    ("claude-sonnet-4", 3.00, 15.00),
+    ("grok-4-fast", 0.20, 0.50),
+    ("grok-4", 3.00, 15.00),
+    ("grok-3-mini", 0.30, 0.50),
+)
+
+
+# Prompt-cache pricing as a fraction of the input price: (read, write) by model-name prefix,
+# longest match wins. Models not listed are billed cached tokens at the full input price.
+CACHE_RATES: Tuple[Tuple[str, float, float], ...] = (
+    ("gpt-4o", 0.50, 1.0),
+    ("gpt-4.1", 0.25, 1.0),
+    ("gpt-5", 0.10, 1.0),
+    ("gemini-2.5", 0.25, 1.0),
+    ("gemini-3", 0.10, 1.0),
+    ("claude", 0.10, 1.25),
+    ("grok", 0.25, 1.0),
+)
+
+
+def _longest_prefix(model: str, rows: Sequence[Tuple]) -> Optional[Tuple]:
+    name = model.lower()
+    best: Optional[Tuple] = None
+    for row in rows:
+        if name.startswith(row[0]) and (best is None or len(row[0]) > len(best[0])):
+            best = row
+    return best
+
+
+def price_for(model: str) -> Optional[Tuple[float, float]]:
+    """(input, output) USD per 1M tokens, or None for models without a known price."""
+    best = _longest_prefix(model, PRICES)
+    return (best[1], best[2]) if best else None
+
+
+def cost_usd(model: str, input_tokens: int, output_tokens: int, cache_read_tokens: int = 0,
+             cache_write_tokens: int = 0) -> Optional[float]:
+    """`input_tokens` includes the prompt-cache reads and writes, which are billed at CACHE_RATES."""
+    price = price_for(model)
+    if price is None:
+        return None
+    rates = _longest_prefix(model, CACHE_RATES)
+    read, write = (rates[1], rates[2]) if rates else (1.0, 1.0)
+    plain = max(0, input_tokens - cache_read_tokens - cache_write_tokens)
+    billed_input = plain + cache_read_tokens * read + cache_write_tokens * write
+    return (billed_input * price[0] + output_tokens * price[1]) / 1_000_000
+
+
+TOKEN_COUNT_CACHE = 1024
+_token_counts: "OrderedDict[bytes, int]" = OrderedDict()  # content digest -> count; never holds the text
+_token_counts_lock = threading.Lock()
+
+
+def count_tokens(text: str) -> int:
+    """
+    CJK-aware token estimate, memoized: agent prompts are re-counted on every rerun. The
+    memo is keyed on a digest of the text, so counted PDFs and prompts are not kept alive.
+    """
+    if len(text) < 256:
+        return estimate_tokens(text)
+    key = hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    with _token_counts_lock:
+        n = _token_counts.get(key)
+        if n is not None:
+            _token_counts.move_to_end(key)
+            return n
+    n = estimate_tokens(text)
+    with _token_counts_lock:
+        _token_counts[key] = n
+        while len(_token_counts) > TOKEN_COUNT_CACHE:
+            _token_counts.popitem(last=False)
+    return n
+
+
+# =========================
+# Pre-run estimates
+# =========================
+@dataclass(frozen=True)
+class PromptEstimate:
+    model: str
+    input_tokens: int
+    max_output_tokens: int
+    fits: bool  # prompt + reserved output within the model's context window
+    max_cost_usd: Optional[float]  # worst case: the whole max_tokens budget is generated
+
+
+def estimate_request(model: str, system_prompt: str, user_prompt: str, max_tokens: int,
+                     extra_input_tokens: int = 0) -> PromptEstimate:
+    """`extra_input_tokens` covers text substituted later (e.g. an ingested PDF counted at upload)."""
+    input_tokens = count_tokens(system_prompt) + count_tokens(user_prompt) + extra_input_tokens
+    return PromptEstimate(
+        model=model,
+        input_tokens=input_tokens,
+        max_output_tokens=max_tokens,
+        fits=input_tokens + max_tokens <= context_window(model),
+        max_cost_usd=cost_usd(model, input_tokens, max_tokens),
+    )
+
+
+def estimate_agent(spec: AgentSpec, values: Mapping[str, str], model: Optional[str] = None,
+                   max_tokens: Optional[int] = None) -> PromptEstimate:
+    """Estimate for the agent's rendered system prompt + user template."""
+    return estimate_request(model or spec.model, spec.system_prompt, spec.render(values),
+                            max_tokens or spec.max_tokens)
+
+
+def cheapest_models(system_prompt: str, user_prompt: str, max_tokens: int, models: Iterable[str],
+                    extra_input_tokens: int = 0) -> List[PromptEstimate]:
+    """Priced models whose context fits the request, cheapest worst case first."""
+    estimates = [estimate_request(m, system_prompt, user_prompt, max_tokens, extra_input_tokens) for m in models]
+    return sorted((e for e in estimates if e.fits and e.max_cost_usd is not None), key=lambda e: e.max_cost_usd)
+
+
+# =========================
+# Actual usage ledger
+# =========================
+@dataclass(frozen=True)
+class UsageRow:
+    step: int
+    agent_id: str
+    model: str
+    provider: str
+    input_tokens: int
+    output_tokens: int
+    estimated: bool  # provider did not report usage; counted locally
+    cached: bool  # served from the response cache, no spend
+    cache_read_tokens: int = 0  # input tokens the provider served from its prompt cache
+    cache_write_tokens: int = 0
+
+    @property
+    def cost_usd(self) -> Optional[float]:
+        if self.cached:
+            return 0.0
+        return cost_usd(self.model, self.input_tokens, self.output_tokens, self.cache_read_tokens, self.cache_write_tokens)
+
+    @property
+    def cache_saved_usd(self) -> float:
+        """What provider prompt caching saved on this call (negative while only paying cache writes)."""
+        full = cost_usd(self.model, self.input_tokens, self.output_tokens)
+        actual = self.cost_usd
+        return 0.0 if self.cached or full is None or actual is None else full - actual
+
+
+GROUP_KEYS = ("step", "agent_id", "model", "provider")
+
+
+class UsageLedger:
+    """Thread-safe list of per-call usage; aggregates into cost tables by step/agent/model/provider."""
+
+    def __init__(self) -> None:
+        self._rows: List[UsageRow] = []
+        self._lock = threading.Lock()
+
+    def record(self, step: int, agent_id: str, result: ChatResult, prompt: str = "") -> UsageRow:
+        estimated = result.input_tokens is None or result.output_tokens is None
+        row = UsageRow(
+            step=step,
+            agent_id=agent_id,
+            model=result.model,
+            provider=result.provider,
+            input_tokens=result.input_tokens if result.input_tokens is not None else count_tokens(prompt),
+            output_tokens=result.output_tokens if result.output_tokens is not None else count_tokens(result.text),
+            estimated=estimated,
+            cached=result.cached,
+            cache_read_tokens=result.cache_read_tokens or 0,
+            cache_write_tokens=result.cache_write_tokens or 0,
+        )
+        self.add(row)
+        return row
+
+    def add(self, row: UsageRow) -> None:
+        with self._lock:
+            self._rows.append(row)
+
+    def rows(self) -> List[UsageRow]:
+        with self._lock:
+            return list(self._rows)
+
+    def table(self, by: Sequence[str] = ("model",)) -> List[Dict[str, object]]:
+        """One dict per group: keys, calls, tokens, cost (None if any row in the group is unpriced)."""
+        groups: Dict[Tuple, Dict[str, object]] = {}
+        for r in self.rows():
+            key = tuple(getattr(r, k) for k in by)
+            g = groups.setdefault(key, {**dict(zip(by, key)), "calls": 0, "cached": 0, "input_tokens": 0,
+                                        "cache_read_tokens": 0, "output_tokens": 0, "cost_usd": 0.0,
+                                        "cache_saved_usd": 0.0, "estimated": False})
+            g["calls"] += 1
+            g["cached"] += int(r.cached)
+            g["input_tokens"] += r.input_tokens
+            g["cache_read_tokens"] += r.cache_read_tokens
+            g["cache_saved_usd"] += r.cache_saved_usd
+            g["output_tokens"] += r.output_tokens
+            g["estimated"] = g["estimated"] or r.estimated
+            cost = r.cost_usd
+            g["cost_usd"] = None if cost is None or g["cost_usd"] is None else g["cost_usd"] + cost
+        return list(groups.values())
+
+    def total_cost(self) -> float:
+        return sum(r.cost_usd or 0.0 for r in self.rows())
+
+    def cache_saved_usd(self) -> float:
+        return sum(r.cache_saved_usd for r in self.rows())
+
+
+def _provider_or_unknown(model: str) -> str:
+    try:
+        return provider_for_model(model)
+    except ValueError:  # model names from older configs or typed by hand
+        return "unknown"
+
+
+def ledger_from_steps(steps: Iterable[StepRecord], texts: Optional[Callable[[str], str]] = None) -> UsageLedger:
+    """
+    Rebuild a ledger from RunStore StepRecords. Steps without reported usage are
+    counted locally when `texts` (hash -> body, e.g. RunStore.text) is given.
+    """
+    ledger = UsageLedger()
+    for s in steps:
+        if s.status != "completed":
+            continue
+        estimated = s.input_tokens is None or s.output_tokens is None
+        input_tokens, output_tokens = s.input_tokens or 0, s.output_tokens or 0
+        if estimated and texts is not None:
+            input_tokens = s.input_tokens if s.input_tokens is not None else count_tokens(texts(s.prompt_hash))
+            output_tokens = s.output_tokens if s.output_tokens is not None else count_tokens(texts(s.output_hash))
+        ledger.add(UsageRow(
+            step=s.step_index,
+            agent_id=s.agent_id,
+            model=s.model,
+            provider=_provider_or_unknown(s.model),
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            estimated=estimated,
+            cached=s.cached,
+            cache_read_tokens=s.cache_read_tokens or 0,
+            cache_write_tokens=s.cache_write_tokens or 0,
+        ))
+    return ledger
@@ -0,0 +1,246 @@
+import re
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from formagent.registry import AgentRegistry, AgentSpec
+from formagent.textmatch import KeywordAutomaton
+from formagent.tracing import span
+
+
+HEADING_LINE_RE = re.compile(r"^\s{0,3}(#{1,6})\s+(.*?)\s*#*\s*$")
+TABLE_SEP_RE = re.compile(r"^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?\s*$")
+LIST_ITEM_RE = re.compile(r"^\s*(?:[-*+]|\d+[.)])\s+\S")
+SPAN_RE = re.compile(r"<span\b", re.IGNORECASE)
+
+# Count-style rules (min_items, min_entities, min_tests, ...) count table body rows
+# plus list items; these count something else.
+COUNT_UNITS: Dict[str, str] = {"min_highlighted_terms": "spans"}
+# Give up on an output that needs Markdown structure but shows none this far in.
+EARLY_STRUCTURE_CHARS = 3000
+
+
+@dataclass(frozen=True)
+class RuleResult:
+    rule: str
+    ok: bool
+    detail: str = ""
+
+
+@dataclass(frozen=True)
+class CompiledRules:
+    """One agent's output_requirements + validation_rules, compiled once per agents.yaml version."""
+
+    agent_id: str
+    min_sections: int = 0
+    tables: Tuple[str, ...] = ()
+    headings: Tuple[str, ...] = ()
+    keywords: Optional[KeywordAutomaton] = None
+    max_chars: int = 0
+    counts: Tuple[Tuple[str, int, str], ...] = ()  # (rule, minimum, unit)
+
+    @property
+    def empty(self) -> bool:
+        return not (self.min_sections or self.tables or self.headings or self.keywords or self.max_chars or self.counts)
+
+    @property
+    def needs_structure(self) -> bool:
+        return bool(self.min_sections or self.tables or self.headings)
+
+    def checker(self) -> "StreamChecker":
+        return StreamChecker(self)
+
+
+def _compile(spec: AgentSpec) -> CompiledRules:
+    req, rules = spec.output_requirements, spec.validation_rules
+    keywords = tuple(str(k) for k in rules.get("require_keywords") or ())
+    counts = tuple(
+        (name, int(value), COUNT_UNITS.get(name, "items"))
+        for name, value in rules.items()
+        if name.startswith("min_") and isinstance(value, (int, float)) and not isinstance(value, bool)
+    )
+    return CompiledRules(
+        agent_id=spec.agent_id,
+        min_sections=int(req.get("min_sections") or 0),
+        tables=tuple(str(t) for t in req.get("require_tables") or ()),
+        headings=tuple(str(h) for h in rules.get("require_headings") or ()),
+        keywords=KeywordAutomaton(keywords) if keywords else None,
+        max_chars=int(rules.get("max_length_chars") or 0),
+        counts=counts,
+    )
+
+
+_compiled: Dict[str, Tuple[AgentSpec, CompiledRules]] = {}
+_compiled_lock = threading.Lock()
+
+
+def compile_rules(spec: AgentSpec) -> CompiledRules:
+    """Compiled rules for `spec`, reused until the registry hands out a new spec object."""
+    hit = _compiled.get(spec.agent_id)
+    if hit is not None and hit[0] is spec:
+        return hit[1]
+    compiled = _compile(spec)
+    with _compiled_lock:
+        _compiled[spec.agent_id] = (spec, compiled)
+    return compiled
+
+
+# =========================
+# Incremental checker (feed deltas as they stream in; O(delta) per feed)
+# =========================
+class StreamChecker:
+    def __init__(self, rules: CompiledRules):
+        self.rules = rules
+        self.chars = 0
+        self.sections = 0
+        self.items = 0
+        self.spans = 0
+        self.tables_seen = 0
+        self._tail = ""
+        self._kw_state = 0
+        self._kw_found = set()
+        self._headings_found = set()
+        self._tables_found = set()
+        self._heading = ""  # current section heading text
+        self._caption = ""  # last plain text line (tables are often titled by a bold line)
+        self._prev = ""  # previous non-blank line (a table's header row)
+        self._in_table = False
+
+    def feed(self, delta: str) -> Optional[str]:
+        """Consume a streamed delta. Returns a reason when the output is already a lost cause."""
+        if self.rules.keywords is not None:
+            self._kw_state, hits = self.rules.keywords.scan(delta, self._kw_state)
+            self._kw_found.update(k for _, k in hits)
+        self.chars += len(delta)
+        *lines, self._tail = (self._tail + delta).split("\n")
+        for line in lines:
+            self._line(line)
+        if self.rules.max_chars and self.chars > self.rules.max_chars:
+            return f"output exceeds max_length_chars ({self.chars} > {self.rules.max_chars})"
+        if self.rules.needs_structure and self.chars > EARLY_STRUCTURE_CHARS and not (self.sections or self.tables_seen):
+            return f"no Markdown headings or tables in the first {EARLY_STRUCTURE_CHARS} characters"
+        return None
+
+    def _line(self, line: str) -> None:
+        stripped = line.strip()
+        if not stripped:
+            return
+        m = HEADING_LINE_RE.match(line)
+        if m:
+            self._in_table = False
+            self.sections += 1
+            self._heading = m.group(2)
+            self._caption = ""
+            self._headings_found.update(h for h in self.rules.headings if h in self._heading)
+        elif TABLE_SEP_RE.match(line) and "|" in self._prev:
+            self._in_table = True
+            self.tables_seen += 1
+            title = f"{self._heading}\n{self._caption}"
+            self._tables_found.update(t for t in self.rules.tables if t in title)
+        elif self._in_table and stripped.startswith("|"):
+            self.items += 1
+        else:
+            self._in_table = False
+            if LIST_ITEM_RE.match(line):
+                self.items += 1
+            elif not stripped.startswith("|"):
+                self._caption = stripped
+        self.spans += len(SPAN_RE.findall(line))
+        self._prev = stripped
+
+    def finish(self) -> List[RuleResult]:
+        if self._tail:
+            self._line(self._tail)
+            self._tail = ""
+        r = self.rules
+        out: List[RuleResult] = []
+        if r.min_sections:
+            out.append(RuleResult("min_sections", self.sections >= r.min_sections, f"{self.sections}/{r.min_sections} sections"))
+        for t in r.tables:
+            out.append(RuleResult(f"require_tables:{t}", t in self._tables_found, "" if t in self._tables_found else f"missing table 「{t}」"))
+        for h in r.headings:
+            out.append(RuleResult(f"require_headings:{h}", h in self._headings_found, "" if h in self._headings_found else f"missing heading 「{h}」"))
+        if r.keywords is not None:
+            for i, k in enumerate(r.keywords.keywords):
+                out.append(RuleResult(f"require_keywords:{k}", i in self._kw_found, "" if i in self._kw_found else f"missing keyword 「{k}」"))
+        if r.max_chars:
+            out.append(RuleResult("max_length_chars", self.chars <= r.max_chars, f"{self.chars}/{r.max_chars} chars"))
+        for name, minimum, unit in r.counts:
+            have = self.spans if unit == "spans" else self.items
+            out.append(RuleResult(name, have >= minimum, f"{have}/{minimum} {unit}"))
+        return out
+
+
+def check_text(rules: CompiledRules, text: str) -> List[RuleResult]:
+    checker = rules.checker()
+    checker.feed(text)
+    return checker.finish()
+
+
+def failures(results: List[RuleResult]) -> List[RuleResult]:
+    return [r for r in results if not r.ok]
+
+
+# =========================
+# Pass-rate stats
+# =========================
+class ValidationStats:
+    """Per agent/rule pass counts across every validated output (thread-safe)."""
+
+    def __init__(self) -> None:
+        self._counts: Dict[Tuple[str, str], List[int]] = {}
+        self._aborts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, agent_id: str, results: List[RuleResult]) -> None:
+        with self._lock:
+            for r in results:
+                c = self._counts.setdefault((agent_id, r.rule), [0, 0])
+                c[0] += int(r.ok)
+                c[1] += 1
+
+    def record_abort(self, agent_id: str) -> None:
+        with self._lock:
+            self._aborts[agent_id] = self._aborts.get(agent_id, 0) + 1
+
+    def pass_rates(self) -> List[Dict[str, object]]:
+        with self._lock:
+            return [
+                {"agent_id": a, "rule": rule, "passed": p, "checked": n, "pass_rate": round(p / n, 3),
+                 "early_aborts": self._aborts.get(a, 0)}
+                for (a, rule), (p, n) in sorted(self._counts.items())
+            ]
+
+
+class Validator:
+    """
+    Checks step outputs against the registry's rules and records pass rates.
+    Chunk ids ("agent#0003") and agents without rules are never checked.
+    """
+
+    def __init__(self, registry: AgentRegistry, stats: Optional[ValidationStats] = None, max_retries: int = 1):
+        self.registry = registry
+        self.stats = stats or ValidationStats()
+        self.max_retries = max_retries
+
+    def rules(self, agent_id: str) -> Optional[CompiledRules]:
+        if agent_id not in self.registry:
+            return None
+        compiled = compile_rules(self.registry.get(agent_id))
+        return None if compiled.empty else compiled
+
+    def check(self, agent_id: str, text: str) -> List[RuleResult]:
+        rules = self.rules(agent_id)
+        if rules is None:
+            return []
+        with span("validate", agent_id=agent_id) as traced:
+            results = check_text(rules, text)
+            traced.set(failed=sum(not r.ok for r in results))
+        self.stats.record(agent_id, results)
+        return results
+
+
+def retry_feedback(failed: List[RuleResult]) -> str:
+    """Appended to the user prompt when an output is regenerated after failing validation."""
+    missing = "；".join(r.detail or r.rule for r in failed)
+    return f"\n\n【格式檢查未通過】上一次輸出未符合：{missing}。請完整重新輸出，並符合所有輸出要求。"